@@ -22,7 +22,6 @@ if __name__ == "__main__":
 import os
 import sys
 import select
-import shutil
 import commands
 import subprocess
 from pylons import config
@@ -30,6 +29,7 @@ from webob.exc import HTTPNotFound
 from mediacore.model.meta import DBSession
 from mediacore.model import *
 from mediacore.lib import helpers
+from mediacore.lib.storage import LocalStorage
 from mediacore.lib.thumbnails import thumb_paths
 
 database = 'mediacore'
@@ -215,7 +215,8 @@ def restore_necessary_files():
         if os.path.exists(src):
             if DEBUG:
                 print "Moving %s to %s" % (src, dest)
-            shutil.move(src, dest)
+            storage = LocalStorage(os.path.dirname(dest))
+            storage.store_path(src, os.path.basename(dest), move=True)
 
 def main(parser, options):
     if options.dump_to:
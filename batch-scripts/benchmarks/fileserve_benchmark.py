@@ -0,0 +1,159 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "File Serving Benchmark"
+_script_description = """
+Compare the download throughput of paste's FileApp, our FileServer and an
+nginx X-Accel-Redirect response, each behind a paste httpserver with a
+fixed number of worker threads. Half of the downloads seek to a random
+offset with a Range header, like a video player does.
+
+The X-Accel-Redirect response is measured without nginx in front of it, so
+its throughput is only the rate at which a worker can hand off downloads;
+the time each worker is held per download is what to compare.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-c', '--clients', dest='clients', type='int', default=16, help='Number of concurrent downloads. Default: 16')
+    cmd.parser.add_option('-w', '--workers', dest='workers', type='int', default=4, help='Number of server worker threads. Default: 4')
+    cmd.parser.add_option('-n', '--downloads', dest='downloads', type='int', default=64, help='Number of downloads per method. Default: 64')
+    cmd.parser.add_option('-s', '--size', dest='size', type='int', default=20, help='Size of the test file in MB. Default: 20')
+    cmd.parser.add_option('--debug', action='store_true', dest='debug', help='Write debug output to STDOUT.', default=False)
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib2
+
+import paste.httpserver
+from paste.fileapp import FileApp
+from pylons import config
+
+from mediacore.lib.fileserve import FileServer, x_accel_path
+
+CONTENT_TYPE = 'video/mp4'
+
+def make_file(size):
+    fd, path = tempfile.mkstemp(suffix='.mp4', dir=config['media_dir'])
+    f = os.fdopen(fd, 'wb')
+    try:
+        block = os.urandom(1024 * 1024)
+        for x in xrange(size):
+            f.write(block)
+    finally:
+        f.close()
+    return path
+
+def make_apps(path):
+    def fileapp(environ, start_response):
+        return FileApp(path, content_type=CONTENT_TYPE)(environ, start_response)
+    def fileserver(environ, start_response):
+        return FileServer(path, CONTENT_TYPE)(environ, start_response)
+    def accel(environ, start_response):
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE),
+                                  ('X-Accel-Redirect', x_accel_path(path)),
+                                  ('Content-Length', '0')])
+        return ['']
+    return [('fileapp', fileapp), ('fileserver', fileserver),
+            ('x-accel', accel)]
+
+def timed(app, held, lock):
+    """Record how long each request holds a worker thread."""
+    def timed_app(environ, start_response):
+        start = time.time()
+        body = app(environ, start_response)
+        try:
+            for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            lock.acquire()
+            held.append(time.time() - start)
+            lock.release()
+    return timed_app
+
+def download(url, size, results, lock):
+    request = urllib2.Request(url)
+    if random.random() < 0.5:
+        request.add_header('Range', 'bytes=%d-' % random.randint(0, size - 1))
+    response = urllib2.urlopen(request)
+    received = 0
+    while True:
+        chunk = response.read(64 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+    response.close()
+    lock.acquire()
+    results.append((response.code, received))
+    lock.release()
+
+def run(app, options, size):
+    held = []
+    lock = threading.Lock()
+    server = paste.httpserver.serve(timed(app, held, lock),
+        host='127.0.0.1', port='0', start_loop=False,
+        use_threadpool=True, threadpool_workers=options.workers)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = 'http://127.0.0.1:%d/' % server.server_address[1]
+
+    results = []
+    queue = range(options.downloads)
+    def client():
+        while True:
+            lock.acquire()
+            try:
+                if not queue:
+                    return
+                queue.pop()
+            finally:
+                lock.release()
+            download(url, size, results, lock)
+
+    start = time.time()
+    clients = [threading.Thread(target=client)
+               for x in xrange(options.clients)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.time() - start
+    server.server_close()
+    return elapsed, results, held
+
+def main(parser, options, args):
+    path = make_file(options.size)
+    size = options.size * 1024 * 1024
+    try:
+        print '%d downloads of a %d MB file, %d clients, %d workers' \
+            % (options.downloads, options.size, options.clients, options.workers)
+        for name, app in make_apps(path):
+            elapsed, results, held = run(app, options, size)
+            received = sum(r for status, r in results)
+            print '%-10s %7.1f MB/s %7.1f MB/s/worker %8.1f ms held/download' % (
+                name,
+                received / elapsed / 1024 / 1024,
+                received / elapsed / 1024 / 1024 / options.workers,
+                1000 * sum(held) / max(len(held), 1),
+            )
+            if DEBUG:
+                statuses = {}
+                for status, r in results:
+                    statuses[status] = statuses.get(status, 0) + 1
+                print '    %r' % statuses
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
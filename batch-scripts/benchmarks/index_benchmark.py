@@ -0,0 +1,208 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Media Index Benchmark"
+_script_description = """
+Compare the public listing and admin dashboard queries with and without
+the composite indexes on the media table. A synthetic library is seeded
+into a scratch database, the queries are run and EXPLAINed without the
+indexes, then the indexes are created and the queries are run again.
+
+The scratch database is a temporary SQLite file unless --url is given.
+It must be empty, as the media and podcasts tables are created and
+dropped in it, so never point it at your MediaCore database.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-u', '--url', dest='url', default=None, help='SQLAlchemy URL of an empty scratch database. Default: a temporary SQLite file')
+    cmd.parser.add_option('-n', '--media', dest='media', type='int', default=100000, help='Number of media to seed. Default: 100000')
+    cmd.parser.add_option('-p', '--podcasts', dest='podcasts', type='int', default=20, help='Number of podcasts to seed. Default: 20')
+    cmd.parser.add_option('-r', '--repeat', dest='repeat', type='int', default=20, help='Number of times to run each query. Default: 20')
+    cmd.parser.add_option('--debug', action='store_true', dest='debug', help='Write debug output to STDOUT.', default=False)
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Index, MetaData, create_engine, sql
+
+from mediacore.model import Media
+from mediacore.model.media import media
+from mediacore.model.podcasts import podcasts
+
+def make_tables(engine):
+    """Create empty copies of the podcasts and media tables."""
+    metadata = MetaData()
+    bench_podcasts = podcasts.tometadata(metadata)
+    bench_media = media.tometadata(metadata)
+    existing = dict((index.name, index) for index in bench_media.indexes)
+    indexes = []
+    for index in media.indexes:
+        if index.name in existing:
+            indexes.append(existing[index.name])
+        else:
+            indexes.append(Index(index.name,
+                *[bench_media.c[col.name] for col in index.columns]))
+    metadata.create_all(bind=engine, tables=[bench_podcasts, bench_media])
+    return metadata, bench_podcasts, bench_media, indexes
+
+def seed(engine, bench_podcasts, bench_media, count, podcast_count):
+    """Insert a library which is mostly published, with some drafts,
+    unreviewed or unencoded media, and some scheduled or expired."""
+    engine.execute(bench_podcasts.insert(), [
+        {'id': i, 'slug': u'podcast-%d' % i, 'title': u'Podcast %d' % i,
+         'author_name': u'Author', 'author_email': u'author@example.com',
+         'created_on': datetime.now(), 'modified_on': datetime.now()}
+        for i in xrange(1, podcast_count + 1)])
+
+    now = datetime.now()
+    rows = []
+    for i in xrange(1, count + 1):
+        reviewed = random.random() < 0.95
+        encoded = reviewed and random.random() < 0.95
+        publishable = encoded and random.random() < 0.95
+        publish_on = now - timedelta(minutes=random.randint(-10000, 2000000))
+        publish_until = None
+        if random.random() < 0.05:
+            publish_until = publish_on + timedelta(days=random.randint(1, 365))
+        is_live = publishable and publish_on <= now \
+            and (publish_until is None or publish_until >= now)
+        rows.append({
+            'id': i,
+            'slug': u'media-%d' % i,
+            'title': u'Media %d' % i,
+            'podcast_id': random.random() < 0.3 \
+                and random.randint(1, podcast_count) or None,
+            'reviewed': reviewed,
+            'encoded': encoded,
+            'publishable': publishable,
+            'is_live': is_live,
+            'created_on': publish_on,
+            'modified_on': now - timedelta(minutes=random.randint(0, 2000000)),
+            'publish_on': publish_on,
+            'publish_until': publish_until,
+            'popularity_points': is_live and random.randint(0, 50000) or 0,
+            'author_name': u'Author',
+            'author_email': u'author@example.com',
+        })
+        if len(rows) == 1000:
+            engine.execute(bench_media.insert(), rows)
+            rows = []
+    if rows:
+        engine.execute(bench_media.insert(), rows)
+
+def listing_queries(podcast_id):
+    """The queries to compare, as built by the controllers."""
+    published = Media.query.published()
+    return [
+        ('latest', published.order_by(Media.publish_on.desc()).limit(20)),
+        ('popular', published.order_by(Media.popularity_points.desc()).limit(20)),
+        ('podcast', published.filter(Media.podcast_id == podcast_id)\
+            .order_by(Media.publish_on.desc()).limit(20)),
+        ('published count', published.statement\
+            .with_only_columns([sql.func.count(media.c.id)])),
+        ('awaiting review', Media.query.filter_by(reviewed=False)\
+            .order_by(Media.modified_on.desc()).limit(6)),
+        ('awaiting encoding', Media.query.filter_by(reviewed=True, encoded=False)\
+            .order_by(Media.modified_on.desc()).limit(6)),
+        ('awaiting publishing', Media.query\
+            .filter_by(reviewed=True, encoded=True, publishable=False)\
+            .order_by(Media.modified_on.desc()).limit(6)),
+        ('admin list', Media.query.order_by_status()\
+            .order_by(Media.publish_on.desc(), Media.modified_on.desc())\
+            .limit(25)),
+    ]
+
+def compile_query(engine, query):
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(bind=engine)
+    params = tuple([compiled.params[name] for name in compiled.positiontup])
+    return str(compiled), params
+
+def explain(engine, query):
+    statement, params = compile_query(engine, query)
+    if engine.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    return [' | '.join([str(value) for value in row])
+            for row in engine.execute(prefix + statement, params)]
+
+def time_query(engine, query, repeat):
+    statement, params = compile_query(engine, query)
+    start = time.time()
+    for x in xrange(repeat):
+        engine.execute(statement, params).fetchall()
+    return (time.time() - start) * 1000 / repeat
+
+def analyze(engine, bench_media):
+    if engine.dialect.name == 'mysql':
+        engine.execute('ANALYZE TABLE %s' % bench_media.name)
+    elif engine.dialect.name in ('sqlite', 'postgresql'):
+        engine.execute('ANALYZE')
+
+def run(engine, queries, repeat):
+    results = []
+    for name, query in queries:
+        elapsed = time_query(engine, query, repeat)
+        results.append(elapsed)
+        print '%-20s %9.2f ms/query' % (name, elapsed)
+        for line in explain(engine, query):
+            print '    %s' % line
+    return results
+
+def main(parser, options, args):
+    scratch_dir = None
+    url = options.url
+    if url is None:
+        scratch_dir = tempfile.mkdtemp()
+        url = 'sqlite:///%s' % os.path.join(scratch_dir, 'benchmark.db')
+    engine = create_engine(url)
+    metadata, bench_podcasts, bench_media, indexes = make_tables(engine)
+    try:
+        for index in indexes:
+            index.drop(bind=engine)
+        start = time.time()
+        seed(engine, bench_podcasts, bench_media, options.media, options.podcasts)
+        print 'Seeded %d media in %.1fs on %s' % (options.media,
+            time.time() - start, engine.dialect.name)
+        analyze(engine, bench_media)
+        queries = listing_queries(random.randint(1, options.podcasts))
+
+        print
+        print 'Without the listing indexes:'
+        before = run(engine, queries, options.repeat)
+
+        start = time.time()
+        for index in indexes:
+            index.create(bind=engine)
+        analyze(engine, bench_media)
+        print
+        print 'Created %s in %.1fs' % (', '.join([i.name for i in indexes]),
+                                       time.time() - start)
+        print
+        print 'With the listing indexes:'
+        after = run(engine, queries, options.repeat)
+
+        print
+        for (name, query), b, a in zip(queries, before, after):
+            print '%-20s %9.2f ms -> %7.2f ms  %6.1fx' % (name, b, a, b / max(a, 0.001))
+        if DEBUG:
+            for name, query in queries:
+                print '%s:\n    %s' % (name, compile_query(engine, query)[0])
+    finally:
+        metadata.drop_all(bind=engine)
+        if scratch_dir:
+            shutil.rmtree(scratch_dir)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
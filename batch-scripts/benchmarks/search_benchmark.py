@@ -0,0 +1,94 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Search Benchmark"
+_script_description = """
+Compare the speed of the search engines in mediacore.lib.search against the
+media in your database. Search terms are sampled from your media titles.
+The MySQL engine is only included when running against a MySQL database.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-n', '--searches', dest='searches', type='int', default=200, help='Number of searches to run per engine. Default: 200')
+    cmd.parser.add_option('--bool', action='store_true', dest='bool', default=False, help='Search in boolean mode, requiring every word.')
+    cmd.parser.add_option('--debug', action='store_true', dest='debug', help='Write debug output to STDOUT.', default=False)
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from mediacore.lib.search import (InvertedIndexSearchEngine,
+    LikeSearchEngine, MySQLSearchEngine, tokenize)
+from mediacore.model import DBSession, Media
+
+def sample_searches(count, bool):
+    words = set()
+    for title, in DBSession.query(Media.title):
+        words.update(w for w in tokenize(title) if len(w) > 3)
+    if not words:
+        print >> sys.stderr, 'There are no media titles to sample from.'
+        sys.exit(1)
+    words = sorted(words)
+    searches = []
+    for x in xrange(count):
+        terms = random.sample(words, min(len(words), random.randint(1, 3)))
+        if bool:
+            terms = ['+' + t for t in terms]
+        searches.append(u' '.join(terms))
+    return searches
+
+def run(engine, searches, bool):
+    results = []
+    start = time.time()
+    for search in searches:
+        query = engine.search(Media.query.published(), search, bool=bool)
+        results.append([m.id for m in query[:20]])
+    return time.time() - start, results
+
+def main(parser, options, args):
+    searches = sample_searches(options.searches, options.bool)
+    index_dir = tempfile.mkdtemp()
+    try:
+        engines = []
+        if DBSession.bind.dialect.name == 'mysql':
+            engines.append(('mysql', MySQLSearchEngine()))
+        index = InvertedIndexSearchEngine(os.path.join(index_dir, 'index.sqlite'))
+        start = time.time()
+        index.rebuild(DBSession)
+        print 'Built the inverted index in %.2fs' % (time.time() - start)
+        engines.append(('index', index))
+        engines.append(('like', LikeSearchEngine()))
+
+        baseline = None
+        for name, engine in engines:
+            elapsed, results = run(engine, searches, options.bool)
+            line = '%-6s %8.2f ms/search' % (name, elapsed * 1000 / len(searches))
+            if baseline is None:
+                baseline = results
+            else:
+                # How many of the baseline's top results this engine found too
+                found = total = 0
+                for ours, theirs in zip(results, baseline):
+                    found += len(set(ours) & set(theirs))
+                    total += len(theirs)
+                if total:
+                    line += '   %5.1f%% overlap with %s' \
+                        % (100.0 * found / total, engines[0][0])
+            print line
+            if DEBUG:
+                for search, ids in zip(searches, results)[:10]:
+                    print '    %r: %r' % (search, ids)
+    finally:
+        shutil.rmtree(index_dir)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Media Summary Benchmark"
+_script_description = """
+Compare loading pages of the latest published media as full Media instances
+and as MediaSummary instances, against the media in your database. For each
+page the load time, the memory still held by the loaded items, and the size
+of the column data fetched from the database are reported.
+
+Measuring the memory requires Python 2.6 or later.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-p', '--pages', dest='pages', type='int', default=10, help='Number of pages to load. Default: 10')
+    cmd.parser.add_option('-n', '--per-page', dest='per_page', type='int', default=20, help='Number of media per page. Default: 20')
+    cmd.parser.add_option('--debug', action='store_true', dest='debug', help='Write debug output to STDOUT.', default=False)
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import gc
+import sys
+import time
+
+from mediacore.model import DBSession, Media
+
+def page_queries(page, per_page):
+    """The full and summary queries for the given page of latest media."""
+    latest = Media.query.published()\
+        .order_by(Media.publish_on.desc(), Media.id.desc())
+    start = page * per_page
+    return [
+        ('media', latest, start, per_page),
+        ('summaries', latest.summaries(), start, per_page),
+    ]
+
+def retained_size(load):
+    """Call load() and return its result and the number of bytes taken up
+    by the objects it created which are still alive."""
+    gc.collect()
+    # Keep the existing objects referenced, so their ids aren't reused
+    snapshot = gc.get_objects()
+    existing = set([id(obj) for obj in snapshot])
+    result = load()
+    gc.collect()
+    created = [obj for obj in gc.get_objects() if id(obj) not in existing]
+    created_ids = set([id(obj) for obj in created])
+    ignore = set([id(snapshot), id(existing), id(created), id(created_ids)])
+    seen = set()
+    size = 0
+    for obj in created:
+        if id(obj) in ignore:
+            continue
+        size += sys.getsizeof(obj)
+        # Strings, numbers and dates aren't tracked by the garbage
+        # collector, so count those which are referred to by new objects
+        for ref in gc.get_referents(obj):
+            ref_id = id(ref)
+            if ref_id in seen or ref_id in existing or ref_id in created_ids:
+                continue
+            seen.add(ref_id)
+            size += sys.getsizeof(ref)
+    return result, size
+
+def data_size(query, start, limit):
+    """Return the number of bytes in the column values of the rows."""
+    statement = query.limit(limit).offset(start).statement
+    size = 0
+    for row in DBSession.execute(statement):
+        for value in row:
+            if isinstance(value, basestring):
+                size += len(value.encode('utf-8'))
+            elif value is not None:
+                size += 8
+    return size
+
+def load_page(query, start, limit):
+    def load():
+        return query[start:start + limit]
+    return load
+
+def main(parser, options, args):
+    if not hasattr(sys, 'getsizeof'):
+        print >> sys.stderr, 'Measuring memory requires Python 2.6 or later.'
+        sys.exit(1)
+    published = Media.query.published().count()
+    if not published:
+        print >> sys.stderr, 'There are no published media to load.'
+        sys.exit(1)
+    pages = min(options.pages, (published - 1) / options.per_page + 1)
+
+    totals = {}
+    names = []
+    for page in xrange(pages):
+        for name, query, start, limit in page_queries(page, options.per_page):
+            if name not in totals:
+                names.append(name)
+                totals[name] = [0.0, 0, 0, 0]
+                # Compile the query and warm the caches before measuring
+                load_page(query, start, limit)()
+                DBSession.expunge_all()
+            begin = time.time()
+            load_page(query, start, limit)()
+            elapsed = time.time() - begin
+            DBSession.expunge_all()
+            items, memory = retained_size(load_page(query, start, limit))
+            count = len(items)
+            del items
+            DBSession.expunge_all()
+            data = data_size(query, start, limit)
+            total = totals[name]
+            total[0] += elapsed
+            total[1] += memory
+            total[2] += data
+            total[3] += count
+            if DEBUG:
+                print '%-10s page %3d: %3d items %8.1f KB held %8.1f KB data' \
+                    % (name, page + 1, count, memory / 1024.0, data / 1024.0)
+
+    print '%-10s %10s %14s %14s %16s' \
+        % ('', 'ms/page', 'KB held/page', 'KB data/page', 'bytes held/item')
+    for name in names:
+        elapsed, memory, data, count = totals[name]
+        print '%-10s %10.2f %14.1f %14.1f %16d' % (name,
+            elapsed * 1000 / pages, memory / 1024.0 / pages,
+            data / 1024.0 / pages, count and memory / count or 0)
+    full, summary = totals[names[0]], totals[names[1]]
+    if summary[1] and summary[2]:
+        print
+        print 'Summaries hold %.1fx less memory and fetch %.1fx less data.' \
+            % (float(full[1]) / summary[1], float(full[2]) / summary[2])
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python2.5
+# -*- coding: utf-8 -*-
+from mediacore.lib.commands import LoadAppCommand, load_app
+
+_script_name = "Thumbnail Benchmark"
+_script_description = """
+Compare the time taken to create media thumbnails in every configured size
+by resizing each from the full size image, as MediaCore used to, against
+render_thumbs, which decodes JPEGs at a reduced scale and resizes each
+thumb from the one before it, and render_thumbs_many, which spreads the
+images across a process pool.
+
+Sample JPEGs are generated unless a directory of images is given.
+"""
+DEBUG = False
+
+if __name__ == "__main__":
+    cmd = LoadAppCommand(_script_name, _script_description)
+    cmd.parser.add_option('-i', '--images', dest='images', default=None, help='Directory of images to use instead of generated samples.')
+    cmd.parser.add_option('-n', '--count', dest='count', type='int', default=16, help='Number of sample images to generate. Default: 16')
+    cmd.parser.add_option('-s', '--size', dest='size', default='3000x2000', help='Size of the sample images. Default: 3000x2000')
+    cmd.parser.add_option('-p', '--processes', dest='processes', type='int', default=None, help='Size of the process pool. Default: the number of CPUs')
+    cmd.parser.add_option('--debug', action='store_true', dest='debug', help='Write debug output to STDOUT.', default=False)
+    load_app(cmd)
+    DEBUG = cmd.options.debug
+
+# BEGIN SCRIPT & SCRIPT SPECIFIC IMPORTS
+import os
+import random
+import shutil
+import tempfile
+import time
+from cStringIO import StringIO
+
+from PIL import Image, ImageDraw
+from pylons import config
+
+from mediacore.lib.thumbnails import _draft_size, render_thumbs, render_thumbs_many, resize_thumb
+
+def make_samples(count, size):
+    """Write ``count`` JPEGs of random shapes, which compress like photos
+    more than flat noise does."""
+    sample_dir = tempfile.mkdtemp()
+    paths = []
+    for i in xrange(count):
+        img = Image.new('RGB', size, (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for x in xrange(200):
+            x1, y1 = random.randint(0, size[0]), random.randint(0, size[1])
+            x2, y2 = random.randint(x1, size[0]), random.randint(y1, size[1])
+            color = tuple([random.randint(0, 255) for c in 'rgb'])
+            draw.ellipse((x1, y1, x2, y2), fill=color)
+        path = os.path.join(sample_dir, '%d.jpg' % i)
+        img.save(path, 'JPEG', quality=90)
+        paths.append(path)
+    return sample_dir, paths
+
+def full_size(path, sizes):
+    """Create thumbs the way create_thumbs_for used to."""
+    img = Image.open(path)
+    data = {}
+    for key, xy in sizes.iteritems():
+        thumb_img = resize_thumb(img, xy)
+        if thumb_img.mode != "RGB":
+            thumb_img = thumb_img.convert("RGB")
+        buffer = StringIO()
+        thumb_img.save(buffer, 'JPEG')
+        data[key] = buffer.getvalue()
+    return data
+
+def decoded_pixels(path, sizes, draft):
+    img = Image.open(path)
+    if draft and img.format == 'JPEG':
+        img.draft('RGB', _draft_size(img.size, sizes.values()))
+    return img.size[0] * img.size[1]
+
+def main(parser, options, args):
+    sizes = config['thumb_sizes']['media']
+    sample_dir = None
+    if options.images:
+        paths = [os.path.join(options.images, name)
+                 for name in sorted(os.listdir(options.images))]
+    else:
+        size = tuple([int(x) for x in options.size.split('x')])
+        sample_dir, paths = make_samples(options.count, size)
+    try:
+        print '%d images, thumb sizes %s' % (len(paths),
+            ', '.join(['%dx%d' % xy for xy in sorted(sizes.values())]))
+        methods = [
+            ('full size', lambda: [full_size(p, sizes) for p in paths], False),
+            ('render_thumbs', lambda: [render_thumbs(p, sizes) for p in paths], True),
+            ('render_thumbs_many', lambda: render_thumbs_many(
+                [(p, sizes) for p in paths], options.processes), True),
+        ]
+        for name, func, draft in methods:
+            start = time.time()
+            results = func()
+            elapsed = time.time() - start
+            pixels = sum([decoded_pixels(p, sizes, draft) for p in paths])
+            print '%-20s %7.1f images/s %8.1f ms/image %7.1f MB decoded/image' % (
+                name,
+                len(paths) / elapsed,
+                1000 * elapsed / len(paths),
+                3.0 * pixels / len(paths) / 1024 / 1024,
+            )
+            if DEBUG:
+                print '    %d bytes of thumbs' % sum(
+                    [len(d) for r in results for d in r.itervalues()])
+    finally:
+        if sample_dir:
+            shutil.rmtree(sample_dir)
+
+if __name__ == "__main__":
+    main(cmd.parser, cmd.options, cmd.args)
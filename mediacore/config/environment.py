@@ -27,6 +27,7 @@ import mediacore.lib.helpers
 
 from mediacore.config.routing import make_map
 from mediacore.lib.auth import classifier_for_flash_uploads
+from mediacore.lib.search import search_engine_from_config
 from mediacore.model import Group, Media, Permission, Podcast, User, init_model
 from mediacore.model.meta import DBSession
 
@@ -68,7 +69,15 @@ def load_environment(global_conf, app_conf):
 
     # Setup the SQLAlchemy database engine
     engine = engine_from_config(config, 'sqlalchemy.')
-    init_model(engine)
+    search_engine = search_engine_from_config(config, engine)
+    config['pylons.app_globals'].search_engine = search_engine
+    init_model(engine, [search_engine.update_index])
+
+    # Import the modules whose caches are invalidated by model changes,
+    # so that their listeners are registered in every process.
+    import mediacore.lib.category_tree
+    import mediacore.lib.feeds
+    import mediacore.lib.render_cache
 
     # CONFIGURATION OPTIONS HERE (note: all config options will override
     # any Pylons config options)
@@ -21,6 +21,7 @@ from repoze.what.predicates import has_permission
 from sqlalchemy import orm, sql
 
 from mediacore.lib.base import BaseController
+from mediacore.lib.counts import count_results
 from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
 from mediacore.model import Comment, Media, fetch_row, get_available_slug
@@ -41,7 +42,7 @@ class CommentsController(BaseController):
 
     @expose_xhr('admin/comments/index.html',
                 'admin/comments/index-table.html')
-    @paginate('comments', items_per_page=25)
+    @paginate('comments', items_per_page=25, count=count_results)
     def index(self, page=1, search=None, media_filter=None, **kwargs):
         """List comments with pagination and filtering.
 
@@ -23,16 +23,18 @@ from formencode import Invalid, validators
 from pylons import config, request, response, session, tmpl_context
 from pylons.i18n import _
 from repoze.what.predicates import has_permission
-from sqlalchemy import orm
 
 from mediacore.forms.admin import SearchForm, ThumbForm
 from mediacore.forms.admin.media import AddFileForm, EditFileForm, MediaForm, PodcastFilterForm, UpdateStatusForm
 from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
+from mediacore.lib.counts import count_results
 from mediacore.lib.decorators import expose, expose_xhr, paginate, validate, validate_xhr
 from mediacore.lib.helpers import redirect, url_for
 from mediacore.lib.mediafiles import add_new_media_file
-from mediacore.lib.thumbnails import thumb_path, thumb_paths, create_thumbs_for, create_default_thumbs_for, has_thumbs, has_default_thumbs
+from mediacore.lib.storage import delete_stored_files, stored_file
+from mediacore.lib.uploads import UploadError, get_upload, receive_chunk
+from mediacore.lib.thumbnails import create_thumbs_for, create_default_thumbs_for, deletable_thumb_paths, has_thumbs, has_default_thumbs, thumb_url
 from mediacore.model import Author, Category, Media, Podcast, Tag, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
 
@@ -51,7 +53,7 @@ class MediaController(BaseController):
     allow_only = has_permission('admin')
 
     @expose_xhr('admin/media/index.html', 'admin/media/index-table.html')
-    @paginate('media', items_per_page=25)
+    @paginate('media', items_per_page=25, count=count_results)
     def index(self, page=1, search=None, podcast_filter=None, **kwargs):
         """List media with pagination and filtering.
 
@@ -78,14 +80,7 @@ class MediaController(BaseController):
                 The :class:`~mediacore.forms.admin.media.PodcastFilterForm` instance.
 
         """
-        media = Media.query.options(orm.undefer('comment_count_published'))
-
-        if search:
-            media = media.admin_search(search)
-        else:
-            media = media.order_by_status()\
-                         .order_by(Media.publish_on.desc(),
-                                   Media.modified_on.desc())
+        media = Media.query
 
         podcast_filter_title = podcast_filter
         if podcast_filter == 'Unfiled':
@@ -95,6 +90,14 @@ class MediaController(BaseController):
             podcast_filter_title = DBSession.query(Podcast.title).get(podcast_filter)
             podcast_filter = int(podcast_filter)
 
+        # Search last, so the search engine sees the other filters
+        if search:
+            media = media.admin_search(search)
+        else:
+            media = media.order_by_status()\
+                         .order_by(Media.publish_on.desc(),
+                                   Media.modified_on.desc())
+
         return dict(
             media = media,
             podcast_filter = podcast_filter,
@@ -203,9 +206,10 @@ class MediaController(BaseController):
         media = fetch_row(Media, id)
 
         if delete:
-            file_paths = thumb_paths(media).values()
+            file_paths = deletable_thumb_paths(media)
+            stored = []
             for f in media.files:
-                file_paths.append(f.file_path)
+                stored.append(stored_file(f))
                 # Remove the file from the session so that SQLAlchemy doesn't
                 # try to issue an UPDATE to set the MediaFile.media_id to None.
                 # The database ON DELETE CASCADE handles everything for us.
@@ -213,6 +217,7 @@ class MediaController(BaseController):
             DBSession.delete(media)
             DBSession.commit()
             helpers.delete_files(file_paths, Media._thumb_dir)
+            delete_stored_files(stored)
             redirect(action='index', id=None)
 
         if not slug:
@@ -253,7 +258,7 @@ class MediaController(BaseController):
 
     @expose('json')
     @validate(add_file_form)
-    def add_file(self, id, file=None, url=None, **kwargs):
+    def add_file(self, id, file=None, url=None, upload_id=None, **kwargs):
         """Save action for the :class:`~mediacore.forms.admin.media.AddFileForm`.
 
         Creates a new :class:`~mediacore.model.media.MediaFile` from the
@@ -265,6 +270,9 @@ class MediaController(BaseController):
         :type file: :class:`cgi.FieldStorage` or ``None``
         :param url: A URL to a recognizable audio or video file
         :type url: :class:`unicode` or ``None``
+        :param upload_id: The ID of a finished upload sent to
+            :meth:`upload_chunk`, to use instead of ``file``.
+        :type upload_id: :class:`unicode` or ``None``
         :rtype: JSON dict
         :returns:
             success
@@ -282,8 +290,17 @@ class MediaController(BaseController):
                 for this file.
             status_form
                 The rendered XHTML :class:`~mediacore.forms.admin.media.UpdateStatusForm`
+            thumb_url
+                The URL of the small thumbnail, which may have just been
+                created.
 
         """
+        if file is None and upload_id:
+            try:
+                file = get_upload(upload_id)
+            except UploadError, e:
+                return dict(success=False, message=str(e))
+
         if id == 'new':
             media = Media()
             user = request.environ['repoze.who.identity']['user']
@@ -333,11 +350,43 @@ class MediaController(BaseController):
                 slug = media.slug,
                 link = url_for(action='edit', id=media.id),
                 duration = helpers.duration_from_seconds(media.duration),
+                thumb_url = thumb_url(media, 's'),
             )
 
         return data
 
 
+    @expose('json')
+    def upload_chunk(self, upload_id=None, filename=None, **kwargs):
+        """Receive one chunk of a file for :meth:`add_file`.
+
+        See :mod:`mediacore.lib.uploads` for the protocol.
+
+        :param upload_id: The ID of the upload in progress, if any.
+        :param filename: The name of the file, with the first chunk.
+        :rtype: JSON dict
+        :returns:
+            success
+                bool
+            upload_id
+                The ID to send with the following chunks and to
+                :meth:`add_file`.
+            offset
+                The number of bytes received so far.
+            complete
+                bool
+            message
+                Error message, if unsuccessful
+
+        """
+        try:
+            data = receive_chunk(request.environ, upload_id, filename)
+        except UploadError, e:
+            return dict(success=False, message=str(e), offset=e.offset)
+        data['success'] = True
+        return data
+
+
     @expose('json')
     @validate(validators={'file_id': validators.Int()})
     def edit_file(self, id, file_id, file_type=None, duration=None, delete=None, **kwargs):
@@ -387,11 +436,10 @@ class MediaController(BaseController):
                 data['success'] = True
                 data['duration'] = helpers.duration_from_seconds(duration)
         elif delete:
-            file_path = file.file_path
+            stored = stored_file(file)
             DBSession.delete(file)
             DBSession.commit()
-            if file_path:
-                helpers.delete_files([file_path], Media._thumb_dir)
+            delete_stored_files([stored])
             media = fetch_row(Media, id)
             data['success'] = True
         else:
@@ -466,14 +514,11 @@ class MediaController(BaseController):
             orig.tags = input.tags
             orig.update_popularity()
 
-        # Copy the input thumb over the default thumbnail
+        # Use the input thumb in place of the default thumbnail
         elif input.slug.startswith('_stub_') \
         and has_default_thumbs(orig) \
         and not has_default_thumbs(input):
-            for key, dst_path in thumb_paths(orig).iteritems():
-                src_path = thumb_path(input, key)
-                # This will raise an OSError on Windows, but not *nix
-                os.rename(src_path, dst_path)
+            orig.thumb_key = input.thumb_key
             DBSession.delete(input)
 
         # Report an error
@@ -502,6 +547,7 @@ class MediaController(BaseController):
             link = url_for(action='edit', id=orig.id),
             status_form = status_form_xhtml,
             file_forms = file_xhtml,
+            thumb_url = thumb_url(orig, 's'),
         )
 
 
@@ -523,6 +569,8 @@ class MediaController(BaseController):
             id
                 The :attr:`~mediacore.model.media.Media.id` which is
                 important if a new media has just been created.
+            thumb_url
+                The URL of the new small thumbnail, if successful.
 
         """
         if id == 'new':
@@ -538,7 +586,9 @@ class MediaController(BaseController):
 
         try:
             # Create JPEG thumbs
-            create_thumbs_for(media, thumb.file, thumb.filename)
+            old_paths = create_thumbs_for(media, thumb.file, thumb.filename)
+            DBSession.commit()
+            helpers.delete_files(old_paths, Media._thumb_dir)
             success = True
             message = None
         except IOError, e:
@@ -564,6 +614,7 @@ class MediaController(BaseController):
             title = media.title,
             slug = media.slug,
             link = url_for(action='edit', id=media.id),
+            thumb_url = success and thumb_url(media, 's') or None,
         )
 
 
@@ -26,7 +26,7 @@ from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
-from mediacore.lib.thumbnails import thumb_paths, create_thumbs_for, create_default_thumbs_for
+from mediacore.lib.thumbnails import create_thumbs_for, create_default_thumbs_for, deletable_thumb_paths, thumb_url
 from mediacore.model import Author, AuthorWithIP, Podcast, fetch_row, get_available_slug
 from mediacore.model.meta import DBSession
 
@@ -141,7 +141,7 @@ class PodcastsController(BaseController):
         podcast = fetch_row(Podcast, id)
 
         if delete:
-            file_paths = thumb_paths(podcast).values()
+            file_paths = deletable_thumb_paths(podcast)
             DBSession.delete(podcast)
             DBSession.commit()
             helpers.delete_files(file_paths, Podcast._thumb_dir)
@@ -187,6 +187,8 @@ class PodcastsController(BaseController):
             id
                 The :attr:`~mediacore.model.podcasts.Podcast.id` which is
                 important if a new podcast has just been created.
+            thumb_url
+                The URL of the new medium thumbnail, if successful.
 
         """
         if id == 'new':
@@ -199,7 +201,9 @@ class PodcastsController(BaseController):
 
         try:
             # Create JPEG thumbs
-            create_thumbs_for(podcast, thumb.file, thumb.filename)
+            old_paths = create_thumbs_for(podcast, thumb.file, thumb.filename)
+            DBSession.commit()
+            helpers.delete_files(old_paths, Podcast._thumb_dir)
             success = True
             message = None
         except IOError, e:
@@ -215,4 +219,5 @@ class PodcastsController(BaseController):
         return dict(
             success = success,
             message = message,
+            thumb_url = success and thumb_url(podcast, 'm') or None,
         )
@@ -23,6 +23,8 @@ from mediacore.forms.admin.settings import AnalyticsForm, CommentsForm, DisplayF
 from mediacore.lib.base import BaseController
 from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
+from mediacore.lib.popularity import (notify_ranked, popularity_settings,
+    rank_media)
 from mediacore.model import Media, Setting, fetch_row
 from mediacore.model.meta import DBSession
 
@@ -163,13 +165,16 @@ class SettingsController(BaseController):
     def save_popularity(self, **kwargs):
         """Save :class:`~mediacore.forms.admin.settings.PopularityForm`.
 
-        Updates the popularity for every media item based on the submitted
-        values.
+        Reranks the popularity of every media item if the submitted values
+        have changed. See :func:`mediacore.lib.popularity.rank_media`.
         """
+        old_settings = popularity_settings()
         self._save(popularity_form, **kwargs)
-        for m in Media.query:
-            m.update_popularity()
-            DBSession.add(m)
+        new_settings = popularity_settings()
+        if new_settings != old_settings:
+            changed = rank_media(DBSession, settings=new_settings)
+            DBSession.commit()
+            notify_ranked(changed)
         redirect(action='popularity')
 
     @expose('admin/settings/upload.html')
@@ -15,16 +15,23 @@
 
 
 from datetime import datetime, timedelta
+from paste.deploy.converters import asbool
 from pylons import config, request, response, session, tmpl_context
 from sqlalchemy import orm, sql
 import webob.exc
 
 from mediacore.lib.base import BaseController
-from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
+from mediacore.lib.cache import get_version_time, get_versions
+from mediacore.lib.counts import count_results
+from mediacore.lib.decorators import (conditional, expose, expose_xhr,
+    paginate, validate)
 from mediacore.lib.helpers import get_featured_category, url_for
 from mediacore.lib import helpers
+from mediacore.lib.paginate import (InvalidCursor, encode_cursor,
+    fetch_keyset_page, keyset_order, keyset_values)
 from mediacore.lib.thumbnails import thumb
 from mediacore.model import Category, Media, Podcast, Tag, fetch_row, get_available_slug
+from mediacore.model.media import media_categories
 from mediacore.model.meta import DBSession
 
 import logging
@@ -47,19 +54,56 @@ order_columns = {
     'popularity': Media.popularity_points,
     'description': Media.description,
     'description_plain': Media.description_plain,
-    'comment_count': 'comment_count_published %s'
+    'comment_count': Media.comment_count_published,
 }
 
+def _load_categories(summaries):
+    """Set the categories of each of the given media summaries.
+
+    The slug and name of every category on the page are fetched with
+    a single query.
+
+    """
+    by_id = {}
+    for summary in summaries:
+        summary.categories = []
+        by_id[summary.id] = summary
+    if not by_id:
+        return
+    rows = DBSession.query(media_categories.c.media_id,
+                           Category.slug, Category.name)\
+        .filter(Category.id == media_categories.c.category_id)\
+        .filter(media_categories.c.media_id.in_(by_id.keys()))
+    for row in rows:
+        by_id[row.media_id].categories.append(row)
+
+def _api_validators(**kwargs):
+    """Return the last modified time and ETag value for an API response.
+
+    View counts are updated without the ORM, so they can be out of date
+    in a response that's validated by a client's cached copy. Media
+    entering or leaving their publishing window bump the media stamp,
+    see :mod:`mediacore.lib.publishing`.
+
+    """
+    versions = ('media', 'comments', 'settings')
+    last_modified = get_version_time(*versions)
+    return last_modified, (get_versions(*versions),
+                           request.host_url,
+                           sorted(request.params.items()))
+
 class MediaController(BaseController):
     """
     JSON Media API
     """
 
+    @conditional(_api_validators)
     @expose('json')
     def index(self, type=None, podcast=None, tag=None, category=None, search=None,
               max_age=None, min_age=None, order=None, offset=0, limit=10,
               published_after=None, published_before=None, featured=False,
-              id=None, slug=None, include_embed=False, **kwargs):
+              id=None, slug=None, include_embed=False, cursor=None,
+              count=True, **kwargs):
         """Query for a list of media.
 
         :param type:
@@ -113,6 +157,18 @@ class MediaController(BaseController):
             next 50 and so on.
         :type offset: int
 
+        :param cursor:
+            The ``next_cursor`` returned with the previous results. This
+            fetches the next results much faster than an offset can, but
+            it can't be combined with a search. The offset is ignored when
+            a cursor is given.
+        :type cursor: str
+
+        :param count:
+            If zero, the total number of results isn't counted, which
+            saves a potentially slow query, and null is returned instead.
+        :type count: bool
+
         :param limit:
             Number of results to return in each query. Defaults to 10.
             The maximum allowed value defaults to 50 and is set via
@@ -148,11 +204,13 @@ class MediaController(BaseController):
                 The total number of results that match this query.
             media
                 A list of media info objects.
+            next_cursor
+                A cursor for fetching the next results, or null if there
+                are no more results or the results can't be paged with a
+                cursor.
 
         """
-        query = Media.query\
-            .published()\
-            .options(orm.undefer('comment_count_published'))
+        query = Media.query.published()
 
         # Basic filters
         if id:
@@ -175,10 +233,12 @@ class MediaController(BaseController):
             category = fetch_row(Category, slug=category)
             query = query.filter(Media.categories.contains(category))
 
+        # Round the ages to the minute, so their results can be cached
+        now = datetime.now().replace(second=0, microsecond=0)
         if max_age:
-            published_after = datetime.now() - timedelta(days=int(max_age))
+            published_after = now - timedelta(days=int(max_age))
         if min_age:
-            published_before = datetime.now() - timedelta(days=int(min_age))
+            published_before = now - timedelta(days=int(min_age))
 
         # FIXME: Parse the date and catch formatting problems before it
         #        it hits the database. Right now support for partial
@@ -213,30 +273,70 @@ class MediaController(BaseController):
             order = getattr(order_attr, order_dir)()
         query = query.order_by(order)
 
-        # Search will supercede the ordering above
-        if search:
-            query = query.search(search)
-
         if featured:
             featured_cat = get_featured_category()
             if featured_cat:
                 query = query.in_category(featured_cat)
 
+        # Search will supercede the ordering above. It's applied last, so
+        # the search engine sees all the other filters.
+        if search:
+            query = query.search(search)
+
         # Preload podcast slugs so we don't do n+1 queries
         podcast_slugs = dict(DBSession.query(Podcast.id, Podcast.slug))
 
-        # Rudimentary pagination support
-        start = int(offset)
-        end = start + min(int(limit), int(config['api_media_max_results']))
+        # Rendering the embedded player requires whole Media instances
+        # with their files. Otherwise just the columns in the response are
+        # loaded, and the categories of the page are fetched afterwards.
+        count_query = query
+        if include_embed:
+            query = query.options(orm.subqueryload('categories'),
+                                  orm.subqueryload('files'))
+        else:
+            query = query.summaries('description', 'description_plain')
 
-        media = [self._info(m, podcast_slugs, include_embed) for m in query[start:end]]
+        # Paginate by cursor where possible, see mediacore.lib.paginate
+        limit = min(int(limit), int(config['api_media_max_results']))
+        order = None
+        if not search:
+            query, order = keyset_order(query)
+
+        if cursor:
+            if order is None:
+                raise APIException, 'Cursors cannot be used with a search or this order.'
+            try:
+                results, next_cursor, page = \
+                    fetch_keyset_page(query, cursor, limit, order)
+            except InvalidCursor, e:
+                raise APIException, str(e)
+        else:
+            start = int(offset)
+            results = query[start:start + limit + 1]
+            next_cursor = None
+            if len(results) > limit:
+                results = results[:limit]
+                values = order and keyset_values(results[-1], order)
+                if values and None not in values:
+                    next_cursor = encode_cursor(values, order=order)
+
+        if not include_embed:
+            _load_categories(results)
+        media = [self._info(m, podcast_slugs, include_embed) for m in results]
+
+        if asbool(count):
+            count = count_results(count_query, limit=0)
+        else:
+            count = None
 
         return dict(
             media = media,
-            count = query.count()
+            count = count,
+            next_cursor = next_cursor,
         )
 
 
+    @conditional(_api_validators)
     @expose('json')
     def get(self, id=None, slug=None, **kwargs):
         """Expose info on a specific media item by ID or slug.
@@ -249,7 +349,9 @@ class MediaController(BaseController):
         :returns: JSON dict
 
         """
-        query = Media.query.published()
+        query = Media.query.published()\
+            .options(orm.subqueryload('categories'),
+                     orm.subqueryload('files'))
 
         if id:
             query = query.filter_by(id=id)
@@ -265,14 +367,14 @@ class MediaController(BaseController):
 
 
     def _info(self, media, podcast_slugs=None, include_embed=False):
-        """Return a JSON-ready dict for the given media instance"""
-        if media.podcast_id:
-            media_url = url_for(controller='/media', action='view', slug=media.slug,
-                                podcast_slug=media.podcast.slug, qualified=True)
-        else:
-            media_url = url_for(controller="/media", action="view", slug=media.slug,
-                                qualified=True)
+        """Return a JSON-ready dict for the given media instance or summary
+
+        To avoid a query per item, load ``media.categories`` (and
+        ``media.files`` when including the embed) with the media, and pass
+        in a dict of all podcast IDs to their slugs. The embed can't be
+        included for a :class:`~mediacore.model.media.MediaSummary`.
 
+        """
         if media.podcast_id is None:
             podcast_slug = None
         elif podcast_slugs:
@@ -281,6 +383,13 @@ class MediaController(BaseController):
             podcast_slug = DBSession.query(Podcast.slug)\
                 .filter_by(id=media.podcast_id).scalar()
 
+        if podcast_slug:
+            media_url = url_for(controller='/media', action='view', slug=media.slug,
+                                podcast_slug=podcast_slug, qualified=True)
+        else:
+            media_url = url_for(controller="/media", action="view", slug=media.slug,
+                                qualified=True)
+
         thumbs = {}
         for size in config['thumb_sizes'][media._thumb_dir].iterkeys():
             thumbs[size] = thumb(media, size, qualified=True)
@@ -300,7 +409,7 @@ class MediaController(BaseController):
             likes = media.likes,
             views = media.views,
             thumbs = thumbs,
-            categories = dict((c.slug, c.name) for c in list(media.categories)),
+            categories = dict((c.slug, c.name) for c in media.categories),
         )
 
         if include_embed:
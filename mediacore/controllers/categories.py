@@ -12,14 +12,15 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import webob.exc
 from pylons import config, request, response, session, tmpl_context as c
-from sqlalchemy import orm, sql
+from sqlalchemy import sql
 
 from mediacore.lib.base import BaseController
+from mediacore.lib.category_tree import category_tree
 from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
 from mediacore.lib.helpers import get_featured_category, redirect, url_for
-from mediacore.model import Category, Media, Podcast, fetch_row
-from mediacore.model.meta import DBSession
+from mediacore.model import Media, Podcast
 
 import logging
 log = logging.getLogger(__name__)
@@ -37,27 +38,21 @@ class CategoriesController(BaseController):
         """Load all our category data before each request."""
         BaseController.__before__(self, *args, **kwargs)
 
-        c.categories = Category.query.order_by(Category.name).populated_tree()
-
-        counts = dict(DBSession.query(Category.id,
-                                      Category.media_count_published))
-        c.category_counts = counts.copy()
-        for cat, depth in c.categories.traverse():
-            count = counts[cat.id]
-            if count:
-                for ancestor in cat.ancestors():
-                    c.category_counts[ancestor.id] += count
+        tree = category_tree()
+        c.categories = tree.roots
+        c.category_counts = tree.counts
 
         category_slug = request.environ['pylons.routes_dict'].get('slug', None)
         if category_slug:
-            c.category = fetch_row(Category, slug=category_slug)
+            c.category = tree.by_slug.get(category_slug, None)
+            if c.category is None:
+                raise webob.exc.HTTPNotFound
             c.breadcrumb = c.category.ancestors()
             c.breadcrumb.append(c.category)
 
     @expose('categories/index.html')
     def index(self, slug=None, **kwargs):
-        media = Media.query.published()\
-            .options(orm.undefer('comment_count_published'))
+        media = Media.query.published()
 
         if c.category:
             media = media.in_category(c.category)
@@ -72,8 +67,8 @@ class CategoriesController(BaseController):
         if not featured:
             featured = popular.first()
 
-        latest = latest.exclude(featured)[:5]
-        popular = popular.exclude(latest, featured)[:5]
+        latest = latest.exclude(featured).summaries()[:5]
+        popular = popular.exclude(latest, featured).summaries()[:5]
 
         return dict(
             featured = featured,
@@ -85,7 +80,6 @@ class CategoriesController(BaseController):
     @paginate('media', items_per_page=20)
     def more(self, slug, order, page=1, **kwargs):
         media = Media.query.published()\
-            .options(orm.undefer('comment_count_published'))\
             .in_category(c.category)
 
         if order == 'latest':
@@ -94,7 +88,7 @@ class CategoriesController(BaseController):
             media = media.order_by(Media.popularity_points.desc())
 
         return dict(
-            media = media,
+            media = media.summaries(),
             order = order,
         )
 
@@ -18,15 +18,22 @@ Publicly Facing Media Controllers
 """
 from pylons import app_globals, config, request, response, session, tmpl_context
 import webob.exc
-from sqlalchemy import orm, sql
 from paste.deploy.converters import asbool
-from paste.fileapp import FileApp
 from paste.util import mimeparse
 from akismet import Akismet
 
 from mediacore.lib.base import BaseController
-from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
+from mediacore.lib.cache import get_version_time, get_versions
+from mediacore.lib.conditional import latest
+from mediacore.lib.counts import count_results
+from mediacore.lib.decorators import (conditional, expose, expose_xhr,
+    paginate, validate)
+from mediacore.lib.fileserve import FileServer, served_file, x_accel_path
+from mediacore.lib.filetypes import parse_user_agent_version
 from mediacore.lib.helpers import url_for, redirect, store_transient_message
+from mediacore.lib.media_cache import media_cache
+from mediacore.lib.random_media import random_media
+from mediacore.lib.render_cache import RenderCache
 from mediacore.model import (DBSession, fetch_row, get_available_slug,
     Media, MediaFile, Comment, Tag, Category, Author, AuthorWithIP, Podcast)
 from mediacore.lib import helpers, email
@@ -38,13 +45,39 @@ log = logging.getLogger(__name__)
 
 post_comment_form = PostCommentForm()
 
+def _count_cached_view(slug, **kwargs):
+    """Count a view of a media page that was served from a cache."""
+    media_id = DBSession.query(Media.id).filter(Media.slug == slug).scalar()
+    if media_id is not None:
+        app_globals.view_counter.increment(media_id)
+
+def _view_validators(slug, **kwargs):
+    """Return the last modified time and ETag value for a media page."""
+    row = DBSession.query(Media.id, Media.modified_on)\
+        .filter(Media.slug == slug).first()
+    if row is None:
+        return None
+    # The page also lists comments and related media, which are covered
+    # by these version stamps. Media entering or leaving their publishing
+    # window bump the media stamp too, see mediacore.lib.publishing.
+    versions = ('media', 'comments', 'settings')
+    last_modified = latest(row.modified_on, get_version_time(*versions))
+    return last_modified, (row.id, get_versions(*versions),
+                           sorted(request.params.items()))
+
+index_cache = RenderCache(params=['page', 'cursor', 'show', 'tag'])
+# These pages embed a player, which is picked for the visitor's browser
+explore_cache = RenderCache(params=['page'], vary=parse_user_agent_version)
+view_cache = RenderCache(on_hit=_count_cached_view,
+                         vary=parse_user_agent_version)
+
 class MediaController(BaseController):
     """
     Media actions -- for both regular and podcast media
     """
 
-    @expose('media/index.html')
-    @paginate('media', items_per_page=20)
+    @expose('media/index.html', cache=index_cache)
+    @paginate('media', items_per_page=20, cursor=True, count=count_results)
     def index(self, page=1, show='latest', q=None, tag=None, **kwargs):
         """List media with pagination.
 
@@ -62,34 +95,36 @@ class MediaController(BaseController):
         :rtype: dict
         :returns:
             media
-                The list of :class:`~mediacore.model.media.Media` instances
-                for this page.
+                The list of :class:`~mediacore.model.media.MediaSummary`
+                instances for this page.
             result_count
                 The total number of media items for this query
             search_query
                 The query the user searched for, if any
 
         """
-        media = Media.query.published()\
-            .options(orm.undefer('comment_count_published'))
+        media = Media.query.published()
 
         media, show = helpers.filter_library_controls(media, show)
 
-        if q:
-            media = media.search(q, bool=True)
         if tag:
             tag = fetch_row(Tag, slug=tag)
             media = media.filter(Media.tags.contains(tag))
+        # Search last, so the search engine sees the other filters
+        if q:
+            media = media.search(q, bool=True)
+
+        media = media.summaries()
 
         return dict(
             media = media,
-            result_count = media.count(),
+            result_count = count_results(media),
             search_query = q,
             show = show,
             tag = tag,
         )
 
-    @expose('media/explore.html')
+    @expose('media/explore.html', cache=explore_cache)
     @paginate('media', items_per_page=20)
     def explore(self, page=1, **kwargs):
         """Display the most recent 15 media.
@@ -102,8 +137,7 @@ class MediaController(BaseController):
                 Latest media
 
         """
-        media = Media.query.published()\
-            .options(orm.undefer('comment_count_published'))
+        media = Media.query.published()
 
         latest = media.order_by(Media.publish_on.desc())
         popular = media.order_by(Media.popularity_points.desc())
@@ -115,8 +149,8 @@ class MediaController(BaseController):
         if not featured:
             featured = popular.first()
 
-        latest = latest.exclude(featured)[:8]
-        popular = popular.exclude(featured, latest)[:5]
+        latest = latest.exclude(featured).summaries()[:8]
+        popular = popular.exclude(featured, latest).summaries()[:5]
 
         return dict(
             featured = featured,
@@ -127,11 +161,7 @@ class MediaController(BaseController):
     @expose()
     def random(self, **kwargs):
         """Redirect to a randomly selected media item."""
-        # TODO: Implement something more efficient than ORDER BY RAND().
-        #       This method does a full table scan every time.
-        media = Media.query.published()\
-            .order_by(sql.func.random())\
-            .first()
+        media = random_media.pick()
         if media is None:
             redirect(action='explore')
         if media.podcast_id:
@@ -140,7 +170,8 @@ class MediaController(BaseController):
             podcast_slug = None
         redirect(action='view', slug=media.slug, podcast_slug=podcast_slug)
 
-    @expose('media/view.html')
+    @conditional(_view_validators, on_not_modified=_count_cached_view)
+    @expose('media/view.html', cache=view_cache)
     def view(self, slug, podcast_slug=None, **kwargs):
         """Display the media player, info and comments.
 
@@ -166,7 +197,7 @@ class MediaController(BaseController):
                 instance.
 
         """
-        media = fetch_row(Media, slug=slug)
+        media = media_cache.get(slug)
 
         if media.podcast_id is not None:
             # Always view podcast media from a URL that shows the context of the podcast
@@ -176,9 +207,9 @@ class MediaController(BaseController):
         if media.fulltext:
             search_terms = '%s %s' % (media.title, media.fulltext.tags)
             related = Media.query.published()\
-                .options(orm.undefer('comment_count_published'))\
                 .filter(Media.id != media.id)\
-                .search(search_terms, bool=False)
+                .search(search_terms, bool=False)\
+                .summaries()
         else:
             related = []
 
@@ -203,7 +234,7 @@ class MediaController(BaseController):
             The new number of likes
 
         """
-        media = fetch_row(Media, slug=slug)
+        media = media_cache.get(slug)
         likes = media.increment_likes()
 
         if request.is_xhr:
@@ -238,7 +269,7 @@ class MediaController(BaseController):
                 store_transient_message('comment_posted', text, success=False)
                 redirect(action='view', anchor='comment-flash')
 
-        media = fetch_row(Media, slug=slug)
+        media = media_cache.get(slug)
 
         c = Comment()
         c.author = AuthorWithIP(
@@ -278,53 +309,53 @@ class MediaController(BaseController):
             match, then a 406 (not acceptable) response is returned.
 
         """
-        media = fetch_row(Media, slug=slug)
-
-        for file in media.files:
-            if file.id == int(id) and file.container == container:
-                # Catch external redirects in case they aren't linked to directly
-                if file.url:
-                    redirect(file.url.encode('utf-8'))
-                elif file.embed:
-                    redirect(file.link_url())
-
-                file_path = file.file_path.encode('utf-8')
-                file_type = file.mimetype.encode('utf-8')
-                file_name = file.display_name.encode('utf-8')
-
-                # Ensure the request accepts files with this container
-                accept = request.environ.get('HTTP_ACCEPT', '*/*')
-                if not mimeparse.best_match([file_type], accept):
-                    raise webob.exc.HTTPNotAcceptable() # 406
-
-                # Headers to add to FileApp
-                headers = [
-                    ('Content-Disposition',
-                     'attachment; filename="%s"' % file_name),
-                ]
-
-                serve_method = config.get('file_serve_method', None)
-
-                if serve_method == 'apache_xsendfile':
-                    # Requires mod_xsendfile for Apache 2.x
-                    # XXX: Don't send Content-Length or Etag headers,
-                    #      Apache handles them for you.
-                    response.headers['X-Sendfile'] = file_path
-                    response.body = ''
-
-                elif serve_method == 'nginx_redirect':
-                    raise NotImplementedError, 'This is only a placeholder'
-                    response.headers['X-Accel-Redirect'] = '../relative/path'
-
-                else:
-                    fileapp = FileApp(file_path, headers,
-                                      content_type=file_type)
-                    return fileapp(environ, start_response)
-
-                response.headers['Content-Type'] = file_type
-                for header, value in headers:
-                    response.headers[header] = value
-
-                return None
-        else:
+        file = served_file(slug, int(id), container)
+        if file is None:
             raise webob.exc.HTTPNotFound()
+
+        # Catch external redirects in case they aren't linked to directly
+        if file['redirect_url']:
+            redirect(file['redirect_url'])
+
+        file_path = file['path']
+        file_type = file['mimetype']
+        file_name = file['display_name']
+
+        # Ensure the request accepts files with this container
+        accept = request.environ.get('HTTP_ACCEPT', '*/*')
+        if not mimeparse.best_match([file_type], accept):
+            raise webob.exc.HTTPNotAcceptable() # 406
+
+        # Headers to add to FileServer
+        headers = [
+            ('Content-Disposition',
+             'attachment; filename="%s"' % file_name),
+        ]
+
+        serve_method = config.get('file_serve_method', None)
+        accel_path = None
+        if serve_method == 'nginx_redirect':
+            accel_path = x_accel_path(file_path)
+
+        if serve_method == 'apache_xsendfile':
+            # Requires mod_xsendfile for Apache 2.x
+            # XXX: Don't send Content-Length or Etag headers,
+            #      Apache handles them for you.
+            response.headers['X-Sendfile'] = file_path
+            response.body = ''
+
+        elif accel_path:
+            # nginx serves the file from an internal location,
+            # along with any ranges, Content-Length and Etag.
+            response.headers['X-Accel-Redirect'] = accel_path
+            response.body = ''
+
+        else:
+            server = FileServer(file_path, file_type, headers)
+            return server(environ, start_response)
+
+        response.headers['Content-Type'] = file_type
+        for header, value in headers:
+            response.headers[header] = value
+
+        return None
@@ -21,14 +21,39 @@ import pylons.templating
 
 from mediacore.lib import helpers
 from mediacore.lib.base import BaseController
-from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
+from mediacore.lib.cache import get_version_time
+from mediacore.lib.conditional import last_publish_change, latest
+from mediacore.lib.counts import count_results
+from mediacore.lib.decorators import (conditional, expose, expose_xhr,
+    paginate, validate)
+from mediacore.lib.feeds import cached_feed
 from mediacore.lib.helpers import redirect
-from mediacore.model import Category, Media, Podcast, fetch_row
+from mediacore.model import Category, Media, MediaFile, Podcast, fetch_row
 from mediacore.model.meta import DBSession
 
 import logging
 log = logging.getLogger(__name__)
 
+def _feed_validators(slug, **kwargs):
+    """Return the last modified time and ETag value for a podcast feed."""
+    podcast = DBSession.query(Podcast.id, Podcast.modified_on)\
+        .filter(Podcast.slug == slug).first()
+    if podcast is None:
+        return None
+    episodes = Media.query.filter(Media.podcast_id == podcast.id)
+    files_modified_on = DBSession.query(sql.func.max(MediaFile.modified_on))\
+        .join(MediaFile.media)\
+        .filter(Media.podcast_id == podcast.id)\
+        .scalar()
+    last_modified = latest(podcast.modified_on,
+                           episodes.value(sql.func.max(Media.modified_on)),
+                           files_modified_on,
+                           last_publish_change(episodes),
+                           get_version_time('settings'))
+    return last_modified, (podcast.id,
+                           request.environ.get('HTTP_ACCEPT', '*/*'),
+                           sorted(request.params.items()))
+
 class PodcastsController(BaseController):
     """
     Podcast Series Controller
@@ -62,8 +87,10 @@ class PodcastsController(BaseController):
 
         podcast_episodes = {}
         for podcast in podcasts:
-            podcast_episodes[podcast] = podcast.media.published()\
-                .order_by(Media.publish_on.desc())[:4]
+            podcast_episodes[podcast] = Media.query.published()\
+                .filter(Media.podcast_id == podcast.id)\
+                .order_by(Media.publish_on.desc())\
+                .summaries()[:4]
 
         return dict(
             podcasts = podcasts,
@@ -72,7 +99,8 @@ class PodcastsController(BaseController):
 
 
     @expose('podcasts/view.html')
-    @paginate('episodes', items_per_page=10)
+    @paginate('episodes', items_per_page=10, cursor=True,
+              count=count_results)
     def view(self, slug, page=1, show='latest', **kwargs):
         """View a podcast and the media that belongs to it.
 
@@ -84,26 +112,28 @@ class PodcastsController(BaseController):
             podcast
                 A :class:`~mediacore.model.podcasts.Podcast` instance.
             episodes
-                A list of :class:`~mediacore.model.media.Media` instances
-                that belong to the ``podcast``.
+                A list of :class:`~mediacore.model.media.MediaSummary`
+                instances that belong to the ``podcast``.
             podcasts
                 A list of all the other podcasts
 
         """
         podcast = fetch_row(Podcast, slug=slug)
-        episodes = podcast.media.published()\
-            .options(orm.undefer('comment_count_published'))
+        episodes = Media.query.published()\
+            .filter(Media.podcast_id == podcast.id)
 
         episodes, show = helpers.filter_library_controls(episodes, show)
+        episodes = episodes.summaries()
 
         return dict(
             podcast = podcast,
             episodes = episodes,
-            result_count = episodes.count(),
+            result_count = count_results(episodes),
             show = show,
         )
 
-    @expose('podcasts/feed.xml')
+    @conditional(_feed_validators)
+    @expose()
     def feed(self, slug, **kwargs):
         """Serve the feed as RSS 2.0.
 
@@ -112,16 +142,12 @@ class PodcastsController(BaseController):
         does not contain 'feedburner', as described here:
         http://www.google.com/support/feedburner/bin/answer.py?hl=en&answer=78464
 
-        :param feedburner_bypass: If true, the redirect to feedburner is disabled.
-        :rtype: Dict
-        :returns:
-            podcast
-                A :class:`~mediacore.model.podcasts.Podcast` instance.
-            episodes
-                A list of :class:`~mediacore.model.media.Media` instances
-                that belong to the ``podcast``.
+        The feed is rendered from :data:`podcasts/feed.xml` and stored
+        until its episodes change, see :func:`mediacore.lib.feeds.cached_feed`.
 
-        Renders: :data:`podcasts/feed.xml` XML
+        :param feedburner_bypass: If true, the redirect to feedburner is disabled.
+        :rtype: str
+        :returns: The feed XML.
 
         """
         podcast = fetch_row(Podcast, slug=slug)
@@ -137,10 +163,4 @@ class PodcastsController(BaseController):
             request.environ.get('HTTP_ACCEPT', '*/*')
         )
 
-        episodes = podcast.media.published()\
-            .order_by(Media.publish_on.desc())[:25]
-
-        return dict(
-            podcast = podcast,
-            episodes = episodes,
-        )
+        return cached_feed(podcast)
@@ -21,9 +21,13 @@ from pylons import app_globals, config, request, response, session, tmpl_context
 from mediacore.forms.uploader import UploadForm
 from mediacore.lib import email
 from mediacore.lib.base import BaseController
+from mediacore.lib.compat import any
 from mediacore.lib.decorators import expose, expose_xhr, paginate, validate
 from mediacore.lib.helpers import redirect, url_for
+from mediacore.lib.jobs import job_status, queue_enabled
 from mediacore.lib.mediafiles import save_media_obj
+from mediacore.lib.uploads import UploadError, get_upload, receive_chunk
+from mediacore.model.meta import DBSession
 
 import logging
 log = logging.getLogger(__name__)
@@ -77,6 +81,8 @@ class UploadController(BaseController):
         provides the value of one field at a time,
 
         :param validate: A JSON list of field names to check for validation
+        :param upload_id: The ID of a finished upload sent to :meth:`chunk`,
+            to use instead of the ``file`` field.
         :parma \*\*kwargs: One or more form field values.
         :rtype: JSON dict
         :returns:
@@ -93,6 +99,10 @@ class UploadController(BaseController):
                 bool
             redirect
                 If valid, the redirect url for the upload successful page.
+            jobs
+                If the job queue is enabled, the IDs of the background
+                jobs processing the upload, which can be polled with
+                :meth:`status`.
 
         """
         if 'validate' in kwargs:
@@ -116,20 +126,84 @@ class UploadController(BaseController):
             else:
                 # else actually save it!
                 kwargs.setdefault('name')
+                file = kwargs['file']
+                if file is None and kwargs.get('upload_id'):
+                    try:
+                        file = get_upload(kwargs['upload_id'])
+                    except UploadError, e:
+                        return dict(success=False, file=str(e))
 
                 media_obj = save_media_obj(
                     kwargs['name'], kwargs['email'],
                     kwargs['title'], kwargs['description'],
-                    None, kwargs['file'], kwargs['url'],
+                    None, file, kwargs['url'],
                 )
-                email.send_media_notification(media_obj)
+                email.queue_media_notification(media_obj)
                 data = dict(
                     success = True,
                     redirect = url_for(action='success')
                 )
+                if queue_enabled():
+                    DBSession.flush()
+                    data['jobs'] = [job.id for job in media_obj.jobs]
 
         return data
 
+    @expose('json')
+    def chunk(self, upload_id=None, filename=None, **kwargs):
+        """Receive one chunk of a file, or report an upload's progress.
+
+        See :mod:`mediacore.lib.uploads` for the protocol. The request body
+        is streamed to disk, so the whole file is never held in memory.
+
+        :param upload_id: The ID of the upload in progress, if any.
+        :param filename: The name of the file, with the first chunk.
+        :rtype: JSON dict
+        :returns:
+            success
+                bool
+            upload_id
+                The ID to send with the following chunks and the form.
+            offset
+                The number of bytes received so far.
+            complete
+                bool
+            message
+                Error message, if unsuccessful
+
+        """
+        try:
+            data = receive_chunk(request.environ, upload_id, filename)
+        except UploadError, e:
+            return dict(success=False, message=str(e), offset=e.offset)
+        data['success'] = True
+        return data
+
+    @expose('json')
+    def status(self, jobs=None, **kwargs):
+        """Report the progress of the background jobs processing uploads.
+
+        :param jobs: A comma separated list of job IDs, as returned by
+            :meth:`submit_async`.
+        :rtype: JSON dict
+        :returns:
+            jobs
+                A list of dicts with the ``id``, ``type``, ``status`` and
+                ``finished`` flag of each job.
+            finished
+                bool, True once every job has finished.
+
+        """
+        try:
+            job_ids = [int(id) for id in (jobs or '').split(',') if id]
+        except ValueError:
+            job_ids = []
+        statuses = job_status(job_ids)
+        return dict(
+            jobs = statuses,
+            finished = not any(not job['finished'] for job in statuses),
+        )
+
     @expose()
     @validate(upload_form, error_handler=index)
     def submit(self, **kwargs):
@@ -143,7 +217,7 @@ class UploadController(BaseController):
             kwargs['title'], kwargs['description'],
             None, kwargs['file'], kwargs['url'],
         )
-        email.send_media_notification(media_obj)
+        email.queue_media_notification(media_obj)
 
         # Redirect to success page!
         redirect(action='success')
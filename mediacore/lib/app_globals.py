@@ -3,6 +3,8 @@
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
+from mediacore.lib.viewcounter import view_counter_from_config
+
 class CachedSettingsDescriptor(object):
     """
     A caching descriptor for the application settings from our database.
@@ -79,3 +81,4 @@ class Globals(object):
 
         """
         self.cache = CacheManager(**parse_cache_config_options(config))
+        self.view_counter = view_counter_from_config(config)
@@ -29,6 +29,7 @@ from repoze.what.plugins.pylonshq import ControllerProtector
 from repoze.what.predicates import Predicate
 
 from mediacore.lib import helpers
+from mediacore.lib.publishing import check_schedule
 from mediacore.model.meta import DBSession
 
 __all__ = ['BareBonesController', 'BaseController']
@@ -123,7 +124,12 @@ class BaseController(BareBonesController):
         :meth:`BareBonesController.__call__` directly to avoid
         this transaction management.
 
+        Media whose publishing window has opened or closed since the last
+        request are published or unpublished first, see
+        :func:`~mediacore.lib.publishing.check_schedule`.
+
         """
+        check_schedule()
         try:
             app_iter = BareBonesController.__call__(self, environ,
                                                     start_response)
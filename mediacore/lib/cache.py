@@ -0,0 +1,110 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache Versioning
+
+Most of our caches are kept in the memory of each server process, so
+when the underlying data changes, every process has to find out that
+its copy is stale. We use version stamps for this: a small file in
+``<cache_dir>/versions`` for each kind of cached content, holding a
+unique token. Whenever that content changes, :func:`bump_version` writes
+a new token, and every cache built against an older token is rebuilt
+the next time it's used::
+
+    version = get_version('categories')
+    if cached.version != version:
+        cached = rebuild(version)
+
+Stamps are usually bumped by listeners on
+:data:`mediacore.model.events.change_notifier`.
+
+"""
+
+import os
+import time
+import uuid
+from datetime import datetime
+
+from pylons import config
+
+__all__ = ['bump_version', 'get_version', 'get_version_time', 'get_versions']
+
+def _stamp_path(name):
+    return os.path.join(config['cache_dir'], 'versions', name)
+
+def get_version(name):
+    """Return the current version token of the named content.
+
+    :param name: The name of the version stamp.
+    :rtype: str
+    :returns: The token, or an empty string if it's never been bumped.
+
+    """
+    try:
+        f = open(_stamp_path(name))
+    except IOError:
+        return ''
+    try:
+        return f.read().strip()
+    finally:
+        f.close()
+
+def get_versions(*names):
+    """Return a single token combining the versions of all the given names."""
+    return '-'.join(get_version(name) for name in names)
+
+def get_version_time(*names):
+    """Return the time the most recent of the named versions was bumped.
+
+    :rtype: :class:`datetime.datetime` or None
+    :returns: The local time, or None if none of them have been bumped.
+
+    """
+    times = []
+    for name in names:
+        try:
+            times.append(os.path.getmtime(_stamp_path(name)))
+        except OSError:
+            pass
+    if not times:
+        return None
+    return datetime.fromtimestamp(max(times))
+
+def bump_version(*names):
+    """Write a new version token for each of the given names.
+
+    The new stamp is written to a temporary file and renamed into place,
+    so readers never see a partially written token.
+
+    """
+    for name in names:
+        path = _stamp_path(name)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Another process may have just created it
+                if not os.path.isdir(dirname):
+                    raise
+        token = '%x.%s' % (int(time.time()), uuid.uuid4().hex[:12])
+        tmp_path = '%s.%s.tmp' % (path, token)
+        f = open(tmp_path, 'w')
+        try:
+            f.write(token)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
@@ -0,0 +1,213 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cached Category Tree
+
+Every public category page displays the entire category tree along with
+the number of published media in each category, including those in its
+subcategories. :func:`category_tree` caches this tree in memory, built
+from three queries: one for the categories, one ``GROUP BY`` for the
+published media counts, and one for the next time a media item enters
+or leaves its publishing window.
+
+The cached tree is rebuilt when categories or the category assignments
+or publish status of any media change, as signalled by the
+``categories`` version stamp, or when the next publishing window
+boundary passes. Otherwise, it's served without touching the database.
+
+"""
+
+import threading
+from datetime import datetime
+
+from sqlalchemy import sql
+
+from mediacore.lib.cache import bump_version, get_version
+from mediacore.model import Category, Media, DBSession
+from mediacore.model.categories import (CategoryNestingException,
+    categories, traverse)
+from mediacore.model.events import change_notifier
+from mediacore.model.media import media, media_categories
+
+__all__ = ['CategoryNode', 'CategoryTree', 'category_tree']
+
+# Media attributes which affect which categories it's counted in
+_media_attrs = set(['categories', 'reviewed', 'encoded', 'publishable',
+                    'publish_on', 'publish_until', 'is_live'])
+
+class CategoryNode(object):
+    """A lightweight, read-only copy of a :class:`Category`.
+
+    Nodes are shared between requests and threads, so they must never be
+    modified once the tree is built.
+
+    """
+    def __init__(self, id, name, slug, parent_id):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.parent = None
+        self.children = []
+
+    def __repr__(self):
+        return '<CategoryNode: %s>' % self.name
+
+    def __unicode__(self):
+        return self.name
+
+    def traverse(self):
+        """Iterate over all nested categories in depth-first order."""
+        return traverse(self.children)
+
+    def descendants(self):
+        """Return a list of descendants in depth-first order."""
+        return [desc for desc, depth in self.traverse()]
+
+    def ancestors(self):
+        """Return a list of ancestors, starting with the root node."""
+        ancestors = []
+        anc = self.parent
+        while anc:
+            if anc is self:
+                raise CategoryNestingException, 'Category %s is defined as a ' \
+                    'parent of one of its ancestors.' % anc
+            ancestors.insert(0, anc)
+            anc = anc.parent
+        return ancestors
+
+    def depth(self):
+        """Return this category's distance from the root of the tree."""
+        return len(self.ancestors())
+
+class CategoryTree(object):
+    """The category tree with published media counts.
+
+    .. attribute:: roots
+
+        The root :class:`CategoryNode` instances, ordered by name.
+
+    .. attribute:: counts
+
+        A dict of category IDs to the number of published media in that
+        category and all its descendants.
+
+    .. attribute:: version
+
+        The ``categories`` version stamp this tree was built against.
+
+    .. attribute:: expires
+
+        The datetime at which a publishing window opens or closes, after
+        which the counts may be wrong, or None.
+
+    """
+    def __init__(self, version=None, now=None):
+        if now is None:
+            now = datetime.now()
+        self.version = version
+        self.by_id = {}
+        self.by_slug = {}
+        self.roots = []
+        self._fetch_tree()
+        self.counts = self._fetch_counts()
+        self.expires = self._fetch_expiry(now)
+
+    def _fetch_tree(self):
+        query = sql.select([categories.c.id, categories.c.name,
+                            categories.c.slug, categories.c.parent_id],
+                           order_by=[categories.c.name])
+        nodes = [CategoryNode(*row) for row in DBSession.execute(query)]
+        for node in nodes:
+            self.by_id[node.id] = node
+            self.by_slug[node.slug] = node
+        for node in nodes:
+            parent = self.by_id.get(node.parent_id, None)
+            if parent is None:
+                self.roots.append(node)
+            else:
+                node.parent = parent
+                parent.children.append(node)
+
+    def _fetch_counts(self):
+        query = sql.select([media_categories.c.category_id,
+                            sql.func.count(media_categories.c.media_id)],
+                           sql.and_(media_categories.c.media_id == media.c.id,
+                                    media.c.is_live == True))\
+            .group_by(media_categories.c.category_id)
+        direct_counts = dict(DBSession.execute(query).fetchall())
+
+        # Roll the counts up into the ancestors of each category
+        counts = dict.fromkeys(self.by_id, 0)
+        counts.update(direct_counts)
+        for node, depth in traverse(self.roots):
+            count = direct_counts.get(node.id, 0)
+            if count:
+                for ancestor in node.ancestors():
+                    counts[ancestor.id] += count
+        return counts
+
+    def _fetch_expiry(self, now):
+        publishable = sql.and_(media.c.reviewed == True,
+                               media.c.encoded == True,
+                               media.c.publishable == True)
+        next_publish = DBSession.execute(
+            sql.select([sql.func.min(media.c.publish_on)],
+                       sql.and_(publishable, media.c.publish_on > now))
+        ).scalar()
+        next_unpublish = DBSession.execute(
+            sql.select([sql.func.min(media.c.publish_until)],
+                       sql.and_(publishable, media.c.publish_until >= now))
+        ).scalar()
+        boundaries = [d for d in (next_publish, next_unpublish) if d]
+        return boundaries and min(boundaries) or None
+
+    def is_current(self, version, now=None):
+        """Return True if this tree is valid for the given version stamp."""
+        if now is None:
+            now = datetime.now()
+        return self.version == version \
+            and (self.expires is None or now <= self.expires)
+
+_tree = None
+_tree_lock = threading.Lock()
+
+def category_tree():
+    """Return the current :class:`CategoryTree`, rebuilding it if necessary."""
+    global _tree
+    version = get_version('categories')
+    tree = _tree
+    if tree is None or not tree.is_current(version):
+        _tree_lock.acquire()
+        try:
+            tree = _tree
+            if tree is None or not tree.is_current(version):
+                tree = _tree = CategoryTree(version)
+        finally:
+            _tree_lock.release()
+    return tree
+
+def _categories_changed(changes):
+    """Bump the categories version if the changes affect the tree."""
+    if Category in changes:
+        bump_version('categories')
+        return
+    for keys in changes.get(Media, {}).itervalues():
+        if keys is None or keys & _media_attrs:
+            bump_version('categories')
+            return
+
+change_notifier.listen(_categories_changed, Category, Media)
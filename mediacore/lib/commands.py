@@ -1,6 +1,15 @@
 """Paster Command Subclasses for use in utilities."""
 
-__all__ = ['LoadAppCommand', 'load_app']
+__all__ = [
+    'FullTextIndexCommand',
+    'LoadAppCommand',
+    'ProcessJobsCommand',
+    'PublishMediaCommand',
+    'RankPopularityCommand',
+    'ReconcileCommentCountsCommand',
+    'load_app',
+    'load_app_parser',
+]
 import os
 import sys
 
@@ -12,6 +21,16 @@ from paste.script.command import Command, BadCommand
 
 import pylons
 
+def load_app_parser():
+    """Return a new option parser for a :class:`LoadAppCommand` subclass."""
+    parser = Command.standard_parser()
+    parser.add_option('-q',
+                      action='count',
+                      dest='quiet',
+                      default=0,
+                      help="Do not load logging configuration from the config file")
+    return parser
+
 class LoadAppCommand(Command):
     """Load the app and all associated StackedObjectProxies.
 
@@ -31,13 +50,7 @@ class LoadAppCommand(Command):
     max_args = 1
     group_name = 'pylons'
 
-    parser = Command.standard_parser()
-
-    parser.add_option('-q',
-                      action='count',
-                      dest='quiet',
-                      default=0,
-                      help="Do not load logging configuration from the config file")
+    parser = load_app_parser()
 
     def __init__(self, name, summary):
         self.summary = summary
@@ -110,3 +123,277 @@ def load_app(cmd):
         cmd.parser.print_help()
         sys.exit(1)
     return cmd
+
+class FullTextIndexCommand(LoadAppCommand):
+    """Rebuild the media_fulltext search index.
+
+    The index of the configured search engine is rebuilt as well.
+    By default every media item is reindexed. With --incremental, only
+    media items without an index row are indexed, orphaned index rows
+    are removed, and, if --since is also given, media modified on or
+    after the given date are reindexed.
+    """
+    summary = __doc__.splitlines()[0]
+    usage = '[CONFIG_FILE]'
+    group_name = 'mediacore'
+
+    parser = load_app_parser()
+    parser.add_option('--incremental',
+                      action='store_true',
+                      dest='incremental',
+                      default=False,
+                      help="Only index media which are missing or out of date")
+    parser.add_option('--since',
+                      dest='since',
+                      metavar='YYYY-MM-DD',
+                      default=None,
+                      help="With --incremental, also reindex media modified "
+                           "on or after this date")
+
+    def __init__(self, name):
+        LoadAppCommand.__init__(self, name, self.summary)
+
+    def command(self):
+        LoadAppCommand.command(self)
+        from datetime import datetime
+        from sqlalchemy import sql
+        from mediacore.model.meta import DBSession
+        from mediacore.model.fulltext import index_media, delete_media_index
+        from mediacore.model.media import media, media_fulltext
+
+        indexed = sql.select([media_fulltext.c.media_id])
+        if self.options.incremental:
+            outdated = sql.not_(media.c.id.in_(indexed))
+            if self.options.since:
+                try:
+                    since = datetime.strptime(self.options.since, '%Y-%m-%d')
+                except ValueError:
+                    raise BadCommand('Invalid --since date: %s' \
+                                     % self.options.since)
+                outdated = sql.or_(outdated, media.c.modified_on >= since)
+            query = sql.select([media.c.id], outdated)
+        else:
+            query = sql.select([media.c.id])
+        media_ids = [row[0] for row in DBSession.execute(query)]
+
+        orphan_query = sql.select([media_fulltext.c.media_id],
+            sql.not_(media_fulltext.c.media_id.in_(sql.select([media.c.id]))))
+        orphan_ids = [row[0] for row in DBSession.execute(orphan_query)]
+
+        written = []
+        def collect(rows, deleted_ids):
+            if self.options.incremental:
+                written.append((rows, deleted_ids))
+
+        delete_media_index(DBSession, orphan_ids)
+        count = index_media(DBSession, media_ids, collect)
+        DBSession.commit()
+
+        # Bring the search engine's own index, if any, up to date too
+        search_engine = pylons.app_globals.search_engine
+        if self.options.incremental:
+            search_engine.update_index([], orphan_ids)
+            for rows, deleted_ids in written:
+                search_engine.update_index(rows, deleted_ids)
+        else:
+            search_engine.rebuild(DBSession)
+        if self.verbose:
+            print 'Indexed %d media, removed %d orphaned index rows.' \
+                % (count, len(orphan_ids))
+
+class PublishMediaCommand(LoadAppCommand):
+    """Publish and unpublish media as their publishing windows open and close.
+
+    This also happens at the start of the first request after each window
+    opens or closes, but running this command refreshes the feeds and
+    cached pages on time even when the site is idle. By default it runs
+    once and exits, so it can be scheduled with cron. Alternatively, pass
+    --interval to keep running, waking up as each window opens or closes,
+    and at least every so many seconds to pick up newly scheduled media.
+    """
+    summary = __doc__.splitlines()[0]
+    usage = '[CONFIG_FILE]'
+    group_name = 'mediacore'
+
+    parser = load_app_parser()
+    parser.add_option('--interval',
+                      dest='interval',
+                      type='int',
+                      metavar='SECONDS',
+                      default=None,
+                      help="Keep running, checking at least every SECONDS seconds")
+
+    def __init__(self, name):
+        LoadAppCommand.__init__(self, name, self.summary)
+
+    def command(self):
+        LoadAppCommand.command(self)
+        import time
+        from datetime import datetime
+        from mediacore.lib.publishing import (next_live_change,
+            publish_scheduled_media)
+        from mediacore.model.meta import DBSession
+        # Register the cache listeners which are notified of the changes
+        import mediacore.lib.category_tree
+        import mediacore.lib.feeds
+        import mediacore.lib.render_cache
+
+        while True:
+            changed = publish_scheduled_media()
+            if self.verbose and changed:
+                print 'Published or unpublished %d media.' % changed
+            if not self.options.interval:
+                break
+            now = datetime.now()
+            try:
+                boundary = next_live_change(DBSession, now)
+            finally:
+                DBSession.remove()
+            delay = self.options.interval
+            if boundary is not None:
+                # Windows close a moment after publish_until, so wake up
+                # one second late rather than a fraction too early.
+                until = boundary - now
+                delay = min(delay, until.days * 86400 + until.seconds + 1)
+            time.sleep(max(delay, 1))
+
+class RankPopularityCommand(LoadAppCommand):
+    """Recompute the popularity points of all media.
+
+    Media entering or leaving their publishing window are only reranked
+    when this is run, so it should be scheduled, for example with cron.
+    Alternatively, pass --interval to keep running and rerank every so
+    many seconds.
+    """
+    summary = __doc__.splitlines()[0]
+    usage = '[CONFIG_FILE]'
+    group_name = 'mediacore'
+
+    parser = load_app_parser()
+    parser.add_option('--interval',
+                      dest='interval',
+                      type='int',
+                      metavar='SECONDS',
+                      default=None,
+                      help="Keep running, reranking every SECONDS seconds")
+
+    def __init__(self, name):
+        LoadAppCommand.__init__(self, name, self.summary)
+
+    def command(self):
+        LoadAppCommand.command(self)
+        import logging
+        import time
+        from mediacore.lib.popularity import notify_ranked, rank_media
+        from mediacore.model.meta import DBSession
+        # Register the cache listeners which are notified of the changes
+        import mediacore.lib.category_tree
+        import mediacore.lib.feeds
+        import mediacore.lib.render_cache
+        log = logging.getLogger(__name__)
+
+        while True:
+            try:
+                # Refetch the settings in case they've been changed
+                pylons.app_globals.settings.refresh()
+                changed = rank_media(DBSession)
+                DBSession.commit()
+            except Exception, e:
+                DBSession.rollback()
+                if not self.options.interval:
+                    raise
+                # Keep running, and try again at the next interval
+                log.exception(e)
+            else:
+                notify_ranked(changed)
+                if self.verbose:
+                    print 'Updated the popularity of %d media.' % len(changed)
+            if not self.options.interval:
+                break
+            time.sleep(self.options.interval)
+
+class ProcessJobsCommand(LoadAppCommand):
+    """Run the queued background jobs.
+
+    Jobs are only queued when the job_queue option is enabled in the
+    config file. By default every job that's ready is run and the command
+    exits, so it can be scheduled with cron. Alternatively, pass
+    --interval to keep running and check for new jobs every so many
+    seconds. Several workers may be run at once.
+    """
+    summary = __doc__.splitlines()[0]
+    usage = '[CONFIG_FILE]'
+    group_name = 'mediacore'
+
+    parser = load_app_parser()
+    parser.add_option('--interval',
+                      dest='interval',
+                      type='int',
+                      metavar='SECONDS',
+                      default=None,
+                      help="Keep running, checking for jobs every SECONDS seconds")
+    parser.add_option('--limit',
+                      dest='limit',
+                      type='int',
+                      default=None,
+                      help="Run at most this many jobs at a time")
+
+    def __init__(self, name):
+        LoadAppCommand.__init__(self, name, self.summary)
+
+    def command(self):
+        LoadAppCommand.command(self)
+        import time
+        from mediacore.lib.jobs import process_jobs
+        from mediacore.model.meta import DBSession
+        # Register the job handlers
+        import mediacore.lib.email
+        import mediacore.lib.mediafiles
+
+        while True:
+            try:
+                # Refetch the settings in case they've been changed
+                pylons.app_globals.settings.refresh()
+                succeeded, failed = process_jobs(DBSession,
+                                                 self.options.limit)
+            except:
+                DBSession.rollback()
+                raise
+            if self.verbose and (succeeded or failed):
+                print 'Ran %d jobs, %d failed.' % (succeeded + failed, failed)
+            if not self.options.interval:
+                break
+            time.sleep(self.options.interval)
+
+class ReconcileCommentCountsCommand(LoadAppCommand):
+    """Recount the comments of every media item.
+
+    The comment counts are kept up to date as comments are saved through
+    MediaCore, so this is only needed after comments have been changed
+    in the database directly.
+    """
+    summary = __doc__.splitlines()[0]
+    usage = '[CONFIG_FILE]'
+    group_name = 'mediacore'
+
+    parser = load_app_parser()
+
+    def __init__(self, name):
+        LoadAppCommand.__init__(self, name, self.summary)
+
+    def command(self):
+        LoadAppCommand.command(self)
+        from mediacore.lib.cache import bump_version
+        from mediacore.model.comments import reconcile_comment_counts
+        from mediacore.model.meta import DBSession
+
+        try:
+            updated = reconcile_comment_counts(DBSession)
+            DBSession.commit()
+        except:
+            DBSession.rollback()
+            raise
+        # The counts are shown on cached pages
+        bump_version('media')
+        if self.verbose:
+            print 'Recounted the comments of %d media.' % updated
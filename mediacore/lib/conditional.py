@@ -0,0 +1,180 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Conditional GET
+
+Feed readers, crawlers and API clients poll the same URLs over and over.
+The :class:`conditional` decorator sends ``ETag`` and ``Last-Modified``
+headers with each response, and when the client already has the current
+version, it responds with ``304 Not Modified`` before the action runs::
+
+    def media_validators(slug, **kwargs):
+        row = DBSession.query(Media.modified_on)\\
+            .filter(Media.slug == slug).first()
+        if row is None:
+            return None
+        return row.modified_on, slug
+
+    class MediaController(BaseController):
+        @conditional(media_validators)
+        @expose('media/view.html')
+        def view(self, slug, **kwargs):
+            ...
+
+The validators function is passed the same keyword arguments as the
+action. It should run cheap queries only, and return a 2-tuple of the
+last modified time of everything the response depends on and any value
+that identifies the response, from which the ETag is derived, or None to
+skip the check.
+
+"""
+
+import hashlib
+import time
+from datetime import datetime
+from email.utils import formatdate, mktime_tz, parsedate_tz
+
+import webob.exc
+from pylons import request, response
+from sqlalchemy import sql
+
+__all__ = ['check_conditions', 'conditional', 'last_publish_change', 'latest']
+
+def _http_date(dt):
+    return formatdate(time.mktime(dt.timetuple()), usegmt=True)
+
+def _parse_http_date(value):
+    try:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return mktime_tz(parsed)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def _etag_matches(etag, header):
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def check_conditions(last_modified=None, etag=None):
+    """Set the validators on the response, or raise 304 if they match.
+
+    If the request has an ``If-None-Match`` header, only the ETag is
+    compared, otherwise ``If-Modified-Since`` is compared to the last
+    modified time, to the second.
+
+    :param last_modified: A naive local :class:`datetime.datetime`.
+    :param etag: A quoted ETag string.
+    :raises webob.exc.HTTPNotModified: If the client has this version.
+
+    """
+    headers = []
+    if etag is not None:
+        headers.append(('ETag', etag))
+    if last_modified is not None:
+        headers.append(('Last-Modified', _http_date(last_modified)))
+
+    if request.method in ('GET', 'HEAD'):
+        if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_none_match:
+            not_modified = etag is not None \
+                and _etag_matches(etag, if_none_match)
+        elif if_modified_since and last_modified is not None:
+            since = _parse_http_date(if_modified_since)
+            not_modified = since is not None \
+                and int(time.mktime(last_modified.timetuple())) <= since
+        else:
+            not_modified = False
+        if not_modified:
+            raise webob.exc.HTTPNotModified(headers=headers)
+
+    for name, value in headers:
+        response.headers[name] = value
+
+class conditional(object):
+    """Respond with 304 Not Modified if the client's copy is current.
+
+    :param validators: A callable which is passed the action's keyword
+        arguments and returns ``(last_modified, etag_value)`` or None.
+    :param on_not_modified: An optional callable which is passed the
+        action's keyword arguments before a 304 is returned, for any
+        side effects of the action which must still happen.
+
+    """
+    def __init__(self, validators, on_not_modified=None):
+        self.validators = validators
+        self.on_not_modified = on_not_modified
+
+    def __call__(self, func):
+        from mediacore.lib.decorators import _copy_func_attrs
+        def conditional_wrapper(*args, **kwargs):
+            result = self.validators(**kwargs)
+            if result is not None:
+                last_modified, value = result
+                identity = request.environ.get('repoze.who.identity') or {}
+                etag = '"%s"' % hashlib.sha1(repr((
+                    func.__name__,
+                    last_modified,
+                    value,
+                    identity.get('repoze.who.userid'),
+                ))).hexdigest()
+                try:
+                    check_conditions(last_modified, etag)
+                except webob.exc.HTTPNotModified:
+                    if self.on_not_modified is not None:
+                        self.on_not_modified(**kwargs)
+                    raise
+            return func(*args, **kwargs)
+        _copy_func_attrs(func, conditional_wrapper)
+        return conditional_wrapper
+
+def last_publish_change(query, now=None):
+    """Return the latest time a media item entered or left its publishing
+    window, which doesn't change its ``modified_on``.
+
+    :param query: A :class:`~mediacore.model.media.MediaQuery` filtered
+        for the media to consider, before filtering for published media.
+    :param now: The current datetime.
+    :rtype: :class:`datetime.datetime` or None
+
+    """
+    from mediacore.model import Media
+    if now is None:
+        now = datetime.now()
+    publishable = query.filter(sql.and_(Media.reviewed == True,
+                                        Media.encoded == True,
+                                        Media.publishable == True))
+    published = publishable\
+        .filter(Media.publish_on <= now)\
+        .value(sql.func.max(Media.publish_on))
+    unpublished = publishable\
+        .filter(Media.publish_until <= now)\
+        .value(sql.func.max(Media.publish_until))
+    boundaries = [d for d in (published, unpublished) if d]
+    return boundaries and max(boundaries) or None
+
+def latest(*dates):
+    """Return the latest of the given dates, ignoring any Nones."""
+    dates = [d for d in dates if d is not None]
+    return dates and max(dates) or None
@@ -0,0 +1,122 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cached Result Counts
+
+Every page of a paginated listing counts all the results of its query to
+number the pages, and a ``COUNT(*)`` over a search or a tag join costs
+about as much as fetching the page itself. :func:`count_results` keeps
+those counts in a beaker cache, so that paging through the same listing
+only counts it once::
+
+    @paginate('media', items_per_page=20, count=count_results)
+    def index(self, page=1, **kwargs):
+        ...
+
+Counts are keyed on the SQL and parameters of the query, without its
+ordering, and on the ``media`` and ``comments`` version stamps, which are
+bumped whenever media or comments are changed through the ORM, or enter
+or leave their publishing window. Queries filtered by a time relative to
+now should round it, so that their key doesn't change on every request.
+
+Counting every result of a large library is still slow the first time.
+With the ``result_count_limit`` option, counting stops after that many
+results, and the count is returned as an :class:`ApproximateCount`, which
+reads as ``1000+``. Paginators number that many results' worth of pages,
+and link past them with a cursor.
+
+The cache is configured with these options in your ini file:
+
+    result_count_cache
+        ``memory`` (the default), ``file`` to share the cache between
+        processes using beaker's file storage, or ``none`` to disable it.
+    result_count_expire
+        The number of seconds to keep a count for, defaults to 60.
+    result_count_limit
+        The number of results to stop counting at, or 0 (the default) to
+        always count them all.
+
+"""
+
+import hashlib
+
+from paste.deploy.converters import asint
+from pylons import app_globals, config
+from sqlalchemy import sql
+
+from mediacore.lib.cache import get_versions
+
+__all__ = ['ApproximateCount', 'count_results']
+
+class ApproximateCount(int):
+    """A lower bound on the number of results, which reads as ``1000+``."""
+    is_approximate = True
+
+    def __str__(self):
+        return '%d+' % self
+
+    def __unicode__(self):
+        return u'%d+' % self
+
+def _get_cache(namespace):
+    cache_type = config.get('result_count_cache', 'memory')
+    if cache_type == 'none':
+        return None
+    return app_globals.cache.get_cache(namespace, type=cache_type,
+        expire=asint(config.get('result_count_expire', 60)))
+
+def _query_key(query):
+    """Return the SQL and parameters of the query, without its ordering."""
+    statement = query.order_by(None).statement
+    compiled = statement.compile(bind=query.session.bind)
+    return unicode(compiled), sorted(compiled.params.iteritems())
+
+def _count(query, limit):
+    query = query.order_by(None)
+    if not limit:
+        return query.count()
+    count = query.limit(limit + 1)\
+        .from_self(sql.func.count(sql.literal_column('*')))\
+        .scalar()
+    if count > limit:
+        return ApproximateCount(limit)
+    return count
+
+def count_results(query, versions=('media', 'comments'), limit=None):
+    """Return the number of results of the query, from cache if possible.
+
+    :param query: A :class:`sqlalchemy.orm.Query`.
+    :param versions: The names of the version stamps which invalidate
+        the cached count.
+    :param limit: The number of results to stop counting at, or 0 to
+        count them all. Defaults to the ``result_count_limit`` option.
+    :rtype: int or :class:`ApproximateCount`
+
+    """
+    if limit is None:
+        limit = asint(config.get('result_count_limit', 0))
+    cache = _get_cache('result_counts')
+    if cache is None:
+        return _count(query, limit)
+
+    statement, params = _query_key(query)
+    key = hashlib.sha1(repr((
+        statement,
+        params,
+        limit,
+        get_versions(*versions),
+    ))).hexdigest()
+    return cache.get(key=key, createfunc=lambda: _count(query, limit))
@@ -24,9 +24,10 @@ from pylons import config, request, response, tmpl_context
 from pylons.templating import render_genshi as render
 from pylons.decorators import jsonify
 
+from mediacore.lib.conditional import conditional
 from mediacore.lib.paginate import paginate
 
-__all__ = ['expose', 'expose_xhr', 'paginate', 'validate']
+__all__ = ['conditional', 'expose', 'expose_xhr', 'paginate', 'validate']
 
 _func_attrs = [
     # Attributes that define useful information or context for functions
@@ -52,7 +53,7 @@ def _get_func_attrs(f):
         result[x] = getattr(f, x, (None,))
     return result
 
-def _expose_wrapper(f, template):
+def _expose_wrapper(f, template, cache=None):
     """Returns a function that will render the passed in function according
     to the passed in template"""
     f.exposed = True
@@ -63,7 +64,7 @@ def _expose_wrapper(f, template):
     elif template == "string":
         return f
 
-    def wrapped_f(*args, **kwargs):
+    def render_f(*args, **kwargs):
         result = f(*args, **kwargs)
 
         extra_vars = {
@@ -97,9 +98,15 @@ def _expose_wrapper(f, template):
                 response.content_type = 'application/xhtml+xml'
 
         return render(tmpl, extra_vars=extra_vars)
+
+    if cache is None:
+        return render_f
+
+    def wrapped_f(*args, **kwargs):
+        return cache(template, render_f, args, kwargs)
     return wrapped_f
 
-def expose(template='string'):
+def expose(template='string', cache=None):
     """Simple expose decorator for controller actions.
 
     Transparently wraps a method in a function that will render the method's
@@ -124,15 +131,18 @@ def expose(template='string'):
             * 'string'
             * 'json'
     :type template: string or unicode
+    :param cache: Optionally, a
+        :class:`~mediacore.lib.render_cache.RenderCache` to serve the
+        rendered genshi template from for anonymous visitors.
 
     """
     def wrap(f):
-        wrapped_f = _expose_wrapper(f, template)
+        wrapped_f = _expose_wrapper(f, template, cache)
         _copy_func_attrs(f, wrapped_f)
         return wrapped_f
     return wrap
 
-def expose_xhr(template_norm='string', template_xhr='json'):
+def expose_xhr(template_norm='string', template_xhr='json', cache=None):
     """
     Expose different templates for normal vs XMLHttpRequest requests.
 
@@ -144,10 +154,12 @@ def expose_xhr(template_norm='string', template_xhr='json'):
             def sample_action(self, *args):
                 # do something
                 return dict(items=get_items_list())
+
+    The optional ``cache`` is used for both templates, see :func:`expose`.
     """
     def wrap(f):
-        norm = _expose_wrapper(f, template_norm)
-        xhr = _expose_wrapper(f, template_xhr)
+        norm = _expose_wrapper(f, template_norm, cache)
+        xhr = _expose_wrapper(f, template_xhr, cache)
 
         def choose(*args, **kwargs):
             if request.is_xhr:
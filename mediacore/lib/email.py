@@ -24,6 +24,8 @@ Email Helpers
 
 .. autofunc:: send_media_notification
 
+.. autofunc:: queue_media_notification
+
 .. autofunc:: send_comment_notification
 
 .. autofunc:: parse_email_string
@@ -35,6 +37,7 @@ import smtplib
 from pylons import app_globals
 
 from mediacore.lib.helpers import line_break_xhtml, strip_xhtml, url_for
+from mediacore.lib.jobs import enqueue, job_handler
 
 def parse_email_string(string):
     """Take a comma separated string of emails and return a list."""
@@ -65,14 +68,15 @@ def send(to_addr, from_addr, subject, body):
     server.quit()
 
 
-def send_media_notification(media_obj):
+def send_media_notification(media_obj, edit_url=None):
     send_to = app_globals.settings['email_media_uploaded']
     if not send_to:
         # media notification emails are disabled!
         return
 
-    edit_url = url_for(controller='/admin/media', action='edit',
-                       id=media_obj.id, qualified=True),
+    if edit_url is None:
+        edit_url = url_for(controller='/admin/media', action='edit',
+                           id=media_obj.id, qualified=True)
 
     clean_description = strip_xhtml(
             line_break_xhtml(line_break_xhtml(media_obj.description)))
@@ -92,6 +96,20 @@ Description: %s
 
     send(send_to, app_globals.settings['email_send_from'], subject, body)
 
+def queue_media_notification(media_obj):
+    """Send the media notification email from a background job.
+
+    The admin URL is worked out now, since a worker doesn't know the
+    hostname that the site is served from.
+    """
+    edit_url = url_for(controller='/admin/media', action='edit',
+                       id=media_obj.id, qualified=True)
+    return enqueue('media_notification', media_obj, edit_url=edit_url)
+
+@job_handler('media_notification')
+def _media_notification_job(media_obj, edit_url):
+    send_media_notification(media_obj, edit_url)
+
 def send_comment_notification(media, comment):
     send_to = app_globals.settings['email_comment_posted']
     if not send_to:
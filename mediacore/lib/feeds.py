@@ -0,0 +1,224 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pre-rendered Podcast Feeds
+
+Feed readers poll our podcast feeds constantly, and the feeds change far
+less often than they're requested. :func:`cached_feed` stores the rendered
+XML for each podcast in ``<cache_dir>/feeds`` and serves those bytes until
+an episode is added, edited or removed, or a publishing window opens or
+closes.
+
+Changes are detected by a :data:`~mediacore.model.events.change_notifier`
+listener, which bumps the version stamp of the affected podcasts' feeds
+and deletes their files. Publishing windows are handled by storing the
+time of the next publish or unpublish in the file name, after which the
+feed is rendered again.
+
+Feeds contain fully qualified URLs, so they're rendered during a request
+to the feed, and stored separately for each host name they're requested
+from.
+
+"""
+
+import glob
+import hashlib
+import os
+import time
+from datetime import datetime
+
+import pylons.templating
+from genshi import XML
+from pylons import config, request
+from sqlalchemy import sql
+
+from mediacore.lib.cache import bump_version, get_versions
+from mediacore.model import DBSession, Media, MediaFile, Podcast, Setting, Tag
+from mediacore.model.events import change_notifier
+from mediacore.model.media import media, media_files
+
+__all__ = ['cached_feed', 'delete_feeds', 'render_feed']
+
+feed_template = 'podcasts/feed.xml'
+feed_length = 25
+
+# Media attributes which don't appear in feeds
+_ignored_media_attrs = set(['views', 'likes', 'popularity_points',
+                            'popularity_likes', 'popularity_dislikes',
+                            'comments', 'modified_on'])
+
+def _feed_dir():
+    return os.path.join(config['cache_dir'], 'feeds')
+
+def _feed_key(podcast_id):
+    """Return a key for the current host and version of the given feed."""
+    return hashlib.sha1(repr((
+        request.host_url,
+        request.script_name,
+        get_versions('feeds', 'feeds-%d' % podcast_id),
+    ))).hexdigest()[:16]
+
+def render_feed(podcast):
+    """Render the RSS feed for the given podcast.
+
+    :param podcast: A :class:`~mediacore.model.podcasts.Podcast` instance.
+    :rtype: unicode
+
+    """
+    episodes = podcast.media.published()\
+        .order_by(Media.publish_on.desc())[:feed_length]
+    tmpl = os.path.join(config['genshi_search_path'], feed_template)
+    return pylons.templating.render_genshi(tmpl, extra_vars=dict(
+        XML = XML,
+        podcast = podcast,
+        episodes = episodes,
+    ))
+
+def _next_publish_change(podcast_id, now):
+    publishable = sql.and_(media.c.podcast_id == podcast_id,
+                           media.c.reviewed == True,
+                           media.c.encoded == True,
+                           media.c.publishable == True)
+    next_publish = DBSession.execute(
+        sql.select([sql.func.min(media.c.publish_on)],
+                   sql.and_(publishable, media.c.publish_on > now))
+    ).scalar()
+    next_unpublish = DBSession.execute(
+        sql.select([sql.func.min(media.c.publish_until)],
+                   sql.and_(publishable, media.c.publish_until > now))
+    ).scalar()
+    boundaries = [d for d in (next_publish, next_unpublish) if d]
+    return boundaries and min(boundaries) or None
+
+def cached_feed(podcast):
+    """Return the feed XML for the given podcast, rendering it if necessary.
+
+    :param podcast: A :class:`~mediacore.model.podcasts.Podcast` instance.
+    :rtype: str
+    :returns: The UTF-8 encoded XML.
+
+    """
+    feed_dir = _feed_dir()
+    prefix = '%d-%s-' % (podcast.id, _feed_key(podcast.id))
+    now = time.time()
+    for path in glob.glob(os.path.join(feed_dir, prefix + '*.xml')):
+        expires = int(os.path.basename(path)[len(prefix):-4])
+        if expires and expires <= now:
+            _remove(path)
+            continue
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            # It was deleted by a change in another thread or process
+            continue
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    xml = render_feed(podcast).encode('utf-8')
+    expires = _next_publish_change(podcast.id, datetime.fromtimestamp(now))
+    if expires:
+        expires = int(time.mktime(expires.timetuple()))
+    else:
+        expires = 0
+
+    if not os.path.isdir(feed_dir):
+        try:
+            os.makedirs(feed_dir)
+        except OSError:
+            # Another process may have just created it
+            if not os.path.isdir(feed_dir):
+                raise
+    path = os.path.join(feed_dir, '%s%d.xml' % (prefix, expires))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(xml)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+    return xml
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def delete_feeds(podcast_ids=None):
+    """Invalidate and delete the stored feeds of the given podcasts.
+
+    :param podcast_ids: A list of podcast IDs, or None for all podcasts.
+
+    """
+    if podcast_ids is None:
+        bump_version('feeds')
+        patterns = ['*.xml']
+    else:
+        bump_version(*['feeds-%d' % id for id in podcast_ids])
+        patterns = ['%d-*.xml' % id for id in podcast_ids]
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(_feed_dir(), pattern)):
+            _remove(path)
+
+def _feeds_changed(changes):
+    """Delete the feeds which include any of the changed objects."""
+    # Tags and settings can affect every feed
+    if Tag in changes or Setting in changes:
+        delete_feeds()
+        return
+
+    podcast_ids = set(changes.get(Podcast, {}))
+    media_ids = []
+    for media_id, keys in changes.get(Media, {}).iteritems():
+        if keys is None or 'podcast' in keys or 'podcast_id' in keys:
+            # Media was inserted, deleted or moved from one podcast to
+            # another, and we don't know which podcast it used to be in
+            delete_feeds()
+            return
+        if keys - _ignored_media_attrs:
+            media_ids.append(media_id)
+    file_ids = []
+    for file_id, keys in changes.get(MediaFile, {}).iteritems():
+        if keys is None:
+            delete_feeds()
+            return
+        file_ids.append(file_id)
+
+    # The transaction has been committed, so look up the podcasts with a
+    # connection of our own rather than starting a new one on the session
+    conn = DBSession.bind.connect()
+    try:
+        if media_ids:
+            podcast_ids.update(row[0] for row in conn.execute(
+                sql.select([media.c.podcast_id],
+                           sql.and_(media.c.id.in_(media_ids),
+                                    media.c.podcast_id != None),
+                           distinct=True)))
+        if file_ids:
+            podcast_ids.update(row[0] for row in conn.execute(
+                sql.select([media.c.podcast_id],
+                           sql.and_(media_files.c.id.in_(file_ids),
+                                    media_files.c.media_id == media.c.id,
+                                    media.c.podcast_id != None),
+                           distinct=True)))
+    finally:
+        conn.close()
+    if podcast_ids:
+        delete_feeds(podcast_ids)
+
+change_notifier.listen(_feeds_changed, Media, MediaFile, Podcast, Setting, Tag)
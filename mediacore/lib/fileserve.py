@@ -0,0 +1,301 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Media File Serving
+
+Media files are large, and a Python worker that streams one is tied up
+until the download finishes. The ``file_serve_method`` option in your ini
+file decides who does the streaming:
+
+    apache_xsendfile
+        Apache's mod_xsendfile, given the file's path in an ``X-Sendfile``
+        header.
+    nginx_redirect
+        nginx, given the file's URI in an ``X-Accel-Redirect`` header. See
+        :func:`x_accel_path`.
+    default
+        :class:`FileServer`, which hands the file to the WSGI server's
+        ``wsgi.file_wrapper`` so that servers which support it can use
+        ``sendfile()``.
+
+In every case clients can resume downloads and seek through video with
+``Range`` requests.
+
+Before any of that, :func:`served_file` looks up the file's details from
+its URL. The details are kept in memory until the ``media`` version stamp
+is bumped, so that most downloads start without a database query.
+
+"""
+
+import os
+import urllib
+from email.utils import formatdate, mktime_tz, parsedate_tz
+
+from pylons import app_globals, config
+from sqlalchemy import sql
+
+from mediacore.lib.cache import get_versions
+from mediacore.model import Media, MediaFile
+
+__all__ = ['FileServer', 'parse_range', 'served_file', 'x_accel_path']
+
+def _lookup_file(slug, id, container):
+    file = MediaFile.query.join(MediaFile.media)\
+        .filter(sql.and_(Media.slug == slug,
+                         MediaFile.id == id,
+                         MediaFile.container == container))\
+        .first()
+    if file is None:
+        return None
+    if file.url:
+        redirect_url = file.url.encode('utf-8')
+    elif file.embed:
+        redirect_url = file.link_url().encode('utf-8')
+    else:
+        redirect_url = None
+    return {
+        'path': file.file_path and file.file_path.encode('utf-8'),
+        'mimetype': file.mimetype.encode('utf-8'),
+        'display_name': file.display_name.encode('utf-8'),
+        'redirect_url': redirect_url,
+    }
+
+def served_file(slug, id, container):
+    """Return what's needed to serve a media file, from cache if possible.
+
+    :param slug: The media :attr:`~mediacore.model.media.Media.slug`.
+    :param id: The :class:`~mediacore.model.media.MediaFile` ID.
+    :param container: The file's
+        :attr:`~mediacore.model.media.MediaFile.container`.
+    :returns: None if there's no such file, otherwise a dict of UTF-8
+        encoded strings: ``path``, ``mimetype``, ``display_name``, and
+        ``redirect_url`` for files hosted elsewhere, otherwise None.
+
+    """
+    cache = app_globals.cache.get_cache('served_files', type='memory',
+                                        expire=3600)
+    key = '%s-%d-%s-%s' % (slug, id, container, get_versions('media'))
+    return cache.get(key=key.encode('utf-8'),
+                     createfunc=lambda: _lookup_file(slug, id, container))
+
+def parse_range(header, size):
+    """Parse a ``Range`` header for a file of the given size.
+
+    Only a single range is supported; requests for several ranges at once
+    are rare enough that they get the whole file, as HTTP allows.
+
+    :param header: The value of the ``Range`` header.
+    :param size: The size of the file in bytes.
+    :returns: A ``(first, last)`` tuple of inclusive byte offsets, None if
+        the whole file should be sent, or False if the range can't be
+        satisfied.
+
+    """
+    units, _, ranges = header.partition('=')
+    if units.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # A suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        first = int(first)
+        if last:
+            last = int(last)
+            if first > last:
+                return None
+        else:
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        return False
+    return first, min(last, size - 1)
+
+def x_accel_path(file_path):
+    """Return the nginx URI of a file in the ``media_dir``.
+
+    nginx maps the ``nginx_serve_path`` option, which defaults to
+    ``/__mediacore_files__``, to the ``media_dir`` with an internal
+    location::
+
+        location /__mediacore_files__/ {
+            internal;
+            alias /path/to/mediacore/data/media/;
+        }
+
+    :param file_path: The absolute path to a file.
+    :returns: The URI, or None if the file is outside the ``media_dir``.
+
+    """
+    media_dir = os.path.abspath(config['media_dir'])
+    file_path = os.path.abspath(file_path)
+    if not file_path.startswith(media_dir + os.sep):
+        return None
+    relative = file_path[len(media_dir) + 1:].replace(os.sep, '/')
+    prefix = config.get('nginx_serve_path', '/__mediacore_files__')
+    return '%s/%s' % (prefix.rstrip('/'), urllib.quote(relative))
+
+def _http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+def _parse_http_date(value):
+    try:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return mktime_tz(parsed)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+class _FileIter(object):
+    """Iterate over ``length`` bytes of a file, starting at its position."""
+
+    def __init__(self, f, length, chunk_size):
+        self.f = f
+        self.remaining = length
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        chunk = self.f.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            raise StopIteration
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self.f.close()
+
+class FileServer(object):
+    """A WSGI app serving a single file, with support for ranges.
+
+    Unlike :class:`paste.fileapp.FileApp`, the response body is handed to
+    ``wsgi.file_wrapper`` whenever it runs to the end of the file, which
+    includes the ``Range: bytes=N-`` requests browsers send when seeking
+    through video.
+
+    :param path: The path to the file.
+    :param content_type: The mimetype to serve it as.
+    :param headers: A list of extra ``(name, value)`` headers to send.
+    :param chunk_size: The number of bytes to read at a time.
+
+    """
+    def __init__(self, path, content_type, headers=None,
+                 chunk_size=64 * 1024):
+        self.path = path
+        self.content_type = content_type
+        self.headers = list(headers or [])
+        self.chunk_size = chunk_size
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed',
+                           [('Allow', 'GET, HEAD'),
+                            ('Content-Type', 'text/plain')])
+            return ['Method not allowed']
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['File not found']
+
+        try:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            mtime = int(stat.st_mtime)
+            etag = '"%x-%x"' % (mtime, size)
+            headers = self.headers + [
+                ('Accept-Ranges', 'bytes'),
+                ('ETag', etag),
+                ('Last-Modified', _http_date(mtime)),
+            ]
+
+            if self._not_modified(environ, etag, mtime):
+                f.close()
+                start_response('304 Not Modified', headers)
+                return []
+
+            byte_range = None
+            if 'HTTP_RANGE' in environ \
+                    and self._range_applies(environ, etag, mtime):
+                byte_range = parse_range(environ['HTTP_RANGE'], size)
+
+            if byte_range is False:
+                f.close()
+                headers += [('Content-Range', 'bytes */%d' % size),
+                            ('Content-Length', '0')]
+                start_response('416 Requested Range Not Satisfiable', headers)
+                return []
+
+            if byte_range is None:
+                status = '200 OK'
+                first, last = 0, size - 1
+            else:
+                status = '206 Partial Content'
+                first, last = byte_range
+                headers.append(('Content-Range',
+                                'bytes %d-%d/%d' % (first, last, size)))
+            length = last - first + 1
+            headers += [
+                ('Content-Type', self.content_type),
+                ('Content-Length', str(length)),
+            ]
+            start_response(status, headers)
+
+            if method == 'HEAD' or length <= 0:
+                f.close()
+                return []
+            if first:
+                f.seek(first)
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if file_wrapper is not None and last == size - 1:
+                return file_wrapper(f, self.chunk_size)
+            return _FileIter(f, length, self.chunk_size)
+        except:
+            f.close()
+            raise
+
+    def _not_modified(self, environ, etag, mtime):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if since:
+            since = _parse_http_date(since)
+            return since is not None and mtime <= since
+        return False
+
+    def _range_applies(self, environ, etag, mtime):
+        """Return False if an ``If-Range`` header says the file changed."""
+        if_range = environ.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        since = _parse_http_date(if_range)
+        return since is not None and mtime <= since
@@ -20,7 +20,6 @@ available to Controllers. This module is available to templates as 'h'.
 import hashlib
 import os
 import re
-import shutil
 import time
 from datetime import datetime
 from urllib import quote, unquote, urlencode
@@ -43,6 +42,7 @@ from mediacore.lib.htmlsanitizer import Cleaner, entities_to_unicode as decode_e
 from mediacore.lib.filetypes import AUDIO, AUDIO_DESC, CAPTIONS, VIDEO, accepted_extensions, guess_mimetype
 from mediacore.lib.thumbnails import thumb, thumb_url
 from mediacore.lib.players import pick_media_file_player
+from mediacore.lib.storage import LocalStorage
 
 imports = [
     'any', 'containers', 'date', 'decode_entities', 'encode_entities',
@@ -431,19 +431,27 @@ def embeddable_player(media):
     Since this returns a plain string, it is automatically escaped by Genshi
     when called in a template.
 
+    The rendered player is cached until the media or settings change, see
+    :func:`mediacore.lib.render_cache.cached_fragment`.
+
     :param media: The item to embed
     :type media: :class:`mediacore.model.media.Media` instance
     :returns: Unicode XHTML
     :rtype: :class:`webhelpers.html.builder.literal`
 
     """
-    xhtml = pylons.templating.render_genshi(
-        'media/_embeddable_player.html',
-        extra_vars=dict(media=media),
-        method='xhtml'
-    )
-    xhtml = spaces_between_tags.sub(literal('><'), xhtml)
-    return xhtml.strip()
+    from mediacore.lib.render_cache import cached_fragment
+    def render_player():
+        xhtml = pylons.templating.render_genshi(
+            'media/_embeddable_player.html',
+            extra_vars=dict(media=media),
+            method='xhtml'
+        )
+        xhtml = spaces_between_tags.sub(literal('><'), xhtml)
+        return xhtml.strip()
+    return cached_fragment('embeddable_player',
+                           (media.id, request.host_url, request.script_name),
+                           render_player)
 
 def get_featured_category():
     from mediacore.model import Category
@@ -518,14 +526,10 @@ def delete_files(paths, subdir=None):
     deleted_dir = config.get('deleted_files_dir', None)
     if deleted_dir and subdir:
         deleted_dir = os.path.join(deleted_dir, subdir)
-    if deleted_dir and not os.path.exists(deleted_dir):
-        os.mkdir(deleted_dir)
     for path in paths:
-        if path and os.path.exists(path):
-            if deleted_dir:
-                shutil.move(path, deleted_dir)
-            else:
-                os.remove(path)
+        if path:
+            storage = LocalStorage(os.path.dirname(path), deleted_dir)
+            storage.delete(os.path.basename(path))
 
 def store_transient_message(cookie_name, text, time=None, path='/', **kwargs):
     """Store a JSON message dict in the named cookie.
@@ -0,0 +1,219 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background Jobs
+
+Slow work that doesn't need to finish before the response is sent, such
+as transferring a new upload to remote storage, downloading thumbnails
+for embedded video, or sending notification emails, is queued as a
+:class:`~mediacore.model.jobs.Job`::
+
+    enqueue('media_notification', media, edit_url=edit_url)
+
+Jobs are saved in the ``jobs`` table along with the rest of the request's
+changes, and run by one or more workers started with::
+
+    paster process-jobs deployment.ini --interval 5
+
+The queue is enabled with the ``job_queue`` option in your ini file. When
+it's disabled, which is the default, :func:`enqueue` runs each job right
+away instead, so that no worker is needed.
+
+Failed jobs are retried up to ``job_max_attempts`` times, waiting
+``job_retry_delay`` seconds longer before each attempt.
+
+"""
+
+import os
+import socket
+import traceback
+from datetime import datetime, timedelta
+
+import simplejson as json
+from paste.deploy.converters import asbool, asint
+from pylons import config
+from sqlalchemy import sql
+
+from mediacore.model.jobs import DONE, FAILED, QUEUED, RUNNING, Job, jobs
+from mediacore.model.meta import DBSession
+
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'enqueue',
+    'job_handler',
+    'job_status',
+    'process_jobs',
+    'queue_enabled',
+]
+
+# Handlers registered with job_handler, keyed by job type
+_handlers = {}
+
+def job_handler(type):
+    """Register the decorated function as the handler for a type of job.
+
+    The handler is passed the job's media, or None, and the keyword
+    arguments given to :func:`enqueue`. It may return a callable to be
+    called once the job's changes have been committed, for cleanup that
+    can't be undone.
+
+    """
+    def register(func):
+        _handlers[type] = func
+        return func
+    return register
+
+def queue_enabled():
+    return asbool(config.get('job_queue', False))
+
+def enqueue(type, media=None, **kwargs):
+    """Queue a job to be run by a worker.
+
+    :param type: The type of job, as registered with :func:`job_handler`.
+    :param media: The :class:`~mediacore.model.media.Media` the job is
+        for, if any. The job is deleted along with it.
+    :param \*\*kwargs: Arguments for the handler. They must be JSON
+        serializable.
+    :returns: The :class:`~mediacore.model.jobs.Job`, or None if the
+        queue is disabled and the job was run right away.
+
+    """
+    if not queue_enabled():
+        after_commit = _handlers[type](media, **kwargs)
+        if after_commit is not None:
+            after_commit()
+        return None
+    job = Job(type, media, unicode(json.dumps(kwargs)))
+    DBSession.add(job)
+    return job
+
+def job_status(job_ids):
+    """Return the status of the given jobs, for polling.
+
+    :returns: A list of dicts with the ``id``, ``type``, ``status`` and
+        ``finished`` flag of each job that still exists.
+
+    """
+    if not job_ids:
+        return []
+    return [dict(id=job.id, type=job.type, status=job.status,
+                 finished=job.finished)
+            for job in Job.query.filter(Job.id.in_(job_ids))]
+
+def _worker_name():
+    return u'%s:%d' % (socket.gethostname(), os.getpid())
+
+def _claim_job(session, worker):
+    """Claim the oldest job that's ready to run.
+
+    Another worker may claim the same job first, so the claim is a
+    conditional UPDATE that only one of them can win.
+
+    """
+    while True:
+        now = datetime.now()
+        job_id = session.query(Job.id)\
+            .filter(Job.status == QUEUED)\
+            .filter(sql.or_(Job.run_after == None, Job.run_after <= now))\
+            .order_by(Job.id)\
+            .limit(1)\
+            .scalar()
+        if job_id is None:
+            return None
+        result = session.execute(jobs.update()\
+            .where(sql.and_(jobs.c.id == job_id, jobs.c.status == QUEUED))\
+            .values(status=RUNNING, worker=worker, started_on=now,
+                    attempts=jobs.c.attempts + 1))
+        session.commit()
+        if result.rowcount == 1:
+            return session.query(Job).get(job_id)
+
+def _run_job(session, job, max_attempts, retry_delay):
+    job_id = job.id
+    try:
+        handler = _handlers.get(job.type, None)
+        if handler is None:
+            raise ValueError, 'Unknown job type: %r' % job.type
+        kwargs = dict((str(key), value) for key, value
+                      in json.loads(job.args or '{}').iteritems())
+        after_commit = handler(job.media, **kwargs)
+        job.status = DONE
+        job.error = None
+        job.finished_on = datetime.now()
+        session.commit()
+    except Exception, e:
+        log.exception(e)
+        session.rollback()
+        job = session.query(Job).get(job_id)
+        if job is None:
+            # Its media has been deleted
+            return False
+        job.error = traceback.format_exc().decode('utf-8', 'replace')
+        if job.attempts < max_attempts:
+            job.status = QUEUED
+            job.run_after = datetime.now() \
+                + timedelta(seconds=retry_delay * job.attempts)
+        else:
+            job.status = FAILED
+            job.finished_on = datetime.now()
+        session.commit()
+        return False
+    if after_commit is not None:
+        after_commit()
+    return True
+
+def _requeue_stale_jobs(session, timeout):
+    """Requeue jobs claimed by workers which seem to have died."""
+    cutoff = datetime.now() - timedelta(seconds=timeout)
+    session.execute(jobs.update()\
+        .where(sql.and_(jobs.c.status == RUNNING,
+                        jobs.c.started_on < cutoff))\
+        .values(status=QUEUED))
+
+def _delete_finished_jobs(session, max_age):
+    cutoff = datetime.now() - timedelta(seconds=max_age)
+    session.execute(jobs.delete()\
+        .where(sql.and_(jobs.c.status.in_([DONE, FAILED]),
+                        jobs.c.finished_on < cutoff)))
+
+def process_jobs(session, limit=None):
+    """Run the queued jobs that are ready, until there are none left.
+
+    :param session: The session to claim and run the jobs in. It's
+        committed after each job.
+    :param limit: The maximum number of jobs to run.
+    :returns: A ``(succeeded, failed)`` tuple of the number of jobs run.
+
+    """
+    worker = _worker_name()
+    max_attempts = asint(config.get('job_max_attempts', 3))
+    retry_delay = asint(config.get('job_retry_delay', 60))
+    _requeue_stale_jobs(session, asint(config.get('job_timeout', 3600)))
+    _delete_finished_jobs(session, asint(config.get('job_expire', 604800)))
+    session.commit()
+
+    succeeded = failed = 0
+    while limit is None or succeeded + failed < limit:
+        job = _claim_job(session, worker)
+        if job is None:
+            break
+        if _run_job(session, job, max_attempts, retry_delay):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
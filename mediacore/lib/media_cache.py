@@ -0,0 +1,169 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hot Media Cache
+
+Every view of a media page, and every like or comment posted to it, looks
+the media up by its slug. Rendering the page then lazily loads its podcast,
+files, fulltext, tags and categories with a query each. When one item is
+getting most of the traffic, those are the same queries over and over.
+
+:data:`media_cache` keeps the most recently requested media in the memory
+of each server process, along with everything their pages need. The cached
+copies are detached from any session. Each request is handed a copy merged
+into its own session without querying the database, so changes made during
+a request, such as counting a view, never leak into the cache.
+
+The cache is emptied when the ``media`` or ``comments`` version stamps are
+bumped. That happens whenever media, their files, podcasts, tags,
+categories or comments are changed through the ORM, by any process. See
+:mod:`mediacore.lib.cache`. Like the :mod:`rendered pages
+<mediacore.lib.render_cache>`, cached media don't see changes which
+bypass the ORM, such as view counts, until then. Call
+:meth:`MediaCache.invalidate` after making such changes if they need to
+show up right away.
+
+The number of media kept by each process is set with the
+``media_cache_size`` option in your ini file. It defaults to 200, and
+0 disables the cache.
+
+"""
+
+import threading
+
+import webob.exc
+from paste.deploy.converters import asint
+from pylons import config
+from sqlalchemy import orm
+
+from mediacore.lib.cache import get_versions
+from mediacore.model import Media, fetch_row
+from mediacore.model.meta import DBSession
+
+__all__ = ['MediaCache', 'media_cache']
+
+class MediaCache(object):
+    """A size-bounded cache of media by slug, which keeps those most
+    recently used.
+
+    :param size: The number of media to keep, or None to read the
+        ``media_cache_size`` option when first used.
+    :param versions: The names of the version stamps which invalidate
+        the cached media.
+
+    """
+    def __init__(self, size=None, versions=('media', 'comments')):
+        self.size = size
+        self.versions = tuple(versions)
+        self._version = None
+        self._entries = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def _get_size(self):
+        if self.size is None:
+            self.size = asint(config.get('media_cache_size', 200))
+        return self.size
+
+    def get(self, slug):
+        """Return the media with the given slug.
+
+        :param slug: A :attr:`~mediacore.model.media.Media.slug`.
+        :returns: A :class:`~mediacore.model.media.Media` instance in
+            :data:`~mediacore.model.meta.DBSession`, with its podcast,
+            files, fulltext, tags and categories loaded.
+        :raises webob.exc.HTTPNotFound: If there's no such media.
+
+        """
+        if not self._get_size():
+            return fetch_row(Media, slug=slug)
+        version = get_versions(*self.versions)
+        snapshot = None
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(slug, None)
+            if entry is not None and self._version == version:
+                self._clock += 1
+                entry[1] = self._clock
+                snapshot = entry[0]
+        finally:
+            self._lock.release()
+        if snapshot is None:
+            snapshot = self.load(slug)
+            self._store(slug, snapshot, version)
+        return DBSession.merge(snapshot, load=False)
+
+    def load(self, slug):
+        """Load the media and everything its page needs, detached.
+
+        A session of its own is used, so that none of the loaded objects
+        are shared with the current request.
+
+        :raises webob.exc.HTTPNotFound: If there's no such media.
+
+        """
+        session = DBSession.session_factory()
+        try:
+            media = session.query(Media)\
+                .options(orm.joinedload('podcast'),
+                         orm.joinedload('fulltext'),
+                         orm.subqueryload('files'),
+                         orm.subqueryload('tags'),
+                         orm.subqueryload('categories'))\
+                .filter(Media.slug == slug)\
+                .first()
+            if media is None:
+                raise webob.exc.HTTPNotFound
+            # Load the attributes which would otherwise be loaded lazily
+            # while rendering, as they can't be once the media is detached.
+            if media.podcast is not None:
+                media.podcast.media_count_published
+            for file in media.files:
+                file.media
+            return media
+        finally:
+            session.close()
+
+    def _store(self, slug, media, version):
+        self._lock.acquire()
+        try:
+            if self._version != version:
+                # Everything cached against the old version is stale
+                self._entries.clear()
+                self._version = version
+            self._clock += 1
+            self._entries[slug] = [media, self._clock]
+            size = self._get_size()
+            while len(self._entries) > size:
+                oldest = min(self._entries.iteritems(),
+                             key=lambda item: item[1][1])[0]
+                del self._entries[oldest]
+        finally:
+            self._lock.release()
+
+    def invalidate(self, slug=None):
+        """Discard the cached copy of the given media, or of all media."""
+        self._lock.acquire()
+        try:
+            if slug is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(slug, None)
+        finally:
+            self._lock.release()
+
+media_cache = MediaCache()
+"""The cache used by :class:`~mediacore.controllers.media.MediaController`."""
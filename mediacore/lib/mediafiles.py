@@ -14,10 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import formencode
-import ftplib
 import os
-import shutil
-import time
 import urllib2
 from cStringIO import StringIO
 
@@ -25,10 +22,12 @@ from paste.deploy.converters import asbool
 from pylons import app_globals, config
 from pylons.i18n import _
 
-from mediacore.lib.compat import sha1
 from mediacore.lib.filetypes import guess_container_format, guess_media_type
 from mediacore.lib.embedtypes import parse_embed_url
 from mediacore.lib.thumbnails import create_default_thumbs_for, create_thumbs_for, has_thumbs, has_default_thumbs, thumb_path
+from mediacore.lib.jobs import enqueue, job_handler, queue_enabled
+from mediacore.lib.storage import FTPUploadException, LocalStorage, get_storage, local_media_storage
+from mediacore.lib.uploads import ChunkedUpload
 from mediacore.model import Author, Media, MediaFile, get_available_slug
 from mediacore.model.meta import DBSession
 
@@ -41,9 +40,6 @@ __all__ = [
     'FTPUploadException',
 ]
 
-class FTPUploadException(formencode.Invalid):
-    pass
-
 def add_new_media_file(media, uploaded_file=None, url=None):
     """Create a new MediaFile for the provided Media object and File/URL
     and add it to that Media object's files list.
@@ -53,8 +49,10 @@ def add_new_media_file(media, uploaded_file=None, url=None):
 
     :param media: The Media object to append the file to
     :type media: :class:`~mediacore.model.media.Media` instance
-    :param uploaded_file: An object with 'filename' and 'file' properties.
-    :type uploaded_file: Formencode uploaded file object.
+    :param uploaded_file: An object with 'filename' and 'file' properties,
+        or a finished chunked upload.
+    :type uploaded_file: Formencode uploaded file object, or
+        :class:`~mediacore.lib.uploads.ChunkedUpload`.
     :param url: The URL to represent, if no file is given.
     :type url: unicode
     :returns: The created MediaFile (or None)
@@ -62,7 +60,11 @@ def add_new_media_file(media, uploaded_file=None, url=None):
     if uploaded_file is not None:
         # Create a MediaFile object, add it to the video, and store the file permanently.
         media_file = media_file_from_filename(uploaded_file.filename)
-        attach_and_store_media_file(media, media_file, uploaded_file.file)
+        if isinstance(uploaded_file, ChunkedUpload):
+            file = uploaded_file
+        else:
+            file = uploaded_file.file
+        attach_and_store_media_file(media, media_file, file)
     elif url is not None:
         # Looks like we were just given a URL. Create a MediaFile object with that URL.
         media_file, thumb_url, duration, title = media_file_from_url(url)
@@ -78,18 +80,8 @@ def add_new_media_file(media, uploaded_file=None, url=None):
 
         # Do we need to create thumbs for an embedded media item?
         if thumb_url \
-        and asbool(app_globals.settings['use_embed_thumbnails']) \
-        and (not has_thumbs(media) or has_default_thumbs(media)):
-            # Download the image into a buffer, wrap the buffer as a File-like
-            # object, and create the thumbs.
-            try:
-                temp_img = urllib2.urlopen(thumb_url)
-                file_like_img = StringIO(temp_img.read())
-                temp_img.close()
-                create_thumbs_for(media, file_like_img, thumb_url)
-                file_like_img.close()
-            except urllib2.URLError, e:
-                log.exception(e)
+        and asbool(app_globals.settings['use_embed_thumbnails']):
+            enqueue('fetch_embed_thumbs', media, thumb_url=thumb_url)
     else:
         raise formencode.Invalid(_('No File or URL provided.'), None, None)
 
@@ -176,8 +168,10 @@ def attach_and_store_media_file(media, media_file, file):
 
     Adds the MediaFile to the database.
     """
+    if isinstance(file, ChunkedUpload):
+        media_file.size = file.size
     # Small files are stored in memory and do not have a tmp file w/ fileno
-    if hasattr(file, 'fileno'):
+    elif hasattr(file, 'fileno'):
         media_file.size = os.fstat(file.fileno())[6]
     else:
         # The file may contain multi-byte characters, so we must seek instead of count chars
@@ -194,7 +188,13 @@ def attach_and_store_media_file(media, media_file, file):
 
     # copy the file to its permanent location
     file_name = '%d_%d_%s.%s' % (media.id, media_file.id, media.slug, media_file.container)
-    file_url = store_media_file(file, file_name)
+    if queue_enabled() and not isinstance(get_storage(), LocalStorage):
+        # Keep the file locally, where it can be served from, until a
+        # worker transfers it to remote storage
+        file_url = store_media_file(file, file_name, local_media_storage())
+        enqueue('transfer_media_file', media, media_file_id=media_file.id)
+    else:
+        file_url = store_media_file(file, file_name)
 
     if file_url:
         # The file has been stored remotely
@@ -203,98 +203,70 @@ def attach_and_store_media_file(media, media_file, file):
         # The file is stored locally and we just need its name
         media_file.file_name = file_name
 
-def store_media_file(file, file_name):
-    """Copy the file to its permanent location and return its URI"""
-    if asbool(app_globals.settings['ftp_storage']):
-        # Put the file into our FTP storage, return its URL
-        return _store_media_file_ftp(file, file_name)
-    else:
-        # Store the file locally, return its path relative to the media dir
-        file_path = os.path.join(config['media_dir'], file_name)
-        file.seek(0)
-        permanent_file = open(file_path, 'w')
-        shutil.copyfileobj(file, permanent_file)
-        file.close()
-        permanent_file.close()
-        return None # The file name is unchanged, so return nothing
+def store_media_file(file, file_name, storage=None):
+    """Copy the file to its permanent location and return its URI.
 
-def _store_media_file_ftp(file, file_name):
-    """Store the file on the defined FTP server.
-
-    Returns the download url for accessing the resource.
-
-    Ensures that the file was stored correctly and is accessible
-    via the download url.
-
-    Raises an exception on failure (FTP connection errors, I/O errors,
-    integrity errors)
+    :param storage: The engine to store the file with, by default the one
+        returned by :func:`~mediacore.lib.storage.get_storage`.
+    :returns: The URL of a file stored remotely, or None if it's stored
+        locally under the given name.
     """
-    stor_cmd = 'STOR ' + file_name
-    file_url = app_globals.settings['ftp_download_url'].rstrip('/') + '/' + file_name
-    ftp_server = app_globals.settings['ftp_server']
-    ftp_user = app_globals.settings['ftp_user']
-    ftp_password = app_globals.settings['ftp_password']
-    upload_dir = app_globals.settings['ftp_upload_directory']
-
-    # Put the file into our FTP storage
-    FTPSession = ftplib.FTP(ftp_server, ftp_user, ftp_password)
-
+    if storage is None:
+        storage = get_storage()
+    if isinstance(file, ChunkedUpload):
+        upload = file
+        if isinstance(storage, LocalStorage):
+            # The chunks were written to the media dir as they arrived,
+            # so this is a rename rather than a copy
+            file_url = storage.store_path(upload.path, file_name, move=True)
+            upload.delete()
+            return file_url
+        file = upload.open()
+        try:
+            return storage.store(file, file_name, upload.hexdigest())
+        finally:
+            file.close()
+            upload.delete()
+    file.seek(0)
     try:
-        if upload_dir:
-            FTPSession.cwd(upload_dir)
-        FTPSession.storbinary(stor_cmd, file)
-        _verify_ftp_upload_integrity(file, file_url)
-        # TODO: Delete the file if the integrity check fails
+        return storage.store(file, file_name)
     finally:
-        FTPSession.quit()
-
-    return file_url
-
-def _verify_ftp_upload_integrity(file, file_url):
-    """Download the file and make sure that it matches the original.
+        file.close()
 
-    Returns True on success, and raises a formencode.Invalid on failure
-    so that the error may be displayed to the user.
+@job_handler('transfer_media_file')
+def transfer_media_file(media, media_file_id):
+    """Move a media file from the ``media_dir`` to remote storage."""
+    media_file = MediaFile.query.get(media_file_id)
+    storage = get_storage()
+    if media_file is None or not media_file.file_name \
+    or isinstance(storage, LocalStorage):
+        # Deleted, already transferred, or remote storage was disabled
+        return None
+    local = LocalStorage(config['media_dir'])
+    file_name = media_file.file_name
+    media_file.url = storage.store_path(local.path(file_name), file_name)
+    media_file.file_name = None
+    # The local copy is only deleted once the new URL has been saved
+    return lambda: local.delete(file_name)
 
-    FIXME: Ideally we wouldn't have to download the whole file, we'd have
-           some better way of verifying the integrity of the upload.
+@job_handler('fetch_embed_thumbs')
+def fetch_embed_thumbs(media, thumb_url):
+    """Create thumbs for an embedded media item from its thumbnail URL.
 
+    Custom thumbs which have been uploaded in the meantime are kept.
     """
-    tries = 0
-    max_tries = int(app_globals.settings['ftp_upload_integrity_retries'])
-    if max_tries < 1:
-        return True
-
-    file.seek(0)
-    orig_hash = sha1(file.read()).hexdigest()
-
-    # Try to download the file. Increase the number of retries, or the
-    # timeout duration, if the server is particularly slow.
-    # eg: Akamai usually takes 3-15 seconds to make an uploaded file
-    #     available over HTTP.
-    while tries < max_tries:
-        tries += 1
-        try:
-            temp_file = urllib2.urlopen(file_url)
-            new_hash = sha1(temp_file.read()).hexdigest()
-            temp_file.close()
-
-            # If the downloaded file matches, success! Otherwise, we can
-            # be pretty sure that it got corrupted during FTP transfer.
-            if orig_hash == new_hash:
-                return True
-            else:
-                msg = _('The file transferred to your FTP server is '\
-                        'corrupted. Please try again.')
-                raise FTPUploadException(msg, None, None)
-        except urllib2.HTTPError, http_err:
-            # Don't raise the exception now, wait until all attempts fail
-            time.sleep(3)
-
-    # Raise the exception from the last attempt
-    msg = _('Could not download the file from your FTP server: %s')\
-        % http_err.message
-    raise FTPUploadException(msg, None, None)
+    if not has_default_thumbs(media):
+        return None
+    # Download the image into a buffer, wrap the buffer as a File-like
+    # object, and create the thumbs.
+    try:
+        temp_img = urllib2.urlopen(thumb_url)
+        file_like_img = StringIO(temp_img.read())
+        temp_img.close()
+        create_thumbs_for(media, file_like_img, thumb_url)
+        file_like_img.close()
+    except urllib2.URLError, e:
+        log.exception(e)
 
 def save_media_obj(name, email, title, description, tags, uploaded_file, url):
     # create our media object as a status-less placeholder initially
@@ -13,11 +13,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import inspect
 import functools
 import warnings
+from datetime import datetime
 
+import simplejson as json
 from pylons import request, tmpl_context
+from sqlalchemy import orm, sql
+from sqlalchemy.orm.exc import UnmappedColumnError, UnmappedInstanceError
+from sqlalchemy.sql import operators
 from webhelpers import paginate as _paginate
 from webhelpers.paginate import get_wrapper
 from webob.multidict import MultiDict
@@ -62,7 +68,8 @@ def partial(*args, **create_time_kwds):
         return func(*args, **kwds)
     return curried_function
 
-def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
+def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None,
+             cursor=False, count=None):
     """Paginate a given collection.
 
     Duplicates and extends the functionality of :func:`tg.decorators.paginate` to:
@@ -108,6 +115,14 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
       items_first_page
         the number of items to be rendered on the first page. Defaults to the
         value of ``items_per_page``
+      cursor
+        if True, pages after the first are fetched with a ``cursor``
+        parameter instead of a page number, when the collection is a
+        query ordered by columns. See :class:`CursorPage`.
+      count
+        a callable which is passed the collection and returns the number
+        of items in it, such as :func:`mediacore.lib.counts.count_results`.
+        By default the collection is counted on every page.
 
     """
     prefix = ""
@@ -115,13 +130,15 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
         prefix = name + "_"
     own_parameters = dict(
         page="%spage" % prefix,
-        items_per_page="%sitems_per_page" % prefix
+        items_per_page="%sitems_per_page" % prefix,
+        cursor="%scursor" % prefix,
         )
     #@decorator
     def _d(f):
         @functools.wraps(f)
         def _w(*args, **kwargs):
             page = int(kwargs.pop(own_parameters["page"], 1))
+            page_cursor = kwargs.pop(own_parameters["cursor"], None)
             real_items_per_page = int(
                     kwargs.pop(
                             own_parameters['items_per_page'],
@@ -154,23 +171,64 @@ def paginate(name, items_per_page=10, use_prefix=False, items_first_page=None):
 
                 collection = res[name]
 
-                # Use CustomPage if our extra custom arg was provided
-                if items_first_page is not None:
-                    page_class = CustomPage
-                else:
-                    page_class = Page
-
-                page = page_class(
-                    collection,
-                    page,
-                    items_per_page=real_items_per_page,
-                    items_first_page=items_first_page,
-                    **additional_parameters.dict_of_lists()
-                    )
-                # wrap the pager so that it will render
-                # the proper page-parameter
-                page.pager = partial(page.pager,
-                        page_param=own_parameters["page"])
+                order = None
+                if cursor and isinstance(collection, orm.Query):
+                    collection, order = keyset_order(collection)
+
+                paged = None
+                if order and page_cursor:
+                    try:
+                        paged = CursorPage(
+                            collection,
+                            page_cursor,
+                            items_per_page=real_items_per_page,
+                            order=order,
+                            cursor_param=own_parameters["cursor"],
+                            )
+                    except InvalidCursor:
+                        # Start over from the first page
+                        page = 1
+
+                if paged is None:
+                    # Use CustomPage if our extra custom arg was provided
+                    if items_first_page is not None:
+                        page_class = CustomPage
+                    else:
+                        page_class = Page
+
+                    item_count = None
+                    if count is not None:
+                        item_count = count(collection)
+
+                    paged = page_class(
+                        collection,
+                        page,
+                        items_per_page=real_items_per_page,
+                        items_first_page=items_first_page,
+                        item_count=item_count,
+                        **additional_parameters.dict_of_lists()
+                        )
+                    # wrap the pager so that it will render
+                    # the proper page-parameter
+                    paged.pager = partial(paged.pager,
+                            page_param=own_parameters["page"])
+                    if order:
+                        # Link to the next page with a cursor, so that
+                        # paging through the whole list never needs an
+                        # expensive offset
+                        paged.cursor_param = own_parameters["cursor"]
+                        paged.next_cursor = None
+                        # An approximate count stops short of the end, so
+                        # there may be more items after its last page
+                        more = paged.next_page or (
+                            getattr(paged.item_count, 'is_approximate', False)
+                            and paged.page == paged.last_page)
+                        if more and paged.items:
+                            values = keyset_values(paged.items[-1], order)
+                            if None not in values:
+                                paged.next_cursor = encode_cursor(
+                                    values, paged.page + 1, order)
+                page = paged
                 res[name] = page
                 # this is a bit strange - it appears
                 # as if c returns an empty
@@ -384,3 +442,201 @@ class CustomPage(Page):
         # This is a subclass of the 'list' type. Initialise the list now.
         list.__init__(self, self.items)
 
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor can't be decoded."""
+
+def _order_signature(order):
+    return ','.join('%s%s' % (col.key, descending and '-' or '+')
+                    for col, descending in order)
+
+def encode_cursor(values, page=None, order=None):
+    """Return an opaque, URL-safe cursor string for the given key values.
+
+    :param values: The values of the ordering columns of the last item
+        on the current page.
+    :param page: The number of the page the cursor leads to, if known.
+    :param order: The ``(column, descending)`` pairs the values are for,
+        so that the cursor can't be used with a different ordering.
+    :rtype: str
+
+    """
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = ['dt', value.year, value.month, value.day, value.hour,
+                     value.minute, value.second, value.microsecond]
+        encoded.append(value)
+    data = {'k': encoded, 'p': page}
+    if order is not None:
+        data['o'] = _order_signature(order)
+    data = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the key values, page number and ordering encoded in a cursor.
+
+    :raises InvalidCursor: If the cursor is malformed.
+    :rtype: tuple
+
+    """
+    try:
+        cursor = str(cursor)
+        data = json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)))
+        values = []
+        for value in data['k']:
+            if isinstance(value, list) and value and value[0] == 'dt':
+                value = datetime(*value[1:])
+            values.append(value)
+        page = data.get('p', None)
+        if page is not None:
+            page = int(page)
+        return values, page, data.get('o', None)
+    except (TypeError, ValueError, KeyError, UnicodeError), e:
+        raise InvalidCursor, 'Invalid cursor %r: %s' % (cursor, e)
+
+def keyset_order(query):
+    """Return the query and the columns it's ordered by, for keyset paging.
+
+    Keyset pagination requires a query ordered by a unique key, so the
+    primary key is appended to the ordering if it's not already there.
+
+    :param query: An SQLAlchemy ORM query.
+    :returns: A 2-tuple of the query and a list of ``(column, descending)``
+        pairs, or ``(query, None)`` if the query is ordered by anything
+        other than mapped columns, such as search relevance.
+
+    """
+    clauses = getattr(query, '_order_by', None)
+    if not clauses:
+        return query, None
+    mapper = query._mapper_zero()
+    order = []
+    for clause in clauses:
+        descending = False
+        modifier = getattr(clause, 'modifier', None)
+        if modifier in (operators.desc_op, operators.asc_op):
+            descending = modifier is operators.desc_op
+            clause = clause.element
+        try:
+            mapper.get_property_by_column(clause)
+        except (KeyError, UnmappedColumnError, AttributeError):
+            return query, None
+        order.append((clause, descending))
+
+    pk = mapper.primary_key
+    if len(pk) != 1:
+        return query, None
+    pk = pk[0]
+    if not [col for col, desc in order if pk.shares_lineage(col)]:
+        descending = order[-1][1]
+        if descending:
+            query = query.order_by(pk.desc())
+        else:
+            query = query.order_by(pk.asc())
+        order.append((pk, descending))
+    return query, order
+
+def keyset_values(item, order):
+    """Return the values of the ordering columns for the given item.
+
+    Items which aren't mapped, such as
+    :class:`~mediacore.model.media.MediaSummary` instances, must have
+    attributes named after the columns.
+
+    """
+    try:
+        mapper = orm.object_mapper(item)
+    except UnmappedInstanceError:
+        return [getattr(item, col.key) for col, descending in order]
+    return [getattr(item, mapper.get_property_by_column(col).key)
+            for col, descending in order]
+
+def keyset_filter(query, order, values):
+    """Filter the query for the items after the given key values."""
+    clauses = []
+    for i, (col, descending) in enumerate(order):
+        if descending:
+            after = col < values[i]
+        else:
+            after = col > values[i]
+        equal = [c == v for (c, d), v in zip(order[:i], values[:i])]
+        clauses.append(sql.and_(*(equal + [after])))
+    return query.filter(sql.or_(*clauses))
+
+def fetch_keyset_page(query, cursor, limit, order=None):
+    """Fetch a page of items following the given cursor.
+
+    :param query: An SQLAlchemy ORM query, ordered by mapped columns.
+    :param cursor: A cursor from a previous page, or None for the first.
+    :param limit: The maximum number of items to return.
+    :param order: The ordering, if the query has already been passed
+        through :func:`keyset_order`.
+    :raises InvalidCursor: If the cursor is malformed or the query can't
+        be paged with cursors.
+    :returns: A 3-tuple of the items, the cursor for the next page or None
+        if this is the last page, and the number of this page if known.
+
+    """
+    if order is None:
+        query, order = keyset_order(query)
+        if order is None:
+            raise InvalidCursor, 'This query cannot be paged with a cursor.'
+    page = 1
+    if cursor:
+        values, page, signature = decode_cursor(cursor)
+        if signature != _order_signature(order) \
+        or len(values) != len(order) or None in values:
+            raise InvalidCursor, 'Cursor %r does not match this query.' % cursor
+        query = keyset_filter(query, order, values)
+    items = query[:limit + 1]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        values = keyset_values(items[-1], order)
+        if None not in values:
+            next_cursor = encode_cursor(values, page and page + 1, order)
+    return items, next_cursor, page
+
+class CursorPage(list):
+    """A page of items fetched after a cursor rather than at an offset.
+
+    Fetching page 1000 with an offset makes the database read and discard
+    every item on the 999 pages before it, whereas a cursor holds the key
+    of the last item on the previous page, so that the database can jump
+    straight to it with an index. The catch is that only the next page
+    can be linked to, and the total number of items isn't counted.
+
+    Instance attributes:
+
+    items
+        The items on the current page
+
+    page
+        Number of the current page, if the cursor was linked to from a
+        numbered page, otherwise None
+
+    items_per_page
+        Maximal number of items displayed on a page
+
+    next_cursor
+        The cursor for the next page, or None if this is the last page
+
+    cursor_param
+        The name of the request param to pass the cursor in
+
+    """
+    is_cursor_page = True
+
+    def __init__(self, collection, cursor, items_per_page=20, order=None,
+                 cursor_param='cursor'):
+        self.original_collection = collection
+        self.items_per_page = items_per_page
+        self.cursor_param = cursor_param
+        self.items, self.next_cursor, self.page = fetch_keyset_page(
+            collection, cursor, items_per_page, order)
+        self.item_count = None
+        self.first_page = 1
+        list.__init__(self, self.items)
@@ -0,0 +1,157 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Popularity Ranking
+
+A media item's popularity is a function of its likes and how recently it
+was published. In our ranking algorithm, being published
+``popularity_decay_lifetime`` hours later is equivalent to having
+``popularity_decay_exponent`` times more likes.
+
+Scores are stored in :attr:`Media.popularity_points
+<mediacore.model.media.Media.popularity_points>` so that listings can
+be ordered by them. :func:`rank_media` recomputes these scores for the
+whole library, reading and writing in chunks and only updating the rows
+whose score has actually changed. It runs when the popularity settings
+are changed, and should be scheduled with ``paster rank-popularity``
+so that media entering or leaving their publishing window are reranked.
+
+The scores are written without the ORM, so once they're committed the
+changed media must be passed to :func:`notify_ranked`, to invalidate the
+caches which depend on their order.
+
+"""
+
+import math
+from datetime import datetime
+
+from pylons import app_globals
+from sqlalchemy import sql
+
+from mediacore.model.events import change_notifier
+from mediacore.model.media import Media, media
+
+__all__ = [
+    'calculate_popularity',
+    'notify_ranked',
+    'popularity_settings',
+    'rank_media',
+]
+
+# FIXME: The current algorithm assumes that the earliest publication
+#        date is January 1, 2000.
+_epoch = datetime(2000, 1, 1)
+
+# How many media rows to rank per query
+_chunk_size = 1000
+
+def popularity_settings():
+    """Return the ``(log_base, base_life_hours)`` from the app settings."""
+    log_base = int(app_globals.settings['popularity_decay_exponent'])
+    base_life_hours = int(app_globals.settings['popularity_decay_lifetime'])
+    return log_base, base_life_hours
+
+def calculate_popularity(publish_on, likes, log_base, base_life_hours):
+    """Return the popularity points for a published media item.
+
+    :param publish_on: The publish date.
+    :param likes: The number of likes.
+    :param log_base: The ``popularity_decay_exponent`` setting.
+    :param base_life_hours: The ``popularity_decay_lifetime`` setting.
+    :rtype: int
+
+    """
+    base_life = base_life_hours * 3600
+    delta = publish_on - _epoch
+    t = delta.days * 86400 + delta.seconds
+    popularity = math.log(likes + 1, log_base) + t / base_life
+    return max(int(popularity), 0)
+
+def rank_media(bind, media_ids=None, settings=None, now=None):
+    """Recompute the popularity points of the given or all media.
+
+    Unpublished media are given zero points. Rows are read in chunks of
+    primary keys, and each chunk's changed scores are written back with
+    a single executemany UPDATE. The ``modified_on`` dates are left as-is.
+
+    :param bind: A session or connection to execute queries with.
+    :param media_ids: Optional list of media IDs to limit the ranking to.
+    :param settings: Optional ``(log_base, base_life_hours)`` tuple.
+        Defaults to :func:`popularity_settings`.
+    :param now: The time at which to check if media are published.
+    :returns: The IDs of the media whose points were changed.
+
+    """
+    if settings is None:
+        settings = popularity_settings()
+    log_base, base_life_hours = settings
+    if now is None:
+        now = datetime.now()
+
+    update = media.update()\
+        .where(media.c.id == sql.bindparam('media_id'))\
+        .values(popularity_points=sql.bindparam('points'),
+                modified_on=media.c.modified_on)
+
+    query = sql.select([
+            media.c.id, media.c.likes, media.c.popularity_points,
+            media.c.reviewed, media.c.encoded, media.c.publishable,
+            media.c.publish_on, media.c.publish_until,
+        ])\
+        .order_by(media.c.id)\
+        .limit(_chunk_size)
+    if media_ids is not None:
+        query = query.where(media.c.id.in_(media_ids))
+
+    changed = []
+    last_id = None
+    while True:
+        chunk_query = query
+        if last_id is not None:
+            chunk_query = chunk_query.where(media.c.id > last_id)
+        rows = bind.execute(chunk_query).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        params = []
+        for row in rows:
+            if row.reviewed and row.encoded and row.publishable \
+            and row.publish_on is not None and row.publish_on <= now \
+            and (row.publish_until is None or row.publish_until >= now):
+                points = calculate_popularity(row.publish_on, row.likes,
+                                              log_base, base_life_hours)
+            else:
+                points = 0
+            if points != row.popularity_points:
+                params.append({'media_id': row.id, 'points': points})
+        if params:
+            bind.execute(update, params)
+            changed.extend(p['media_id'] for p in params)
+    return changed
+
+def notify_ranked(media_ids):
+    """Tell the :data:`~mediacore.model.events.change_notifier` listeners
+    that the popularity points of the given media have changed.
+
+    Call this after committing the changes made by :func:`rank_media`.
+
+    """
+    if media_ids:
+        change_notifier.notify({
+            Media: dict((media_id, set(['popularity_points']))
+                        for media_id in media_ids),
+        })
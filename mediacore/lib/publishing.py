@@ -0,0 +1,185 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Publishing Schedule
+
+A media item appears on the site while it's reviewed, encoded and
+publishable, and the current time is between its ``publish_on`` and
+``publish_until`` dates. Rather than compare those dates to the current
+time in every public query, which also makes every statement unique,
+the result is stored in the indexed :attr:`Media.is_live
+<mediacore.model.media.Media.is_live>` column.
+
+It's set whenever a media item is saved, and :func:`update_live_media`
+flips it as publishing windows open and close. That happens:
+
+    * at the start of the first request after a window opens or closes,
+      see :func:`check_schedule`, and
+    * whenever ``paster publish-media`` is run. With ``--interval`` it
+      keeps running and wakes up as each window opens or closes, so that
+      feeds and caches are refreshed on time even when the site is idle.
+
+The flipped media are passed to the :data:`~mediacore.model.events.change_notifier`
+listeners as a change to their ``is_live`` attribute, so that the caches
+which depend on them are invalidated.
+
+"""
+
+import threading
+from datetime import datetime
+
+from sqlalchemy import sql
+
+from mediacore.lib.cache import get_version
+from mediacore.model.events import change_notifier
+from mediacore.model.media import Media, live_at, media
+from mediacore.model.meta import DBSession
+
+__all__ = [
+    'check_schedule',
+    'next_live_change',
+    'publish_scheduled_media',
+    'update_live_media',
+]
+
+def update_live_media(bind, media_ids=None, now=None):
+    """Flip the is_live flag of media whose publishing window has opened
+    or closed.
+
+    The ``modified_on`` dates are left as-is.
+
+    :param bind: A session or connection to execute queries with.
+    :param media_ids: Optional list of media IDs to limit the update to.
+    :param now: The time at which to check if media should be live.
+    :returns: A list of the IDs of the media which were changed.
+
+    """
+    if now is None:
+        now = datetime.now()
+    should_be_live = live_at(now)
+    flips = [
+        (True, sql.and_(media.c.is_live == False, should_be_live)),
+        (False, sql.and_(media.c.is_live == True,
+                         sql.or_(media.c.publish_on == None,
+                                 sql.not_(should_be_live)))),
+    ]
+    changed = []
+    for is_live, outdated in flips:
+        if media_ids is not None:
+            outdated = sql.and_(media.c.id.in_(media_ids), outdated)
+        ids = [row[0] for row in
+               bind.execute(sql.select([media.c.id], outdated))]
+        if not ids:
+            continue
+        bind.execute(media.update()\
+            .where(sql.and_(media.c.id.in_(ids), outdated))\
+            .values(is_live=is_live, modified_on=media.c.modified_on))
+        changed.extend(ids)
+    return changed
+
+def next_live_change(bind, now=None):
+    """Return the next time a media item should go live or stop being live.
+
+    This may be in the past, if :func:`update_live_media` hasn't been run
+    since then.
+
+    :param bind: A session or connection to execute queries with.
+    :param now: The current datetime.
+    :rtype: :class:`datetime.datetime` or None
+
+    """
+    if now is None:
+        now = datetime.now()
+    publish = bind.execute(
+        sql.select([sql.func.min(media.c.publish_on)], sql.and_(
+            media.c.is_live == False,
+            media.c.reviewed == True,
+            media.c.encoded == True,
+            media.c.publishable == True,
+            sql.or_(media.c.publish_until == None,
+                    media.c.publish_until >= now),
+        ))
+    ).scalar()
+    unpublish = bind.execute(
+        sql.select([sql.func.min(media.c.publish_until)],
+                   media.c.is_live == True)
+    ).scalar()
+    boundaries = [d for d in (publish, unpublish) if d]
+    return boundaries and min(boundaries) or None
+
+def publish_scheduled_media(now=None):
+    """Run :func:`update_live_media` in a transaction of its own, and
+    notify the cache listeners of the changes.
+
+    A connection of its own is used so that the flipped media are visible
+    to the transaction of the current request, which starts afterwards.
+
+    :returns: The number of media which were changed.
+
+    """
+    conn = DBSession.bind.connect()
+    try:
+        transaction = conn.begin()
+        try:
+            changed = update_live_media(conn, now=now)
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+    finally:
+        conn.close()
+    if changed:
+        change_notifier.notify({
+            Media: dict((media_id, set(['is_live'])) for media_id in changed),
+        })
+    return len(changed)
+
+# The next time is_live should change, cached per 'media' version stamp
+_next_change = None
+_next_change_lock = threading.Lock()
+
+def check_schedule(now=None):
+    """Update is_live if a publishing window has opened or closed since
+    the last check.
+
+    This is called at the start of every request, so the next boundary is
+    cached in memory until media are changed.
+
+    :returns: The number of media which were changed.
+
+    """
+    global _next_change
+    if now is None:
+        now = datetime.now()
+    version = get_version('media')
+    cached = _next_change
+    if cached is None or cached[0] != version:
+        conn = DBSession.bind.connect()
+        try:
+            cached = _next_change = (version, next_live_change(conn, now))
+        finally:
+            conn.close()
+    boundary = cached[1]
+    if boundary is None or boundary > now:
+        return 0
+    # Only one thread needs to do the update
+    if not _next_change_lock.acquire(False):
+        return 0
+    try:
+        _next_change = None
+        return publish_scheduled_media(now)
+    finally:
+        _next_change_lock.release()
@@ -0,0 +1,134 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Random Media Selection
+
+``ORDER BY RAND()`` scans and sorts the entire media table to return a
+single row. Instead, :class:`RandomMediaPicker` keeps a cached list of
+the IDs of every media item that is, or is scheduled to become,
+published, along with their publishing windows.
+
+Picking an item is then a random index into that list, a check of the
+publishing window against the current time, and a single primary key
+lookup to confirm the item is still published. Because each pick checks
+the window itself, scheduled media appear and expire right on time even
+though the list is only refreshed every few minutes.
+
+"""
+
+import random
+from datetime import datetime
+
+from pylons import app_globals
+from sqlalchemy import sql
+
+from mediacore.model import DBSession, Media
+
+__all__ = ['RandomMediaPicker', 'random_media']
+
+class RandomMediaPicker(object):
+    """Pick random published media from a cached list of candidates.
+
+    :param namespace: The beaker cache namespace to store candidates in.
+    :param expire: Seconds before the candidate list is refetched.
+    :param tries: How many random candidates to try before concluding
+        that the cached list is stale.
+
+    """
+    def __init__(self, namespace='random_media', expire=300, tries=5):
+        self.namespace = namespace
+        self.expire = expire
+        self.tries = tries
+        self.cache = None
+
+    def _get_cache(self):
+        if self.cache is None:
+            self.cache = app_globals.cache.get_cache(self.namespace,
+                                                     expire=self.expire,
+                                                     type='memory')
+        return self.cache
+
+    def candidates(self):
+        """Return the cached list of candidate ``(id, publish_on,
+        publish_until)`` tuples.
+
+        """
+        return self._get_cache().get(key='candidates',
+                                     createfunc=self.fetch_candidates)
+
+    def fetch_candidates(self):
+        """Query all media which are published or scheduled to be.
+
+        The publish dates are checked at the time of each pick rather than
+        here, so that the list remains valid for as long as it's cached.
+
+        """
+        query = DBSession.query(Media.id, Media.publish_on, Media.publish_until)\
+            .filter(Media.reviewed == True)\
+            .filter(Media.encoded == True)\
+            .filter(Media.publishable == True)\
+            .filter(Media.publish_on != None)\
+            .filter(sql.or_(Media.publish_until == None,
+                            Media.publish_until >= datetime.now()))
+        return [tuple(row) for row in query]
+
+    def invalidate(self):
+        """Discard the cached candidates so they're fetched on next use."""
+        self._get_cache().remove_value(key='candidates')
+
+    def pick(self):
+        """Return a random published :class:`~mediacore.model.media.Media`.
+
+        :returns: A media instance, or None if nothing is published.
+
+        """
+        candidates = self.candidates()
+        media = self._pick(candidates)
+        if media is None and candidates:
+            # The list may be stale, for example if media was unpublished
+            # since it was cached. Try again with a fresh list.
+            self.invalidate()
+            media = self._pick(self.candidates(), exhaustive=True)
+        return media
+
+    def _pick(self, candidates, exhaustive=False):
+        now = datetime.now()
+        if exhaustive:
+            candidates = [c for c in candidates if _in_window(c, now)]
+            tries = min(self.tries, len(candidates))
+        else:
+            tries = self.tries
+        for x in xrange(tries):
+            if not candidates:
+                break
+            candidate = random.choice(candidates)
+            if not _in_window(candidate, now):
+                continue
+            media = Media.query.published()\
+                .filter(Media.id == candidate[0])\
+                .first()
+            if media is not None:
+                return media
+        return None
+
+def _in_window(candidate, now):
+    media_id, publish_on, publish_until = candidate
+    return publish_on <= now \
+        and (publish_until is None or publish_until >= now)
+
+random_media = RandomMediaPicker()
+"""The picker used by :meth:`MediaController.random
+<mediacore.controllers.media.MediaController.random>`."""
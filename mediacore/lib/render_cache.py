@@ -0,0 +1,182 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rendered Page Cache
+
+Rendering our larger Genshi templates is expensive, and the public pages
+look the same for every anonymous visitor. A :class:`RenderCache` can be
+passed to :func:`~mediacore.lib.decorators.expose` to serve those pages
+from a beaker cache instead of calling the action at all::
+
+    @expose('media/explore.html', cache=RenderCache(params=['page']))
+    def explore(self, page=1, **kwargs):
+        ...
+
+Pages are keyed on the template, the route arguments, the query string
+and the ``media``, ``comments`` and ``settings`` version stamps, which
+are bumped whenever the content they describe is changed through the ORM.
+See :mod:`mediacore.lib.cache`. Content which changes without the ORM,
+such as view counts, popularity rankings, or media reaching the end of
+their publishing window, is refreshed when the cached page expires.
+
+Pages which render differently for each browser, such as those with a
+media player, which picks HTML5 or Flash by the User-Agent, must pass a
+``vary`` callable that returns whatever the page depends on, so that it
+becomes part of the key.
+
+The cache is configured with these options in your ini file:
+
+    render_cache
+        ``memory`` (the default), ``file`` to share the cache between
+        processes using beaker's file storage, or ``none`` to disable it.
+    render_cache_expire
+        The number of seconds to keep a page for, defaults to 300.
+
+"""
+
+import hashlib
+
+from paste.deploy.converters import asint
+from pylons import app_globals, config, request, response
+
+from mediacore.lib.cache import bump_version, get_versions
+from mediacore.model import (Category, Comment, Media, MediaFile, Podcast,
+    Setting, Tag)
+from mediacore.model.events import change_notifier
+
+__all__ = ['RenderCache', 'cached_fragment']
+
+# The version stamps bumped by changes to each class
+_stamps_by_class = {
+    Media: 'media',
+    MediaFile: 'media',
+    Podcast: 'media',
+    Tag: 'media',
+    Category: 'media',
+    Comment: 'comments',
+    Setting: 'settings',
+}
+
+def _get_cache(namespace):
+    cache_type = config.get('render_cache', 'memory')
+    if cache_type == 'none':
+        return None
+    return app_globals.cache.get_cache(namespace, type=cache_type,
+        expire=asint(config.get('render_cache_expire', 300)))
+
+def _make_key(*parts):
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+class RenderCache(object):
+    """Cache the rendered output of an action for anonymous visitors.
+
+    :param versions: The names of the version stamps which invalidate
+        the cached pages.
+    :param params: The request params which may vary the page. Requests
+        with any other params, such as a search query, are never cached,
+        so that the cache can't be filled with one-off pages.
+    :param on_hit: An optional callback which is passed the route
+        arguments whenever a page is served from the cache, for any
+        side effects of the action which must still happen, such as
+        counting views.
+    :param namespace: The beaker cache namespace.
+    :param vary: An optional callable which returns any other value the
+        page depends on for the current request, such as
+        :func:`~mediacore.lib.filetypes.parse_user_agent_version`.
+
+    """
+    def __init__(self, versions=('media', 'comments', 'settings'),
+                 params=(), on_hit=None, namespace='render_cache',
+                 vary=None):
+        self.versions = tuple(versions)
+        self.params = frozenset(params)
+        self.on_hit = on_hit
+        self.namespace = namespace
+        self.vary = vary
+
+    def is_cacheable(self):
+        """Return True if the current request may be served from the cache."""
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if request.environ.get('repoze.who.identity'):
+            # Logged in users may see admin links and unpublished content
+            return False
+        if request.environ.get('paste.testing', False):
+            # Tests inspect the template variables, which cached pages lack
+            return False
+        return not [key for key in request.params if key not in self.params]
+
+    def key(self, template):
+        """Return the cache key for the current request."""
+        routes_dict = request.environ.get('pylons.routes_dict', {})
+        return _make_key(
+            template,
+            request.host_url,
+            request.script_name,
+            sorted(routes_dict.iteritems()),
+            sorted(request.params.items()),
+            self.vary is not None and self.vary() or None,
+            get_versions(*self.versions),
+        )
+
+    def __call__(self, template, render, args, kwargs):
+        """Return the cached output, calling ``render`` if it's missing."""
+        cache = _get_cache(self.namespace)
+        if cache is None or not self.is_cacheable():
+            return render(*args, **kwargs)
+
+        missed = []
+        def createfunc():
+            missed.append(True)
+            output = render(*args, **kwargs)
+            return response.content_type, output
+        content_type, output = cache.get(key=self.key(template),
+                                         createfunc=createfunc)
+        if not missed:
+            response.content_type = content_type
+            if self.on_hit is not None:
+                routes_dict = request.environ.get('pylons.routes_dict', {})
+                self.on_hit(**routes_dict)
+        return output
+
+def cached_fragment(name, key, createfunc,
+                    versions=('media', 'settings')):
+    """Return a rendered fragment, such as a partial template, from cache.
+
+    :param name: The name of the fragment, used as the cache namespace.
+    :param key: A tuple identifying this instance of the fragment.
+    :param createfunc: A callable which renders the fragment on a miss.
+    :param versions: The names of the version stamps which invalidate
+        the cached fragment.
+
+    """
+    cache = _get_cache('render_cache.%s' % name)
+    if cache is None:
+        return createfunc()
+    return cache.get(key=_make_key(key, get_versions(*versions)),
+                     createfunc=createfunc)
+
+def _content_changed(changes):
+    """Bump the version stamps of the cached pages affected by the changes."""
+    stamps = set()
+    for cls in changes:
+        for stamped_cls, stamp in _stamps_by_class.iteritems():
+            if issubclass(cls, stamped_cls):
+                stamps.add(stamp)
+    if stamps:
+        bump_version(*stamps)
+
+change_notifier.listen(_content_changed, *_stamps_by_class.keys())
@@ -0,0 +1,414 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Search Engines
+
+:meth:`MediaQuery.search <mediacore.model.media.MediaQuery.search>` and
+:meth:`~mediacore.model.media.MediaQuery.admin_search` hand the actual
+searching off to the engine in ``app_globals.search_engine``, chosen by
+the ``search_engine`` option in your config file:
+
+``mysql``
+    MySQL's native ``MATCH ... AGAINST`` on the FULLTEXT indexes of the
+    ``media_fulltext`` table.
+
+``index``
+    A pure-python inverted index, stored in an SQLite database file at
+    ``search_index_path``, ranked with BM25. It is updated whenever
+    ``media_fulltext`` is, and works with any database. Only the best
+    ``search_max_results`` matches are returned, 1000 by default, so
+    result counts are capped to that too.
+
+``like``
+    An unindexed ``LIKE`` scan over ``media_fulltext``. Slow, and
+    results are not ranked, but requires no setup at all.
+
+``auto``
+    Use ``mysql`` on MySQL databases and ``index`` everywhere else. This
+    is the default.
+
+All engines accept the same search syntax: words are matched
+individually. In boolean mode, words prefixed with ``+`` are required,
+words prefixed with ``-`` are excluded, and words ending in ``*`` match
+any word beginning with that prefix.
+
+"""
+
+import math
+import os
+import re
+import threading
+
+from sqlalchemy import sql
+
+from mediacore.model.media import (Media, MediaFullText, media_fulltext,
+    _fulltext_indexes)
+from mediacore.model import MatchAgainstClause
+
+__all__ = [
+    'InvertedIndexSearchEngine',
+    'LikeSearchEngine',
+    'MySQLSearchEngine',
+    'SearchEngine',
+    'parse_search',
+    'search_engine_from_config',
+    'tokenize',
+]
+
+_word_re = re.compile(r'[+-]?\w+\*?', re.UNICODE)
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    """Split the given text into a list of lowercase words."""
+    if not text:
+        return []
+    return _token_re.findall(text.lower())
+
+def parse_search(search, bool=False):
+    """Parse a search string into required, optional and excluded words.
+
+    Words that end with ``*`` are kept that way to denote a prefix match.
+    Any other MySQL boolean operators are ignored.
+
+    :param search: The search string.
+    :param bool: Whether to recognize the boolean mode operators.
+    :returns: A ``(required, optional, excluded)`` tuple of lists.
+
+    """
+    required, optional, excluded = [], [], []
+    for word in _word_re.findall(search.lower()):
+        op = word[0]
+        if op in '+-':
+            word = word[1:]
+        if not bool:
+            optional.append(word.rstrip('*'))
+        elif op == '+':
+            required.append(word)
+        elif op == '-':
+            excluded.append(word)
+        else:
+            optional.append(word)
+    return required, optional, excluded
+
+class SearchEngine(object):
+    """Base class for the search engines that back
+    :class:`~mediacore.model.media.MediaQuery`.
+
+    """
+    def search(self, query, search, index='public', bool=False, order_by=True):
+        """Filter the given query for the given search string.
+
+        :param query: A :class:`~mediacore.model.media.MediaQuery`.
+        :param search: The search string.
+        :param index: The name of the column group to search, either
+            ``'public'`` or ``'admin'``. See ``_fulltext_indexes``.
+        :param bool: Whether to use boolean mode.
+        :param order_by: Whether to order the results by relevance,
+            overriding any existing order.
+        :returns: The filtered query.
+
+        """
+        raise NotImplementedError
+
+    def update_index(self, rows, deleted_ids):
+        """Update the engine with changes just written to ``media_fulltext``.
+
+        :param rows: Dicts of ``media_fulltext`` column values for media that
+            have been added or changed.
+        :param deleted_ids: Media IDs which have been removed.
+
+        """
+        pass
+
+    def rebuild(self, bind):
+        """Rebuild any engine-specific index from ``media_fulltext``."""
+        pass
+
+class MySQLSearchEngine(SearchEngine):
+    """Search using MySQL's native FULLTEXT indexes."""
+
+    def search(self, query, search, index='public', bool=False, order_by=True):
+        search_cols = _fulltext_indexes[index]
+        filter = MatchAgainstClause(search_cols, search, bool)
+        query = query.join(MediaFullText).filter(filter)
+        if order_by:
+            # MySQL automatically orders natural lang searches by relevance,
+            # so override any existing ordering
+            query = query.order_by(None)
+            if bool:
+                # To mimic the same behaviour in boolean mode, we must do an
+                # extra natural language search on our boolean-filtered results
+                relevance = MatchAgainstClause(search_cols, search, bool=False)
+                query = query.order_by(relevance)
+        return query
+
+class LikeSearchEngine(SearchEngine):
+    """Search ``media_fulltext`` with a ``LIKE`` clause per word."""
+
+    def search(self, query, search, index='public', bool=False, order_by=True):
+        search_cols = _fulltext_indexes[index]
+        required, optional, excluded = parse_search(search, bool)
+
+        def matches(word):
+            pattern = u'%%%s%%' % word.rstrip('*')
+            return sql.or_(*[col.like(pattern) for col in search_cols])
+
+        query = query.join(MediaFullText)
+        if required:
+            query = query.filter(sql.and_(*[matches(w) for w in required]))
+        elif optional:
+            query = query.filter(sql.or_(*[matches(w) for w in optional]))
+        for word in excluded:
+            query = query.filter(sql.not_(matches(word)))
+        return query
+
+class InvertedIndexSearchEngine(SearchEngine):
+    """Search a BM25-ranked inverted index stored in an SQLite file.
+
+    Each column of ``media_fulltext`` is indexed separately, so that the
+    public and admin searches can each sum over their own columns.
+
+    The index knows nothing of the filters on the query being searched,
+    so the ranked matches are checked against the query, best first, until
+    ``max_results`` of them are found to pass. Any further matches are
+    dropped, which also caps the count of the results. Apply all other
+    filters to the query before searching it, so that they're taken into
+    account.
+
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, path, max_results=1000):
+        self.path = path
+        self.max_results = max_results
+        self.fields = _fulltext_fields()
+        self._local = threading.local()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._create_tables()
+
+    def _connect(self):
+        """Return an SQLite connection for this thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                field INTEGER NOT NULL,
+                media_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, field, media_id)
+            );
+            CREATE INDEX IF NOT EXISTS postings_media_id
+                ON postings (media_id);
+            CREATE TABLE IF NOT EXISTS lengths (
+                media_id INTEGER NOT NULL,
+                field INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (media_id, field)
+            );
+        """)
+        conn.commit()
+
+    def update_index(self, rows, deleted_ids):
+        conn = self._connect()
+        try:
+            self._delete(conn, list(deleted_ids) + [r['media_id'] for r in rows])
+            postings, lengths = [], []
+            for row in rows:
+                for field, col in enumerate(self.fields):
+                    counts = {}
+                    terms = tokenize(row.get(col, None))
+                    for term in terms:
+                        counts[term] = counts.get(term, 0) + 1
+                    for term, tf in counts.iteritems():
+                        postings.append((term, field, row['media_id'], tf))
+                    if terms:
+                        lengths.append((row['media_id'], field, len(terms)))
+            conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                             postings)
+            conn.executemany('INSERT INTO lengths VALUES (?, ?, ?)', lengths)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+    def _delete(self, conn, media_ids):
+        for i in xrange(0, len(media_ids), 500):
+            chunk = media_ids[i:i + 500]
+            params = ', '.join('?' * len(chunk))
+            conn.execute('DELETE FROM postings WHERE media_id IN (%s)'
+                         % params, chunk)
+            conn.execute('DELETE FROM lengths WHERE media_id IN (%s)'
+                         % params, chunk)
+
+    def rebuild(self, bind):
+        conn = self._connect()
+        conn.execute('DELETE FROM postings')
+        conn.execute('DELETE FROM lengths')
+        conn.commit()
+        query = sql.select([media_fulltext], order_by=media_fulltext.c.media_id)
+        result = bind.execute(query)
+        while True:
+            rows = result.fetchmany(500)
+            if not rows:
+                break
+            self.update_index([dict(row.items()) for row in rows], [])
+
+    def rank(self, search, index='public', bool=False):
+        """Return ``(media_id, score)`` pairs for every match, best first."""
+        required, optional, excluded = parse_search(search, bool)
+        if not required and not optional:
+            return []
+        conn = self._connect()
+        fields = [self.fields.index(col.name)
+                  for col in _fulltext_indexes[index]]
+        in_fields = ', '.join(str(f) for f in fields)
+
+        doc_count, total_length = conn.execute(
+            'SELECT COUNT(DISTINCT media_id), SUM(length) FROM lengths '
+            'WHERE field IN (%s)' % in_fields).fetchone()
+        if not doc_count:
+            return []
+        avg_length = float(total_length) / doc_count
+
+        # Fetch the {media_id: tf} postings of each word
+        def postings(word):
+            if word.endswith('*'):
+                prefix = word.rstrip('*')
+                cursor = conn.execute(
+                    'SELECT media_id, SUM(tf) FROM postings '
+                    'WHERE term >= ? AND term < ? AND field IN (%s) '
+                    'GROUP BY media_id' % in_fields,
+                    (prefix, prefix + u'\uffff'))
+            else:
+                cursor = conn.execute(
+                    'SELECT media_id, SUM(tf) FROM postings '
+                    'WHERE term = ? AND field IN (%s) '
+                    'GROUP BY media_id' % in_fields, (word,))
+            return dict(cursor.fetchall())
+
+        required = [postings(w) for w in required]
+        optional = [postings(w) for w in optional]
+        excluded_ids = set()
+        for word in excluded:
+            excluded_ids.update(postings(word))
+
+        if required:
+            candidates = set(required[0])
+            for p in required[1:]:
+                candidates.intersection_update(p)
+        else:
+            candidates = set()
+            for p in optional:
+                candidates.update(p)
+        candidates.difference_update(excluded_ids)
+        if not candidates:
+            return []
+
+        lengths = self._lengths(conn, candidates, in_fields)
+        scores = dict.fromkeys(candidates, 0.0)
+        for p in required + optional:
+            df = len(p)
+            idf = math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+            for media_id, tf in p.iteritems():
+                if media_id not in scores:
+                    continue
+                norm = 1 - self.b + self.b * lengths.get(media_id, 0) / avg_length
+                scores[media_id] += idf * tf * (self.k1 + 1) \
+                                  / (tf + self.k1 * norm)
+
+        return sorted(scores.iteritems(), key=lambda x: (-x[1], x[0]))
+
+    def _lengths(self, conn, media_ids, in_fields):
+        lengths = {}
+        media_ids = list(media_ids)
+        for i in xrange(0, len(media_ids), 500):
+            chunk = media_ids[i:i + 500]
+            cursor = conn.execute(
+                'SELECT media_id, SUM(length) FROM lengths '
+                'WHERE field IN (%s) AND media_id IN (%s) GROUP BY media_id'
+                % (in_fields, ', '.join('?' * len(chunk))), chunk)
+            lengths.update(cursor.fetchall())
+        return lengths
+
+    def search(self, query, search, index='public', bool=False, order_by=True):
+        ranked = self.rank(search, index, bool)
+        media_ids = self._filter_ranked(query, ranked)
+        if not media_ids:
+            # Match nothing
+            return query.filter(Media.id == None)
+        query = query.filter(Media.id.in_(media_ids))
+        if order_by:
+            positions = [(media_id, i) for i, media_id in enumerate(media_ids)]
+            query = query.order_by(None)\
+                .order_by(sql.case(positions, value=Media.id))
+        return query
+
+    def _filter_ranked(self, query, ranked):
+        """Return the IDs of the best ``max_results`` ranked matches which
+        the query's own filters allow, best first."""
+        id_query = query.order_by(None).with_entities(Media.id)
+        media_ids = []
+        for i in xrange(0, len(ranked), 500):
+            chunk = [media_id for media_id, score in ranked[i:i + 500]]
+            allowed = set(media_id for media_id, in
+                          id_query.filter(Media.id.in_(chunk)))
+            media_ids.extend(media_id for media_id in chunk
+                             if media_id in allowed)
+            if len(media_ids) >= self.max_results:
+                return media_ids[:self.max_results]
+        return media_ids
+
+def _fulltext_fields():
+    """Return the names of all the columns indexed in any column group."""
+    fields = []
+    for cols in _fulltext_indexes.itervalues():
+        for col in cols:
+            if col.name not in fields:
+                fields.append(col.name)
+    return sorted(fields)
+
+def search_engine_from_config(config, engine):
+    """Create the search engine specified by the ``search_engine`` option.
+
+    :param config: The app config.
+    :param engine: The SQLAlchemy engine for the database.
+
+    """
+    name = config.get('search_engine', 'auto')
+    if name == 'auto':
+        name = engine.dialect.name == 'mysql' and 'mysql' or 'index'
+    if name == 'mysql':
+        return MySQLSearchEngine()
+    elif name == 'like':
+        return LikeSearchEngine()
+    elif name == 'index':
+        path = config.get('search_index_path', None) \
+            or os.path.join(config['cache_dir'], 'search', 'index.sqlite')
+        max_results = int(config.get('search_max_results', 1000))
+        return InvertedIndexSearchEngine(path, max_results)
+    raise ValueError, 'Unknown search_engine: %r' % name
@@ -0,0 +1,689 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Storage Engines
+
+A :class:`StorageEngine` is where uploaded files are kept. They all share
+the same small API, so that the code storing or deleting a file doesn't
+need to know whether it's on the local disk or a remote server::
+
+    storage = get_storage()
+    url = storage.store(file, '1_2_my-video.mp4')
+    storage.exists('1_2_my-video.mp4')
+    storage.delete('1_2_my-video.mp4')
+
+Media files are kept by the engine chosen with the ``storage_engine``
+option in your ini file:
+
+    auto
+        ``ftp`` if FTP storage is enabled in the admin settings, otherwise
+        ``local``. This is the default.
+    local
+        :class:`LocalStorage` in the ``media_dir``.
+    ftp
+        :class:`FTPStorage`, configured in the admin settings.
+    s3local
+        :class:`LocalS3Storage`, which keeps files in a bucket directory
+        under ``s3local_root``, served from ``s3local_url``.
+
+Thumbnails are always kept in the ``image_dir`` with a
+:class:`LocalStorage`, since they're served as static files.
+
+Remote engines keep their connections open in a :class:`ConnectionPool`
+between requests, and transfer several files, or several parts of a large
+file, at once.
+
+"""
+
+import ftplib
+import os
+import shutil
+import threading
+import time
+import urllib2
+import uuid
+from Queue import Empty, Full, Queue
+
+import formencode
+from paste.deploy.converters import asbool, asint
+from pylons import app_globals, config
+from pylons.i18n import _
+
+from mediacore.lib.cache import get_version
+from mediacore.lib.uploads import sha1_file
+
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'ConnectionPool',
+    'FTPStorage',
+    'FTPUploadException',
+    'LocalS3Storage',
+    'LocalStorage',
+    'StorageEngine',
+    'delete_stored_files',
+    'get_storage',
+    'image_storage',
+    'local_media_storage',
+    'stored_file',
+]
+
+class FTPUploadException(formencode.Invalid):
+    pass
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Another process may have just created it
+            if not os.path.isdir(path):
+                raise
+
+def _parallel(func, items, workers):
+    """Call ``func`` on each item in up to ``workers`` threads at once.
+
+    The first exception raised by any call is re-raised once all the
+    threads have finished.
+
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    queue = Queue()
+    for i, item in enumerate(items):
+        queue.put((i, item))
+    def work():
+        while not errors:
+            try:
+                i, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[i] = func(item)
+            except Exception, e:
+                errors.append(e)
+    threads = [threading.Thread(target=work)
+               for x in xrange(min(workers, len(items)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return results
+
+class ConnectionPool(object):
+    """Keep connections open for reuse between requests.
+
+    :param create: A callable which opens a new connection.
+    :param check: An optional callable which is passed an idle connection
+        before it's reused, and raises an exception if it's gone stale.
+    :param close: An optional callable which closes a connection.
+    :param max_size: The number of idle connections to keep.
+    :param max_idle: Connections idle for longer than this many seconds
+        are closed instead of reused.
+
+    """
+    def __init__(self, create, check=None, close=None, max_size=4,
+                 max_idle=60):
+        self.create = create
+        self.check = check
+        self.close_func = close
+        self.max_idle = max_idle
+        self._idle = Queue(max_size)
+
+    def get(self):
+        """Return an idle connection, or a new one."""
+        while True:
+            try:
+                conn, released = self._idle.get_nowait()
+            except Empty:
+                return self.create()
+            if time.time() - released > self.max_idle:
+                self._close(conn)
+                continue
+            if self.check is not None:
+                try:
+                    self.check(conn)
+                except Exception:
+                    self._close(conn)
+                    continue
+            return conn
+
+    def put(self, conn):
+        """Return a working connection to the pool."""
+        try:
+            self._idle.put_nowait((conn, time.time()))
+        except Full:
+            self._close(conn)
+
+    def discard(self, conn):
+        """Close a connection which may be broken."""
+        self._close(conn)
+
+    def close(self):
+        """Close all the idle connections."""
+        while True:
+            try:
+                conn, released = self._idle.get_nowait()
+            except Empty:
+                return
+            self._close(conn)
+
+    def _close(self, conn):
+        if self.close_func is not None:
+            try:
+                self.close_func(conn)
+            except Exception:
+                pass
+
+class StorageEngine(object):
+    """Base class for the places files may be stored.
+
+    Files are identified by a name, which may include forward slashes.
+
+    """
+    #: The number of files transferred at once by :meth:`store_many`
+    workers = 1
+
+    def store(self, file, name, hexdigest=None):
+        """Store the contents of a file-like object under the given name.
+
+        :param file: A file-like object, read from its current position.
+        :param name: The name to store it under.
+        :param hexdigest: The SHA-1 hex digest of the file's contents, if
+            known, for engines which verify their transfers.
+        :returns: The URL the file can be downloaded from, or None if it
+            is served by MediaCore.
+
+        """
+        raise NotImplementedError
+
+    def store_path(self, path, name, move=False, hexdigest=None):
+        """Store the file at the given local path.
+
+        :param move: If True the local file is no longer needed, and may
+            be moved rather than copied.
+        :returns: See :meth:`store`.
+
+        """
+        f = open(path, 'rb')
+        try:
+            url = self.store(f, name, hexdigest)
+        finally:
+            f.close()
+        if move:
+            os.remove(path)
+        return url
+
+    def store_many(self, paths_and_names):
+        """Store several local files at once.
+
+        :param paths_and_names: A list of ``(path, name)`` tuples.
+        :returns: A list of the URLs returned by :meth:`store`.
+
+        """
+        return _parallel(lambda (path, name): self.store_path(path, name),
+                         paths_and_names, self.workers)
+
+    def delete(self, name):
+        """Delete the named file, if it exists."""
+        raise NotImplementedError
+
+    def exists(self, name):
+        """Return True if the named file exists."""
+        raise NotImplementedError
+
+    def url(self, name):
+        """Return the URL of the named file, or None if it is served by
+        MediaCore."""
+        return None
+
+    def name_for_url(self, url):
+        """Return the name of the file stored at the given URL, or None if
+        it wasn't stored by this engine."""
+        return None
+
+    def close(self):
+        """Release any connections held by this engine."""
+        pass
+
+class LocalStorage(StorageEngine):
+    """Store files in a directory on the local disk.
+
+    :param root: The directory to store files in.
+    :param deleted_dir: If given, deleted files are moved here instead of
+        being deleted permanently.
+    :param base_url: If given, the URL the ``root`` is served from.
+
+    """
+    def __init__(self, root, deleted_dir=None, base_url=None):
+        self.root = root
+        self.deleted_dir = deleted_dir
+        self.base_url = base_url
+
+    def path(self, name):
+        """Return the local path of the named file."""
+        return os.path.join(self.root, *name.split('/'))
+
+    def store(self, file, name, hexdigest=None):
+        path = self.path(name)
+        _makedirs(os.path.dirname(path))
+        f = open(path, 'wb')
+        try:
+            shutil.copyfileobj(file, f, 64 * 1024)
+        finally:
+            f.close()
+        return self.url(name)
+
+    def store_path(self, path, name, move=False, hexdigest=None):
+        dest = self.path(name)
+        _makedirs(os.path.dirname(dest))
+        if move:
+            # A rename if they're on the same filesystem
+            shutil.move(path, dest)
+        else:
+            shutil.copyfile(path, dest)
+        return self.url(name)
+
+    def delete(self, name):
+        path = self.path(name)
+        if not os.path.exists(path):
+            return
+        if self.deleted_dir:
+            dest = os.path.join(self.deleted_dir, *name.split('/'))
+            _makedirs(os.path.dirname(dest))
+            shutil.move(path, dest)
+        else:
+            os.remove(path)
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def url(self, name):
+        if self.base_url is None:
+            return None
+        return self.base_url.rstrip('/') + '/' + name
+
+    def name_for_url(self, url):
+        if self.base_url is None:
+            return None
+        prefix = self.base_url.rstrip('/') + '/'
+        if url.startswith(prefix):
+            return url[len(prefix):]
+        return None
+
+class FTPStorage(StorageEngine):
+    """Store files on an FTP server, from which they're served over HTTP.
+
+    :param server: The FTP server's hostname.
+    :param user: The FTP username.
+    :param password: The FTP password.
+    :param upload_dir: The directory on the server to store files in.
+    :param download_url: The HTTP URL the ``upload_dir`` is served from.
+    :param integrity_retries: The number of times to try downloading each
+        stored file to verify it, or 0 to skip the check.
+    :param pool_size: The number of connections to keep open, which is
+        also the number of files :meth:`store_many` transfers at once.
+
+    """
+    def __init__(self, server, user, password, upload_dir, download_url,
+                 integrity_retries=0, pool_size=4):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.upload_dir = upload_dir
+        self.download_url = download_url.rstrip('/') + '/'
+        self.integrity_retries = integrity_retries
+        self.workers = pool_size
+        self.pool = ConnectionPool(self._connect,
+                                   check=lambda ftp: ftp.voidcmd('NOOP'),
+                                   close=lambda ftp: ftp.quit(),
+                                   max_size=pool_size)
+
+    def _connect(self):
+        ftp = ftplib.FTP(self.server, self.user, self.password)
+        if self.upload_dir:
+            ftp.cwd(self.upload_dir)
+        return ftp
+
+    def _call(self, func):
+        """Call ``func`` with a pooled connection."""
+        ftp = self.pool.get()
+        try:
+            result = func(ftp)
+        except (ftplib.error_temp, ftplib.error_proto, EOFError,
+                IOError):
+            # The connection may be broken, so don't reuse it
+            self.pool.discard(ftp)
+            raise
+        except:
+            self.pool.put(ftp)
+            raise
+        self.pool.put(ftp)
+        return result
+
+    def store(self, file, name, hexdigest=None):
+        self._call(lambda ftp: ftp.storbinary('STOR ' + name, file))
+        url = self.url(name)
+        if self.integrity_retries > 0:
+            if hexdigest is None:
+                file.seek(0)
+                hexdigest = sha1_file(file)
+            self._verify(url, hexdigest)
+        return url
+
+    def _verify(self, url, hexdigest):
+        """Download the file and make sure that it matches the original.
+
+        Raises a :class:`FTPUploadException` on failure so that the error
+        may be displayed to the user.
+
+        """
+        # Increase the number of retries if the server is particularly
+        # slow. eg: Akamai usually takes 3-15 seconds to make an uploaded
+        # file available over HTTP.
+        http_err = None
+        for attempt in xrange(self.integrity_retries):
+            try:
+                temp_file = urllib2.urlopen(url)
+                try:
+                    new_hash = sha1_file(temp_file)
+                finally:
+                    temp_file.close()
+            except urllib2.HTTPError, http_err:
+                # Don't raise the exception now, wait until all attempts fail
+                time.sleep(3)
+                continue
+            # If the downloaded file matches, success! Otherwise, we can
+            # be pretty sure that it got corrupted during FTP transfer.
+            if new_hash == hexdigest:
+                return True
+            msg = _('The file transferred to your FTP server is '\
+                    'corrupted. Please try again.')
+            raise FTPUploadException(msg, None, None)
+
+        # Raise the exception from the last attempt
+        msg = _('Could not download the file from your FTP server: %s')\
+            % (http_err is not None and http_err.msg)
+        raise FTPUploadException(msg, None, None)
+
+    def delete(self, name):
+        def delete(ftp):
+            try:
+                ftp.delete(name)
+            except ftplib.error_perm:
+                # It doesn't exist
+                pass
+        self._call(delete)
+
+    def exists(self, name):
+        def exists(ftp):
+            try:
+                ftp.sendcmd('TYPE I')
+                ftp.size(name)
+                return True
+            except ftplib.error_perm:
+                return False
+        return self._call(exists)
+
+    def url(self, name):
+        return self.download_url + name
+
+    def name_for_url(self, url):
+        if url.startswith(self.download_url):
+            return url[len(self.download_url):]
+        return None
+
+    def close(self):
+        self.pool.close()
+
+class LocalS3Storage(StorageEngine):
+    """A stand-in for an S3-compatible object store, kept on local disk.
+
+    Objects are stored in a bucket directory, and large files are sent
+    the way S3 expects them: as a multipart upload whose parts are
+    transferred in parallel, and only appear once all the parts are
+    complete. An engine for a real S3 service only needs to implement
+    the object and multipart methods against its API.
+
+    :param root: The directory to keep buckets in.
+    :param bucket: The name of the bucket.
+    :param base_url: The URL the ``root`` is served from.
+    :param part_size: Files larger than this many bytes are sent in parts.
+    :param workers: The number of parts, or files, to transfer at once.
+
+    """
+    def __init__(self, root, bucket, base_url, part_size=8 * 1024 * 1024,
+                 workers=4):
+        self.root = root
+        self.bucket = bucket
+        self.base_url = base_url.rstrip('/') + '/'
+        self.part_size = part_size
+        self.workers = workers
+
+    def _object_path(self, key):
+        return os.path.join(self.root, self.bucket, *key.split('/'))
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, '.multipart', upload_id)
+
+    def _put_object(self, key, data):
+        path = self._object_path(key)
+        _makedirs(os.path.dirname(path))
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+
+    def _initiate_multipart(self, key):
+        upload_id = uuid.uuid4().hex
+        _makedirs(self._upload_dir(upload_id))
+        return upload_id
+
+    def _upload_part(self, upload_id, number, data):
+        f = open(os.path.join(self._upload_dir(upload_id), str(number)), 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def _complete_multipart(self, upload_id, key, count):
+        upload_dir = self._upload_dir(upload_id)
+        path = self._object_path(key)
+        _makedirs(os.path.dirname(path))
+        tmp_path = '%s.%s.tmp' % (path, upload_id)
+        f = open(tmp_path, 'wb')
+        try:
+            for number in xrange(1, count + 1):
+                part = open(os.path.join(upload_dir, str(number)), 'rb')
+                try:
+                    shutil.copyfileobj(part, f, 64 * 1024)
+                finally:
+                    part.close()
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def _abort_multipart(self, upload_id):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def store(self, file, name, hexdigest=None):
+        first = file.read(self.part_size)
+        second = file.read(1)
+        if not second:
+            self._put_object(name, first)
+            return self.url(name)
+
+        upload_id = self._initiate_multipart(name)
+        lock = threading.Lock()
+        state = {'first': first, 'pending': second, 'parts': 0}
+        def next_part():
+            # Parts are read in order, one at a time, and uploaded in
+            # parallel, so at most one part per worker is held in memory
+            lock.acquire()
+            try:
+                if state['first'] is not None:
+                    data = state['first']
+                    state['first'] = None
+                else:
+                    # Carry over the byte read to check for a second part
+                    data = state['pending']
+                    state['pending'] = ''
+                    data += file.read(self.part_size - len(data))
+                if not data:
+                    return None, None
+                state['parts'] += 1
+                return state['parts'], data
+            finally:
+                lock.release()
+        def upload_parts(worker):
+            while True:
+                number, data = next_part()
+                if number is None:
+                    return
+                self._upload_part(upload_id, number, data)
+        try:
+            _parallel(upload_parts, range(self.workers), self.workers)
+        except:
+            self._abort_multipart(upload_id)
+            raise
+        self._complete_multipart(upload_id, name, state['parts'])
+        return self.url(name)
+
+    def delete(self, name):
+        try:
+            os.remove(self._object_path(name))
+        except OSError:
+            pass
+
+    def exists(self, name):
+        return os.path.isfile(self._object_path(name))
+
+    def url(self, name):
+        return '%s%s/%s' % (self.base_url, self.bucket, name)
+
+    def name_for_url(self, url):
+        prefix = '%s%s/' % (self.base_url, self.bucket)
+        if url.startswith(prefix):
+            return url[len(prefix):]
+        return None
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _storage_from_config():
+    name = config.get('storage_engine', 'auto')
+    settings = app_globals.settings
+    if name == 'auto':
+        name = asbool(settings['ftp_storage']) and 'ftp' or 'local'
+    if name == 'local':
+        return local_media_storage()
+    elif name == 'ftp':
+        return FTPStorage(
+            settings['ftp_server'],
+            settings['ftp_user'],
+            settings['ftp_password'],
+            settings['ftp_upload_directory'],
+            settings['ftp_download_url'],
+            integrity_retries=int(settings['ftp_upload_integrity_retries']),
+            pool_size=asint(config.get('storage_pool_size', 4)),
+        )
+    elif name == 's3local':
+        return LocalS3Storage(
+            config['s3local_root'],
+            config.get('s3local_bucket', 'media'),
+            config['s3local_url'],
+            workers=asint(config.get('storage_pool_size', 4)),
+        )
+    raise ValueError, 'Unknown storage_engine: %r' % name
+
+def get_storage():
+    """Return the engine that media files are stored with.
+
+    The engine and its connections are kept until the settings change.
+
+    """
+    global _engine
+    version = get_version('settings')
+    _engine_lock.acquire()
+    try:
+        if _engine is None or _engine[0] != version:
+            if _engine is not None:
+                _engine[1].close()
+            _engine = (version, _storage_from_config())
+        return _engine[1]
+    finally:
+        _engine_lock.release()
+
+def local_media_storage():
+    """Return the engine for media files kept in the ``media_dir``.
+
+    Files stored before FTP storage was enabled are still kept here.
+
+    """
+    deleted_dir = config.get('deleted_files_dir', None)
+    if deleted_dir:
+        deleted_dir = os.path.join(deleted_dir, 'media')
+    return LocalStorage(config['media_dir'], deleted_dir)
+
+def stored_file(media_file):
+    """Return where a :class:`~mediacore.model.media.MediaFile` is stored.
+
+    :returns: A ``(engine, name)`` tuple, or None if the file isn't
+        stored by us, as with files on YouTube.
+
+    """
+    if media_file.file_name:
+        return local_media_storage(), media_file.file_name
+    if media_file.url:
+        storage = get_storage()
+        name = storage.name_for_url(media_file.url)
+        if name is not None:
+            return storage, name
+    return None
+
+def delete_stored_files(stored):
+    """Delete the files returned by :func:`stored_file`.
+
+    Call this once the files have been deleted from the database. Errors
+    from remote engines are logged rather than raised, since there's no
+    longer any record of the file to retry with.
+
+    :param stored: A list of :func:`stored_file` results. None is ignored.
+
+    """
+    for item in stored:
+        if item is None:
+            continue
+        storage, name = item
+        try:
+            storage.delete(name)
+        except Exception, e:
+            log.exception(e)
+
+def image_storage():
+    """Return the engine that thumbnails are stored with."""
+    return LocalStorage(config['image_dir'],
+                        config.get('deleted_files_dir', None))
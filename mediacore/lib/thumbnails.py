@@ -13,35 +13,72 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+"""
+Thumbnails
+
+Thumbnails are stored in the ``image_dir`` as ``<subdir>/<key><size>.jpg``,
+for example ``media/<key>s.jpg``. The key of a media item or podcast is
+kept in its ``thumb_key`` column:
+
+    None
+        The default thumbs, which are stored once with the key ``new`` and
+        shared by every item without thumbs of its own.
+    a SHA-1 hex digest
+        Thumbs made by :func:`create_thumbs_for`, keyed by the contents of
+        the original image, so that items with the same image share them.
+    an ID
+        Thumbs stored before keys were introduced, named by the item's ID.
+
+So whether an item has the default thumbs, and the URLs of its thumbs, is
+known without touching the disk.
+
+"""
+
 import filecmp
+import math
 import os
-import shutil
 import urllib2
+from cStringIO import StringIO
 from PIL import Image
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5
+    multiprocessing = None
 # XXX: note that pylons.url is imported here. Make sure to only use it with
 #      absolute paths (ie. those starting with a /) to avoid differences in
 #      behavior from mediacore.lib.helpers.url_for
 from pylons import config, url as url_for
 
+from mediacore.lib.compat import any
+from mediacore.lib.storage import image_storage
+from mediacore.lib.uploads import sha1_file
+
 __all__ = [
     'ThumbDict', 'create_default_thumbs_for', 'create_thumbs_for',
-    'has_thumbs', 'has_default_thumbs',
+    'deletable_thumb_paths',
+    'has_thumbs', 'has_default_thumbs', 'render_thumbs', 'render_thumbs_many',
     'thumb', 'thumb_path', 'thumb_paths', 'thumb_url',
 ]
 
 def _normalize_thumb_item(item):
-    """Pass back the image subdir and id when given a media or podcast."""
+    """Pass back the image subdir and thumb key when given a media or podcast."""
     try:
-        return item._thumb_dir, item.id or 'new'
+        return item._thumb_dir, item.thumb_key or 'new'
     except AttributeError:
         return item
 
+def _thumb_name(item, size, ext='jpg'):
+    """Return the name of a thumb in the :func:`image_storage`."""
+    image_dir, item_id = _normalize_thumb_item(item)
+    return '%s/%s%s.%s' % (image_dir, item_id, size, ext)
+
 def thumb_path(item, size, exists=False, ext='jpg'):
     """Get the thumbnail path for the given item and size.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
+    :param item: A 2-tuple with a subdir name and a key. If given a
+        ORM mapped class with _thumb_dir and thumb_key attributes, the
+        info can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     :param size: Size key to display, see ``thumb_sizes`` in
         :mod:`mediacore.config.app_config`
@@ -58,20 +95,19 @@ def thumb_path(item, size, exists=False, ext='jpg'):
     if not item:
         return None
 
-    image_dir, item_id = _normalize_thumb_item(item)
-    image = '%s/%s%s.%s' % (image_dir, item_id, size, ext)
-    image_path = os.path.join(config['image_dir'], image)
+    storage = image_storage()
+    image = _thumb_name(item, size, ext)
 
-    if exists and not os.path.isfile(image_path):
+    if exists and not storage.exists(image):
         return None
-    return image_path
+    return storage.path(image)
 
 def thumb_paths(item, **kwargs):
     """Return a list of paths to all sizes of thumbs for a given item.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
+    :param item: A 2-tuple with a subdir name and a key. If given a
+        ORM mapped class with _thumb_dir and thumb_key attributes, the
+        info can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     :returns: thumb sizes and their paths
     :rtype: ``dict``
@@ -84,9 +120,9 @@ def thumb_paths(item, **kwargs):
 def thumb_url(item, size, qualified=False, exists=False):
     """Get the thumbnail url for the given item and size.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
+    :param item: A 2-tuple with a subdir name and a key. If given a
+        ORM mapped class with _thumb_dir and thumb_key attributes, the
+        info can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     :param size: Size key to display, see ``thumb_sizes`` in
         :mod:`mediacore.config.app_config`
@@ -103,10 +139,9 @@ def thumb_url(item, size, qualified=False, exists=False):
     if not item:
         return None
 
-    image_dir, item_id = _normalize_thumb_item(item)
-    image = '%s/%s%s.jpg' % (image_dir, item_id, size)
+    image = _thumb_name(item, size)
 
-    if exists and not os.path.isfile(os.path.join(config['image_dir'], image)):
+    if exists and not image_storage().exists(image):
         return None
     return url_for('/images/%s' % image, qualified=qualified)
 
@@ -123,9 +158,9 @@ class ThumbDict(dict):
 def thumb(item, size, qualified=False, exists=False):
     """Get the thumbnail url & dimensions for the given item and size.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
+    :param item: A 2-tuple with a subdir name and a key. If given a
+        ORM mapped class with _thumb_dir and thumb_key attributes, the
+        info can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     :param size: Size key to display, see ``thumb_sizes`` in
         :mod:`mediacore.config.app_config`
@@ -191,78 +226,187 @@ def resize_thumb(img, size, filter=Image.ANTIALIAS):
 
     return img.resize(size, filter)
 
+def _draft_size(src_size, sizes):
+    """Return the smallest size the source can be reduced to while still
+    covering every thumb size once cropped."""
+    scale = max([max(float(w) / src_size[0], float(h) / src_size[1])
+                 for w, h in sizes])
+    return (int(math.ceil(src_size[0] * scale)),
+            int(math.ceil(src_size[1] * scale)))
+
+def _same_ratio(a, b):
+    return abs(float(a[0]) / a[1] - float(b[0]) / b[1]) < 0.01
+
+def _resize_thumbs(img, sizes):
+    """Return a dict of resized copies of the image, one for each size.
+
+    JPEGs are decoded at the smallest scale that is still large enough,
+    which is much faster than decoding the full image and uses a fraction
+    of the memory. The thumbs are made from the largest down, and each
+    is resized from the one before it when they have the same shape.
+
+    :param img: An image which hasn't been loaded yet.
+    :param sizes: A dict of ``(width, height)`` tuples.
+    """
+    if img.format == 'JPEG':
+        img.draft('RGB', _draft_size(img.size, sizes.values()))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    thumbs = {}
+    prev = img
+    by_area = sorted(sizes.iteritems(), key=lambda (key, xy): xy[0] * xy[1],
+                     reverse=True)
+    for key, xy in by_area:
+        src = img
+        if _same_ratio(prev.size, xy) \
+        and prev.size[0] >= xy[0] and prev.size[1] >= xy[1]:
+            src = prev
+        prev = thumbs[key] = resize_thumb(src, xy)
+    return thumbs
+
+def render_thumbs(image_file, sizes):
+    """Return the JPEG data of thumbs of an image in the given sizes.
+
+    :param image_file: A file-like object or path of the original image.
+    :param sizes: A dict of ``(width, height)`` tuples, such as
+        ``config['thumb_sizes']['media']``.
+    :returns: A dict of JPEG data strings with the same keys.
+    """
+    thumbs = _resize_thumbs(Image.open(image_file), sizes)
+    data = {}
+    for key, thumb_img in thumbs.iteritems():
+        buffer = StringIO()
+        thumb_img.save(buffer, 'JPEG')
+        data[key] = buffer.getvalue()
+    return data
+
+def _render_thumbs_args(args):
+    return render_thumbs(*args)
+
+def render_thumbs_many(paths_and_sizes, processes=None):
+    """Render the thumbs of many images at once, across a process pool.
+
+    Images are only passed to the pool by path, and only the much smaller
+    thumbs are passed back. Without the :mod:`multiprocessing` module, as
+    in Python 2.5, the images are rendered one by one.
+
+    :param paths_and_sizes: A list of ``(path, sizes)`` tuples, as passed
+        to :func:`render_thumbs`.
+    :param processes: The size of the pool. Defaults to the number of CPUs.
+    :returns: A list of the results of :func:`render_thumbs`, in order.
+    """
+    paths_and_sizes = list(paths_and_sizes)
+    if multiprocessing is None or processes == 1 or len(paths_and_sizes) < 2:
+        return [render_thumbs(path, sizes) for path, sizes in paths_and_sizes]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_render_thumbs_args, paths_and_sizes)
+    finally:
+        pool.close()
+        pool.join()
+
 def create_thumbs_for(item, image_file, image_filename):
     """Creates thumbnails in all sizes for a given Media or Podcast object.
 
-    Side effects: Closes the open file handle passed in as image_file.
+    The thumbs are keyed by the contents of the image. If another item
+    already uses the same image, its thumbs are shared rather than
+    rendered again.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
-    :type item: ``tuple`` or mapped class instance
+    Side effects: Closes the open file handle passed in as image_file,
+    and sets the item's ``thumb_key``.
+
+    :param item: An ORM mapped class instance with _thumb_dir and
+        thumb_key attributes.
     :param image_file: An open file handle for the original image file.
     :type image_file: file
     :param image_filename: The original filename of the thumbnail image.
     :type image_filename: unicode
+    :returns: The paths of the item's previous thumbs, if nothing else
+        uses them. See :func:`deletable_thumb_paths`.
     """
-    image_dir, item_id = _normalize_thumb_item(item)
-    img = Image.open(image_file)
-
-    # TODO: Allow other formats?
-    for key, xy in config['thumb_sizes'][item._thumb_dir].iteritems():
-        path = thumb_path(item, key)
-        thumb_img = resize_thumb(img, xy)
-        if thumb_img.mode != "RGB":
-            thumb_img = thumb_img.convert("RGB")
-        thumb_img.save(path)
-
-    # Backup the original image just for kicks
-    backup_type = os.path.splitext(image_filename)[1].lower()[1:]
-    backup_path = thumb_path(item, 'orig', ext=backup_type)
-    backup_file = open(backup_path, 'w+b')
+    image_dir = item._thumb_dir
+    storage = image_storage()
+    sizes = config['thumb_sizes'][image_dir]
+
+    image_file.seek(0)
+    key = unicode(sha1_file(image_file))
     image_file.seek(0)
-    shutil.copyfileobj(image_file, backup_file)
+    old_paths = []
+    if key != item.thumb_key:
+        old_paths = deletable_thumb_paths(item)
+
+    names = dict((size, _thumb_name((image_dir, key), size))
+                 for size in sizes)
+    if any(not storage.exists(name) for name in names.itervalues()):
+        # TODO: Allow other formats?
+        thumbs = render_thumbs(image_file, sizes)
+        for size, data in thumbs.iteritems():
+            storage.store(StringIO(data), names[size])
+
+        # Backup the original image just for kicks
+        backup_type = os.path.splitext(image_filename)[1].lower()[1:]
+        image_file.seek(0)
+        storage.store(image_file,
+                      _thumb_name((image_dir, key), 'orig', ext=backup_type))
     image_file.close()
-    backup_file.close()
+
+    item.thumb_key = key
+    return old_paths
 
 def create_default_thumbs_for(item):
-    """Create copies of the default thumbs for the given item.
+    """Use the default thumbs for the given item.
 
-    This copies the default files (all named with an id of 'new') to
-    use the given item's id. This means there could be lots of duplicate
-    copies of the default thumbs, but at least we can always use the
-    same url when rendering.
+    The default files (all named with a key of 'new') are shared by every
+    item which uses them, so nothing is copied.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
-    :type item: ``tuple`` or mapped class instance
+    :param item: An ORM mapped class instance with a thumb_key attribute.
 
     """
-    image_dir, item_id = _normalize_thumb_item(item)
-    for key in config['thumb_sizes'][image_dir].iterkeys():
-        src_file = thumb_path((image_dir, 'new'), key)
-        dst_file = thumb_path(item, key)
-        shutil.copyfile(src_file, dst_file)
+    item.thumb_key = None
 
 def has_thumbs(item):
-    """Return True if a thumb exists for this item.
+    """Return True if the item has thumbs of its own, not the defaults.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
+    :param item: A 2-tuple with a subdir name and a key. If given a
+        ORM mapped class with _thumb_dir and thumb_key attributes, the
+        info can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     """
+    if hasattr(item, 'thumb_key'):
+        return item.thumb_key is not None
     return bool(thumb_path(item, 's', exists=True))
 
 def has_default_thumbs(item):
     """Return True if the thumbs for the given item are the defaults.
 
-    :param item: A 2-tuple with a subdir name and an ID. If given a
-        ORM mapped class with _thumb_dir and id attributes, the info
-        can be extracted automatically.
+    :param item: A 2-tuple with a subdir name and a key. If given a
+        ORM mapped class with _thumb_dir and thumb_key attributes, the
+        info can be extracted automatically.
     :type item: ``tuple`` or mapped class instance
     """
+    if hasattr(item, 'thumb_key'):
+        return item.thumb_key is None
     image_dir, item_id = _normalize_thumb_item(item)
     return filecmp.cmp(thumb_path((image_dir, item_id), 's'),
                        thumb_path((image_dir, 'new'), 's'))
+
+def deletable_thumb_paths(item):
+    """Return the paths of an item's thumbs which no other item uses.
+
+    Call this before the item is deleted, or given new thumbs, and delete
+    the files once that has been committed.
+
+    :param item: An ORM mapped class instance with _thumb_dir and
+        thumb_key attributes.
+    :returns: A list of paths, which is empty for the default thumbs.
+    """
+    if item.thumb_key is None:
+        return []
+    cls = item.__class__
+    shared = cls.query.filter(cls.thumb_key == item.thumb_key)
+    if item.id is not None:
+        shared = shared.filter(cls.id != item.id)
+    if shared.first() is not None:
+        return []
+    return thumb_paths(item).values()
@@ -0,0 +1,296 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Chunked, Resumable Uploads
+
+A form upload is spooled to a temporary file before our action is even
+called, then copied to the ``media_dir``, and a dropped connection means
+starting over. Large files can instead be sent as a series of chunks,
+each written straight to a partial file in ``<media_dir>/partial`` and
+hashed as it arrives. When the form is submitted with the ``upload_id``
+instead of a file, the finished file is moved into place without being
+copied.
+
+The protocol, used by ``/upload/chunk`` and the admin ``upload_chunk``
+action, is:
+
+1. ``POST`` the first chunk with a ``filename`` param, the raw bytes as the
+   request body, and a ``Content-Range: bytes 0-1048575/73400320`` header
+   giving its position in the whole file. The response is a JSON dict
+   with the ``upload_id`` to send with every later request, the
+   ``offset`` received so far, and whether the upload is ``complete``.
+2. ``POST`` each following chunk with the ``upload_id`` param.
+3. After an interruption, ``GET`` with the ``upload_id`` param to find out
+   the ``offset`` to resume from.
+
+Uploads larger than the ``max_upload_size`` setting are refused. Partial
+files which haven't grown for ``upload_expire`` seconds, one day by
+default, are deleted the next time an upload is started.
+
+"""
+
+import os
+import re
+import time
+import uuid
+
+import simplejson as json
+from paste.deploy.converters import asint
+from pylons import app_globals, config
+
+from mediacore.lib.compat import sha1
+
+__all__ = [
+    'ChunkedUpload',
+    'UploadError',
+    'get_upload',
+    'receive_chunk',
+    'sha1_file',
+]
+
+BLOCK_SIZE = 64 * 1024
+
+_id_re = re.compile(r'^[0-9a-f]{32}$')
+_content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# Running hashes of the uploads this process has received, keyed by ID,
+# as (offset, hash) tuples. Another process, or this one after a restart,
+# rehashes the partial file instead.
+_hashes = {}
+
+class UploadError(Exception):
+    """Raised when a chunk can't be accepted.
+
+    :attr:`offset` is the number of bytes received so far, if known, so
+    that the client can resume from there.
+
+    """
+    def __init__(self, message, offset=None):
+        Exception.__init__(self, message)
+        self.offset = offset
+
+def _update_hash(hash, file):
+    while True:
+        block = file.read(BLOCK_SIZE)
+        if not block:
+            break
+        hash.update(block)
+    return hash
+
+def sha1_file(file):
+    """Return the SHA-1 hex digest of the rest of a file-like object,
+    read one block at a time."""
+    return _update_hash(sha1(), file).hexdigest()
+
+def _upload_dir():
+    return os.path.join(config['media_dir'], 'partial')
+
+class ChunkedUpload(object):
+    """A file being uploaded in chunks, possibly over many requests.
+
+    :param upload_id: The 32 character hex ID of the upload.
+    :raises UploadError: If the ID is malformed or unknown.
+
+    """
+    def __init__(self, upload_id):
+        if not upload_id or not _id_re.match(upload_id):
+            raise UploadError('Invalid upload ID.')
+        self.id = str(upload_id)
+        self.path = os.path.join(_upload_dir(), self.id + '.part')
+        try:
+            f = open(self.path + '.json')
+        except IOError:
+            raise UploadError('Unknown upload ID.')
+        try:
+            info = json.load(f)
+        finally:
+            f.close()
+        self.filename = info['filename']
+        self.size = info['size']
+
+    @classmethod
+    def start(cls, filename, size):
+        """Begin a new upload of the given filename and total size."""
+        upload_dir = _upload_dir()
+        if not os.path.isdir(upload_dir):
+            try:
+                os.makedirs(upload_dir)
+            except OSError:
+                # Another process may have just created it
+                if not os.path.isdir(upload_dir):
+                    raise
+        delete_stale_uploads()
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(upload_dir, upload_id + '.part')
+        f = open(path + '.json', 'w')
+        try:
+            json.dump({'filename': filename, 'size': size}, f)
+        finally:
+            f.close()
+        open(path, 'wb').close()
+        return cls(upload_id)
+
+    @property
+    def offset(self):
+        """The number of bytes received so far."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def write_chunk(self, stream, first, length):
+        """Append ``length`` bytes read from ``stream`` at offset ``first``.
+
+        :raises UploadError: If ``first`` isn't the current offset, the
+            chunk would run past the end of the file, or the stream ends
+            early. Whatever was read is kept, so the client can resume.
+
+        Chunks of the same upload must be sent one at a time.
+
+        """
+        offset = self.offset
+        if first != offset:
+            raise UploadError('Expected the chunk at offset %d.' % offset,
+                              offset)
+        if first + length > self.size:
+            raise UploadError('The chunk runs past the end of the file.',
+                              offset)
+        hash = self._hash(offset)
+        remaining = length
+        f = open(self.path, 'ab')
+        try:
+            while remaining > 0:
+                block = stream.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                f.write(block)
+                hash.update(block)
+                remaining -= len(block)
+        finally:
+            f.close()
+            _hashes[self.id] = (self.offset, hash)
+        if remaining:
+            raise UploadError('The chunk ended early.', self.offset)
+
+    def _hash(self, offset):
+        """Return the running hash of the first ``offset`` bytes."""
+        known = _hashes.get(self.id)
+        if known is not None and known[0] == offset:
+            return known[1]
+        f = open(self.path, 'rb')
+        try:
+            return _update_hash(sha1(), f)
+        finally:
+            f.close()
+
+    def hexdigest(self):
+        """Return the SHA-1 hex digest of the data received so far."""
+        return self._hash(self.offset).hexdigest()
+
+    def open(self):
+        """Return the partial file, opened for reading."""
+        return open(self.path, 'rb')
+
+    def delete(self):
+        """Delete the partial file and forget about this upload."""
+        for path in (self.path, self.path + '.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _hashes.pop(self.id, None)
+
+    def as_dict(self):
+        return dict(
+            upload_id = self.id,
+            offset = self.offset,
+            complete = self.complete,
+        )
+
+def delete_stale_uploads(max_age=None):
+    """Delete partial uploads which haven't grown for ``max_age`` seconds,
+    and the info files of any whose partial file has gone missing."""
+    if max_age is None:
+        max_age = asint(config.get('upload_expire', 86400))
+    cutoff = time.time() - max_age
+    upload_dir = _upload_dir()
+    for name in os.listdir(upload_dir):
+        if name.endswith('.part.json'):
+            path = os.path.join(upload_dir, name[:-len('.json')])
+            if os.path.exists(path):
+                continue
+        elif name.endswith('.part'):
+            path = os.path.join(upload_dir, name)
+        else:
+            continue
+        for stale in (path, path + '.json'):
+            try:
+                if os.path.getmtime(stale) < cutoff:
+                    os.remove(stale)
+            except OSError:
+                pass
+
+def get_upload(upload_id):
+    """Return the finished upload with the given ID.
+
+    :raises UploadError: If it's unknown or incomplete.
+
+    """
+    upload = ChunkedUpload(upload_id)
+    if not upload.complete:
+        raise UploadError('The upload is incomplete.', upload.offset)
+    return upload
+
+def receive_chunk(environ, upload_id=None, filename=None):
+    """Handle a request of the chunked upload protocol.
+
+    :param environ: The WSGI environ of the request.
+    :param upload_id: The ID of an upload in progress, or None to begin
+        a new one with the first chunk.
+    :param filename: The name of the file, when beginning an upload.
+    :returns: :meth:`ChunkedUpload.as_dict`
+    :raises UploadError: If the request is malformed, or the chunk can't
+        be accepted.
+
+    """
+    if environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+        return ChunkedUpload(upload_id).as_dict()
+
+    match = _content_range_re.match(environ.get('HTTP_CONTENT_RANGE', ''))
+    if match is None:
+        raise UploadError('A Content-Range header is required.')
+    first, last, size = [int(x) for x in match.groups()]
+    length = last - first + 1
+    if length <= 0 or str(length) != environ.get('CONTENT_LENGTH'):
+        raise UploadError('The Content-Range and Content-Length differ.')
+
+    if upload_id:
+        upload = ChunkedUpload(upload_id)
+        if upload.size != size:
+            raise UploadError('The file size has changed.', upload.offset)
+    elif not filename:
+        raise UploadError('A filename is required.')
+    elif size > int(app_globals.settings['max_upload_size']):
+        raise UploadError('The file is too large.')
+    else:
+        upload = ChunkedUpload.start(filename, size)
+
+    upload.write_chunk(environ['wsgi.input'], first, length)
+    return upload.as_dict()
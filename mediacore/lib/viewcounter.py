@@ -0,0 +1,378 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+View Counters
+
+Issuing ``UPDATE media SET views = views + 1`` on every page hit makes
+popular pages queue up behind each other's row locks. The counters in
+this module collect views and write them back as aggregated deltas in
+a single batch instead.
+
+The counter in use is chosen with the ``view_counter`` option in your
+config file and is available as ``app_globals.view_counter``:
+
+``direct``
+    Write every view immediately, within the current request.
+
+``buffered``
+    Sum views in process memory and flush them every
+    ``view_counter_flush_interval`` seconds or once
+    ``view_counter_flush_threshold`` views have been collected,
+    whichever comes first. Views still in memory are lost if the
+    process is killed.
+
+``journal``
+    Like ``buffered``, but every view is also appended to a journal
+    file for this process in ``view_counter_journal_dir``. Journals
+    left behind by processes that have died are replayed by the next
+    flush in any other process, so views survive worker restarts.
+    Views are delivered at least once: a process killed between the
+    database commit and the journal cleanup will count them twice.
+    The journal dir must be local to the machine since process IDs are
+    used to find abandoned journals.
+
+"""
+
+import atexit
+import errno
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import exc, sql
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'BufferedViewCounter',
+    'JournalViewCounter',
+    'ViewCounter',
+    'view_counter_from_config',
+]
+
+class ViewCounter(object):
+    """Count each view with an immediate UPDATE in the current session."""
+
+    def increment(self, media_id, count=1):
+        """Count ``count`` views for the given media ID."""
+        from mediacore.model.meta import DBSession
+        from mediacore.model.media import Media
+
+        # Don't raise an exception should concurrency problems occur.
+        # Views will not actually be incremented in this case, but thats
+        # relatively unimportant compared to rendering the page for the user.
+        transaction = DBSession.begin_nested()
+        try:
+            DBSession.execute(self._update_statement(),
+                              {'media_id': media_id, 'delta': count},
+                              Media)
+            transaction.commit()
+        except exc.OperationalError, e:
+            transaction.rollback()
+            # (OperationalError) (1205, 'Lock wait timeout exceeded, try restarting the transaction')
+            if not '1205' in e.message:
+                raise
+
+    def flush(self):
+        """Write any pending views to the database.
+
+        This counter doesn't buffer anything so this is a no-op.
+
+        """
+        pass
+
+    def _update_statement(self):
+        from mediacore.model.media import media
+        # Pass modified_on explicitly so that its onupdate default isn't
+        # triggered: a view doesn't modify the media.
+        return media.update()\
+            .where(media.c.id == sql.bindparam('media_id'))\
+            .values(views=media.c.views + sql.bindparam('delta'),
+                    modified_on=media.c.modified_on)
+
+    def _write(self, deltas):
+        """Add the given ``{media_id: delta}`` to the database in one batch.
+
+        This runs on its own connection and transaction so that it's
+        independent of whatever request happens to trigger the flush.
+
+        """
+        from mediacore.model import meta
+        params = [{'media_id': media_id, 'delta': delta}
+                  for media_id, delta in sorted(deltas.iteritems())
+                  if delta]
+        if not params:
+            return
+        conn = meta.engine.connect()
+        try:
+            trans = conn.begin()
+            try:
+                conn.execute(self._update_statement(), params)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        finally:
+            conn.close()
+
+class BufferedViewCounter(ViewCounter):
+    """Sum views in memory and periodically flush them in a batch."""
+
+    def __init__(self, flush_interval=30, flush_threshold=1000):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._pending_total = 0
+        self._last_flush = time.time()
+        self._timer = None
+        self._timer_pid = None
+        atexit.register(self.flush)
+
+    def increment(self, media_id, count=1):
+        self._lock.acquire()
+        try:
+            self._record(media_id, count)
+            self._pending[media_id] = self._pending.get(media_id, 0) + count
+            self._pending_total += count
+            flush_due = self._pending_total >= self.flush_threshold \
+                or time.time() - self._last_flush >= self.flush_interval
+        finally:
+            self._lock.release()
+        self._ensure_timer()
+        if flush_due:
+            self.flush(blocking=False)
+
+    def flush(self, blocking=True):
+        """Write all pending views to the database.
+
+        :param blocking: If False and another thread is already flushing,
+            return immediately instead of waiting for it to finish.
+        :returns: True if a flush was run.
+
+        """
+        if not self._flush_lock.acquire(blocking):
+            return False
+        try:
+            self._lock.acquire()
+            try:
+                deltas = self._take_pending()
+            finally:
+                self._lock.release()
+            self._flush(deltas)
+            return True
+        finally:
+            self._flush_lock.release()
+
+    def _record(self, media_id, count):
+        """Hook for persisting a view as it's counted. Called with the lock."""
+        pass
+
+    def _take_pending(self):
+        """Swap out the pending views. Called with the lock."""
+        deltas = self._pending
+        self._pending = {}
+        self._pending_total = 0
+        self._last_flush = time.time()
+        return deltas
+
+    def _flush(self, deltas):
+        try:
+            self._write(deltas)
+        except exc.DBAPIError, e:
+            log.warn('Unable to flush %d view counts, will retry: %s',
+                     len(deltas), e)
+            self._requeue(deltas)
+
+    def _requeue(self, deltas):
+        self._lock.acquire()
+        try:
+            for media_id, delta in deltas.iteritems():
+                self._pending[media_id] = self._pending.get(media_id, 0) + delta
+                self._pending_total += delta
+        finally:
+            self._lock.release()
+
+    def _ensure_timer(self):
+        """Make sure a flush thread is running in this process.
+
+        Checking the pid restarts the thread in forked children, where
+        only the thread that forked survives.
+
+        """
+        pid = os.getpid()
+        if self._timer is not None and self._timer_pid == pid \
+        and self._timer.isAlive():
+            return
+        self._lock.acquire()
+        try:
+            if self._timer is None or self._timer_pid != pid \
+            or not self._timer.isAlive():
+                self._timer = threading.Thread(target=self._run_timer,
+                                               name='ViewCounterFlush')
+                self._timer.setDaemon(True)
+                self._timer_pid = pid
+                self._timer.start()
+        finally:
+            self._lock.release()
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Unexpected error flushing view counts')
+
+class JournalViewCounter(BufferedViewCounter):
+    """Sum views in memory, backed by a per-process journal on disk.
+
+    Each view is appended to ``<pid>.journal``. A flush renames the
+    journal to a batch file, writes the batch to the database and then
+    deletes it. Batch files and journals of dead processes are claimed
+    (by renaming them to our pid) and written by the next flush.
+
+    """
+
+    def __init__(self, journal_dir, flush_interval=30, flush_threshold=1000):
+        self.journal_dir = journal_dir
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        self._journal = None
+        self._journal_pid = None
+        self._batch_seq = 0
+        BufferedViewCounter.__init__(self, flush_interval, flush_threshold)
+
+    def _record(self, media_id, count):
+        journal = self._open_journal()
+        journal.write('%d %d\n' % (media_id, count))
+        journal.flush()
+
+    def _open_journal(self):
+        pid = os.getpid()
+        if self._journal is None or self._journal_pid != pid:
+            # Don't close a journal inherited from our parent process:
+            # the parent is still writing to it.
+            self._journal = open(self._journal_path(pid), 'a')
+            self._journal_pid = pid
+        return self._journal
+
+    def _journal_path(self, pid):
+        return os.path.join(self.journal_dir, '%d.journal' % pid)
+
+    def _take_pending(self):
+        pid = os.getpid()
+        if self._journal is not None and self._journal_pid == pid:
+            self._journal.close()
+            self._journal = None
+            self._claim(self._journal_path(pid), pid)
+        return BufferedViewCounter._take_pending(self)
+
+    def _flush(self, deltas):
+        # The in-memory deltas are only used to decide when to flush;
+        # the batch files on disk are the authoritative record.
+        pid = os.getpid()
+        self._claim_abandoned(pid)
+        for path in self._batch_paths(pid):
+            deltas = self._read(path)
+            try:
+                self._write(deltas)
+            except exc.DBAPIError, e:
+                log.warn('Unable to flush view count journal %s, '
+                         'will retry: %s', path, e)
+                return
+            os.remove(path)
+
+    def _claim(self, path, pid):
+        """Rename the given journal or batch file to a new batch for pid.
+
+        :returns: True if we got it, False if another process beat us to it.
+
+        """
+        self._batch_seq += 1
+        name = os.path.basename(path).split('.', 1)[0]
+        batch = '%s-%d-%d.batch-%d' % (name, int(time.time()),
+                                       self._batch_seq, pid)
+        try:
+            os.rename(path, os.path.join(self.journal_dir, batch))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    def _claim_abandoned(self, pid):
+        for filename in os.listdir(self.journal_dir):
+            owner = _file_owner(filename)
+            if owner is not None and owner != pid and not _pid_exists(owner):
+                self._claim(os.path.join(self.journal_dir, filename), pid)
+
+    def _batch_paths(self, pid):
+        suffix = '.batch-%d' % pid
+        return sorted(os.path.join(self.journal_dir, filename)
+                      for filename in os.listdir(self.journal_dir)
+                      if filename.endswith(suffix))
+
+    def _read(self, path):
+        deltas = {}
+        f = open(path)
+        try:
+            for line in f:
+                try:
+                    media_id, count = map(int, line.split())
+                except ValueError:
+                    # A partially written line from a killed process.
+                    continue
+                deltas[media_id] = deltas.get(media_id, 0) + count
+        finally:
+            f.close()
+        return deltas
+
+def _file_owner(filename):
+    """Return the pid that owns the given journal or batch filename."""
+    name, ext = os.path.splitext(filename)
+    try:
+        if ext == '.journal':
+            return int(name)
+        elif ext.startswith('.batch-'):
+            return int(ext[len('.batch-'):])
+    except ValueError:
+        pass
+    return None
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+def view_counter_from_config(config):
+    """Create the view counter specified by the ``view_counter`` option."""
+    method = config.get('view_counter', 'buffered')
+    if method == 'direct':
+        return ViewCounter()
+    flush_interval = int(config.get('view_counter_flush_interval', 30))
+    flush_threshold = int(config.get('view_counter_flush_threshold', 1000))
+    if method == 'buffered':
+        return BufferedViewCounter(flush_interval, flush_threshold)
+    elif method == 'journal':
+        journal_dir = config.get('view_counter_journal_dir', None) \
+            or os.path.join(config['cache_dir'], 'views')
+        return JournalViewCounter(journal_dir, flush_interval, flush_threshold)
+    raise ValueError, 'Unknown view_counter method: %r' % method
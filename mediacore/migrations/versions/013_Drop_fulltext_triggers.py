@@ -0,0 +1,42 @@
+"""
+Drop the MySQL triggers which used to maintain the media_fulltext table.
+
+The fulltext index is now maintained by the application itself, see
+mediacore.model.fulltext. If the triggers were never installed, the
+index will be empty until it's rebuilt with:
+
+    paster fulltext-index deployment.ini
+
+"""
+import logging
+from sqlalchemy import *
+from sqlalchemy import exc
+from migrate import *
+
+log = logging.getLogger(__name__)
+
+triggers = [
+    'media_ai', 'media_au', 'media_ad',
+    'media_tags_ai', 'media_tags_ad', 'tags_au', 'tags_ad',
+    'media_categories_ai', 'media_categories_ad',
+    'categories_au', 'categories_ad',
+]
+
+def upgrade(migrate_engine):
+    if migrate_engine.dialect.name != 'mysql':
+        return
+    for trigger in triggers:
+        try:
+            migrate_engine.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+        except exc.DBAPIError, e:
+            # Triggers could only be installed by a MySQL superuser, so the
+            # regular database user may not be allowed to drop them.
+            log.warn('Unable to drop trigger %s, please drop it as a MySQL '
+                     'superuser: %s', trigger, e)
+    log.info('If search returns no results, rebuild the fulltext index '
+             'with: paster fulltext-index deployment.ini')
+
+def downgrade(migrate_engine):
+    # The triggers must be reinstalled as a MySQL superuser using the
+    # setup_triggers.sql script from a previous release.
+    pass
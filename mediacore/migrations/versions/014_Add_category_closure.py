@@ -0,0 +1,68 @@
+"""
+Add the category_closure table which indexes the category hierarchy.
+
+The table holds a row for every ancestor of each category, including the
+category itself at depth 0, so that all descendants or ancestors can be
+fetched with a single join. See mediacore.model.categories.
+"""
+import logging
+from sqlalchemy import *
+from migrate import *
+
+log = logging.getLogger(__name__)
+
+metadata = MetaData()
+categories = Table('categories', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('name', Unicode(50), nullable=False, index=True),
+    Column('slug', Unicode(50), nullable=False, unique=True),
+    Column('parent_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE')),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True, index=True),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    category_closure.create(checkfirst=True)
+    conn = migrate_engine.connect()
+    transaction = conn.begin()
+    try:
+        backfill_closure(conn)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    category_closure.drop(checkfirst=True)
+
+def backfill_closure(conn):
+    conn.execute(category_closure.delete())
+    parents = dict(conn.execute(
+        select([categories.c.id, categories.c.parent_id])
+    ).fetchall())
+    rows = []
+    for cat_id in parents:
+        ancestor_id, depth = cat_id, 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append({'ancestor_id': ancestor_id,
+                         'descendant_id': cat_id,
+                         'depth': depth})
+            ancestor_id = parents.get(ancestor_id, None)
+            depth += 1
+        if ancestor_id is not None:
+            log.warning('Category ID %d has circular nesting, its '
+                        'ancestors have been truncated.' % cat_id)
+    if rows:
+        conn.execute(category_closure.insert(), rows)
@@ -0,0 +1,40 @@
+"""
+Add the jobs table which holds the background job queue.
+
+See mediacore.lib.jobs.
+"""
+from datetime import datetime
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+jobs = Table('jobs', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('type', Unicode(50), nullable=False),
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE')),
+    Column('args', UnicodeText),
+    Column('status', Unicode(20), default=u'queued', nullable=False, index=True),
+    Column('attempts', Integer, default=0, nullable=False),
+    Column('error', UnicodeText),
+    Column('worker', Unicode(100)),
+    Column('created_on', DateTime, default=datetime.now, nullable=False),
+    Column('run_after', DateTime),
+    Column('started_on', DateTime),
+    Column('finished_on', DateTime),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    jobs.create(checkfirst=True)
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    jobs.drop(checkfirst=True)
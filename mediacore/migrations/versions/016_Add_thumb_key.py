@@ -0,0 +1,67 @@
+"""
+Add the thumb_key column to media and podcasts, which names their thumbs.
+
+Existing thumbs are named by ID, so the key is set to the ID, except for
+items whose thumbs are copies of the defaults, which now share the
+default files instead. See mediacore.lib.thumbnails.
+"""
+import filecmp
+import os
+from sqlalchemy import *
+from migrate import *
+
+from pylons import config
+
+metadata = MetaData()
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+podcasts = Table('podcasts', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+tables = [(media, 'media'), (podcasts, 'podcasts')]
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for table, thumb_dir in tables:
+        Column('thumb_key', Unicode(40)).create(table)
+    conn = migrate_engine.connect()
+    transaction = conn.begin()
+    try:
+        for table, thumb_dir in tables:
+            backfill_thumb_keys(conn, table, thumb_dir)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for table, thumb_dir in tables:
+        Column('thumb_key', Unicode(40)).drop(table)
+
+def backfill_thumb_keys(conn, table, thumb_dir):
+    conn.execute(table.update().values(
+        thumb_key=cast(table.c.id, String)))
+
+    image_dir = config.get('image_dir', None)
+    if not image_dir:
+        return
+    default = os.path.join(image_dir, thumb_dir, 'news.jpg')
+    if not os.path.exists(default):
+        return
+    default_ids = []
+    for (item_id,) in conn.execute(select([table.c.id])):
+        path = os.path.join(image_dir, thumb_dir, '%ss.jpg' % item_id)
+        if not os.path.exists(path) or filecmp.cmp(path, default):
+            default_ids.append(item_id)
+    if default_ids:
+        conn.execute(table.update()\
+            .where(table.c.id.in_(default_ids))\
+            .values(thumb_key=None))
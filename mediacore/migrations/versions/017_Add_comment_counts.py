@@ -0,0 +1,52 @@
+"""
+Add the comment_count and comment_count_published columns to media.
+
+They replace the correlated subqueries which used to count the comments
+of each media item in every listing, and are kept up to date as comments
+are saved. See mediacore.model.comments.
+"""
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+comments = Table('comments', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE')),
+    Column('publishable', Boolean, default=False, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+count_columns = ('comment_count', 'comment_count_published')
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for name in count_columns:
+        Column(name, Integer, server_default='0', nullable=False).create(media)
+    conn = migrate_engine.connect()
+    transaction = conn.begin()
+    try:
+        backfill_comment_counts(conn)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for name in count_columns:
+        Column(name, Integer).drop(media)
+
+def backfill_comment_counts(conn):
+    count = select([func.count(comments.c.id)],
+                   comments.c.media_id == media.c.id)
+    published = count.where(comments.c.publishable == True)
+    conn.execute(media.update().values(
+        comment_count=count.as_scalar(),
+        comment_count_published=published.as_scalar()))
@@ -0,0 +1,43 @@
+"""
+Add the indexed is_live column to media, so that public queries can find
+the published media without comparing their publish dates to the current
+time. See mediacore.lib.publishing.
+"""
+from datetime import datetime
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('reviewed', Boolean, default=False, nullable=False),
+    Column('encoded', Boolean, default=False, nullable=False),
+    Column('publishable', Boolean, default=False, nullable=False),
+    Column('modified_on', DateTime, default=datetime.now, onupdate=datetime.now, nullable=False),
+    Column('publish_on', DateTime),
+    Column('publish_until', DateTime),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    is_live = Column('is_live', Boolean, server_default='0', nullable=False)
+    is_live.create(media)
+    Index('ix_media_is_live', is_live).create()
+    now = datetime.now()
+    migrate_engine.execute(media.update()\
+        .where(and_(
+            media.c.reviewed == True,
+            media.c.encoded == True,
+            media.c.publishable == True,
+            media.c.publish_on <= now,
+            or_(media.c.publish_until == None,
+                media.c.publish_until >= now),
+        ))\
+        .values(is_live=True, modified_on=media.c.modified_on))
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    # The index is dropped along with the column
+    Column('is_live', Boolean).drop(media)
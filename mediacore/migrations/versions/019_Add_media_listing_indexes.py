@@ -0,0 +1,51 @@
+"""
+Add composite indexes on media for the public listings and the admin
+dashboard. The index on is_live alone is replaced by the first two.
+"""
+from datetime import datetime
+from sqlalchemy import *
+from migrate import *
+
+metadata = MetaData()
+podcasts = Table('podcasts', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+media = Table('media', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('podcast_id', Integer, ForeignKey('podcasts.id', onupdate='CASCADE', ondelete='SET NULL')),
+    Column('reviewed', Boolean, default=False, nullable=False),
+    Column('encoded', Boolean, default=False, nullable=False),
+    Column('publishable', Boolean, default=False, nullable=False),
+    Column('is_live', Boolean, default=False, nullable=False),
+    Column('modified_on', DateTime, default=datetime.now, onupdate=datetime.now, nullable=False),
+    Column('publish_on', DateTime),
+    Column('popularity_points', Integer, default=0, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+
+is_live_index = Index('ix_media_is_live', media.c.is_live)
+
+indexes = [
+    Index('media_live_publish_on', media.c.is_live, media.c.publish_on),
+    Index('media_live_popularity', media.c.is_live, media.c.popularity_points),
+    Index('media_podcast_live_publish_on',
+          media.c.podcast_id, media.c.is_live, media.c.publish_on),
+    Index('media_status_modified_on', media.c.reviewed, media.c.encoded,
+          media.c.publishable, media.c.modified_on),
+]
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    for index in indexes:
+        index.create()
+    is_live_index.drop()
+
+def downgrade(migrate_engine):
+    metadata.bind = migrate_engine
+    is_live_index.create()
+    for index in indexes:
+        index.drop()
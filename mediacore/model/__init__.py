@@ -35,9 +35,18 @@ slug_length = 50
 # and import them at the bottom of this file.
 ######
 
-def init_model(engine):
-    """Call me before using any of the tables or classes in the model."""
-    DBSession.configure(bind=engine)
+def init_model(engine, fulltext_listeners=()):
+    """Call me before using any of the tables or classes in the model.
+
+    :param engine: The SQLAlchemy engine to bind to.
+    :param fulltext_listeners: Callables to notify of changes to the
+        search index. See :class:`mediacore.model.fulltext.FullTextIndexer`.
+
+    """
+    from mediacore.model.events import change_notifier
+    from mediacore.model.fulltext import FullTextIndexer
+    indexer = FullTextIndexer(fulltext_listeners)
+    DBSession.configure(bind=engine, extension=[indexer, change_notifier])
     from mediacore.model import meta
     meta.metadata.bind = engine
     meta.engine = engine
@@ -246,6 +255,7 @@ __all__ = [
     'Category',
     'Media', 'MediaFile',
     'Podcast',
+    'Job',
 ]
 
 from mediacore.model.auth import User, Group, Permission
@@ -256,3 +266,4 @@ from mediacore.model.tags import Tag
 from mediacore.model.categories import Category
 from mediacore.model.media import Media, MediaFile
 from mediacore.model.podcasts import Podcast
+from mediacore.model.jobs import Job
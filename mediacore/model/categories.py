@@ -33,6 +33,22 @@ categories = Table('categories', metadata,
     mysql_charset='utf8'
 )
 
+category_closure = Table('category_closure', metadata,
+    Column('ancestor_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True, index=True),
+    Column('depth', Integer, nullable=False),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8'
+)
+"""A closure table: one row for every ancestor of each category.
+
+Every category is also listed as its own ancestor at depth 0, so that
+a category and all its descendants can be found with one indexed join
+on ``ancestor_id``, and all its ancestors with one on ``descendant_id``.
+This table is maintained by :class:`CategoryClosureExtension`.
+
+"""
+
 class CategoryNestingException(Exception):
     pass
 
@@ -142,19 +158,38 @@ class Category(object):
         return traverse(self.children)
 
     def descendants(self):
-        """Return a list of descendants in depth-first order."""
-        return [desc for desc, depth in self.traverse()]
+        """Return a list of descendants in depth-first order.
+
+        All descendants are fetched with a single query using the
+        :data:`category_closure` table.
+
+        """
+        if self.id is None:
+            return CategoryList(desc for desc, depth in self.traverse())
+        descs = Category.query\
+            .join((category_closure,
+                   category_closure.c.descendant_id == Category.id))\
+            .filter(category_closure.c.ancestor_id == self.id)\
+            .filter(category_closure.c.depth > 0)\
+            .all()
+        # The query is ordered by name, so each list of children is too
+        children = defaultdict(list)
+        for desc in descs:
+            children[desc.parent_id].append(desc)
+        def _depth_first(parent_id):
+            for child in children.pop(parent_id, ()):
+                yield child
+                for desc in _depth_first(child.id):
+                    yield desc
+        return CategoryList(_depth_first(self.id))
 
     def ancestors(self):
         """Return a list of ancestors, starting with the root node.
 
-        This method is optimized for when all categories have already
-        been fetched in the current DBSession::
+        All ancestors are fetched with a single query using the
+        :data:`category_closure` table::
 
-            >>> Category.query.all()    # run one query
-            >>> row = Category.query.get(50)   # doesn't use a query
-            >>> row.parent    # the DBSession recognized the primary key
-            <Category: parent>
+            >>> row = Category.query.get(50)
             >>> print row.ancestors()
             [...,
              <Category: great-grand-parent>,
@@ -162,6 +197,14 @@ class Category(object):
              <Category: parent>]
 
         """
+        if self.id is not None:
+            return CategoryList(Category.query\
+                .join((category_closure,
+                       category_closure.c.ancestor_id == Category.id))\
+                .filter(category_closure.c.descendant_id == self.id)\
+                .filter(category_closure.c.depth > 0)\
+                .order_by(category_closure.c.depth.desc()))
+        # Unsaved categories aren't in the closure table yet
         ancestors = CategoryList()
         anc = self.parent
         while anc:
@@ -177,7 +220,97 @@ class Category(object):
         return len(self.ancestors())
 
 
-mapper(Category, categories, order_by=categories.c.name, properties={
+class CategoryClosureExtension(interfaces.MapperExtension):
+    """Keep the :data:`category_closure` table in sync with the tree.
+
+    Rows are written with the same connection as the category itself,
+    so the closure table is always consistent within the transaction.
+
+    """
+    def after_insert(self, mapper, connection, instance):
+        insert_closure(connection, instance.id, instance.parent_id)
+        return interfaces.EXT_CONTINUE
+
+    def after_update(self, mapper, connection, instance):
+        old_parent_id = connection.execute(
+            sql.select([category_closure.c.ancestor_id],
+                       sql.and_(category_closure.c.descendant_id == instance.id,
+                                category_closure.c.depth == 1))
+        ).scalar()
+        if old_parent_id != instance.parent_id:
+            move_closure(connection, instance.id, instance.parent_id)
+        return interfaces.EXT_CONTINUE
+
+    def after_delete(self, mapper, connection, instance):
+        connection.execute(category_closure.delete().where(sql.or_(
+            category_closure.c.ancestor_id == instance.id,
+            category_closure.c.descendant_id == instance.id,
+        )))
+        return interfaces.EXT_CONTINUE
+
+def insert_closure(conn, cat_id, parent_id):
+    """Add the closure rows for a new category with no children."""
+    rows = [{'ancestor_id': cat_id, 'descendant_id': cat_id, 'depth': 0}]
+    if parent_id is not None:
+        query = sql.select([category_closure.c.ancestor_id,
+                            category_closure.c.depth],
+                           category_closure.c.descendant_id == parent_id)
+        for ancestor_id, depth in conn.execute(query):
+            rows.append({'ancestor_id': ancestor_id,
+                         'descendant_id': cat_id,
+                         'depth': depth + 1})
+    conn.execute(category_closure.insert(), rows)
+
+def move_closure(conn, cat_id, parent_id):
+    """Move the given category and all its descendants to a new parent.
+
+    The links between the subtree and its old ancestors are deleted and
+    replaced with links to its new ancestors. The links within the
+    subtree are left untouched.
+
+    """
+    subtree = dict(conn.execute(
+        sql.select([category_closure.c.descendant_id,
+                    category_closure.c.depth],
+                   category_closure.c.ancestor_id == cat_id)
+    ).fetchall())
+    if not subtree:
+        # This category was never indexed, so index it now. Its children
+        # will be indexed too as they're saved.
+        insert_closure(conn, cat_id, parent_id)
+        return
+    if parent_id in subtree:
+        raise CategoryNestingException, 'Category %s cannot be moved into ' \
+            'one of its own descendants.' % cat_id
+
+    old_ancestor_ids = [row[0] for row in conn.execute(
+        sql.select([category_closure.c.ancestor_id],
+                   sql.and_(category_closure.c.descendant_id == cat_id,
+                            category_closure.c.depth > 0))
+    )]
+    if old_ancestor_ids:
+        conn.execute(category_closure.delete().where(sql.and_(
+            category_closure.c.descendant_id.in_(subtree.keys()),
+            category_closure.c.ancestor_id.in_(old_ancestor_ids),
+        )))
+
+    if parent_id is not None:
+        new_ancestors = conn.execute(
+            sql.select([category_closure.c.ancestor_id,
+                        category_closure.c.depth],
+                       category_closure.c.descendant_id == parent_id)
+        ).fetchall()
+        rows = []
+        for ancestor_id, anc_depth in new_ancestors:
+            for descendant_id, desc_depth in subtree.iteritems():
+                rows.append({'ancestor_id': ancestor_id,
+                             'descendant_id': descendant_id,
+                             'depth': anc_depth + desc_depth + 1})
+        if rows:
+            conn.execute(category_closure.insert(), rows)
+
+mapper(Category, categories, order_by=categories.c.name,
+       extension=CategoryClosureExtension(), properties={
     'children': relation(Category,
         backref=backref('parent', remote_side=[categories.c.id]),
         order_by=categories.c.name.asc(),
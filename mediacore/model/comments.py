@@ -21,6 +21,12 @@ Comments come with two status flags:
     * reviewed
     * publishable
 
+The number of comments on each media item is kept in its
+``comment_count`` and ``comment_count_published`` columns, which are
+updated whenever a comment is saved, see :class:`CommentCountExtension`.
+If they are ever changed outside the ORM, they can be recounted with
+``paster reconcile-comment-counts``.
+
 """
 from datetime import datetime
 from sqlalchemy import Table, ForeignKey, Column, sql
@@ -111,7 +117,87 @@ class Comment(object):
     """)
 
 
-mapper(Comment, comments, order_by=comments.c.created_on, properties={
+# The counter columns on the media table. It can't be imported here, since
+# mediacore.model.media imports this module.
+media_counts = sql.table('media',
+    sql.column('id'),
+    sql.column('comment_count'),
+    sql.column('comment_count_published'),
+)
+
+def add_to_comment_counts(conn, media_id, count, published):
+    """Add the given numbers to the comment counts of a media item."""
+    if media_id is None or not (count or published):
+        return
+    conn.execute(media_counts.update()\
+        .where(media_counts.c.id == media_id)\
+        .values(comment_count=media_counts.c.comment_count + count,
+                comment_count_published=\
+                    media_counts.c.comment_count_published + published))
+
+def reconcile_comment_counts(conn, media_ids=None):
+    """Recount the comments of the given media items, or all of them.
+
+    :returns: The number of media items updated.
+
+    """
+    count = sql.select([sql.func.count(comments.c.id)],
+                       comments.c.media_id == media_counts.c.id)
+    published = count.where(comments.c.publishable == True)
+    query = media_counts.update().values(
+        comment_count=count.as_scalar(),
+        comment_count_published=published.as_scalar())
+    if media_ids is not None:
+        query = query.where(media_counts.c.id.in_(media_ids))
+    return conn.execute(query).rowcount
+
+class CommentCountExtension(interfaces.MapperExtension):
+    """Keep the comment counts of each media item up to date.
+
+    The counts are adjusted with the same connection as the comment
+    itself, so they're always consistent within the transaction. The
+    previous values of a changed comment may not have been loaded, so
+    they're read from the database before it's updated.
+
+    """
+    def _counted_as(self, connection, instance):
+        row = connection.execute(
+            sql.select([comments.c.media_id, comments.c.publishable],
+                       comments.c.id == instance.id)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        return row[0], int(bool(row[1]))
+
+    def after_insert(self, mapper, connection, instance):
+        add_to_comment_counts(connection, instance.media_id,
+                              1, int(bool(instance.publishable)))
+        return interfaces.EXT_CONTINUE
+
+    def before_update(self, mapper, connection, instance):
+        instance._counted_as = self._counted_as(connection, instance)
+        return interfaces.EXT_CONTINUE
+
+    def after_update(self, mapper, connection, instance):
+        old_media_id, old_published = instance.__dict__.pop('_counted_as')
+        published = int(bool(instance.publishable))
+        if old_media_id == instance.media_id:
+            add_to_comment_counts(connection, instance.media_id,
+                                  0, published - old_published)
+        else:
+            add_to_comment_counts(connection, old_media_id,
+                                  -1, -old_published)
+            add_to_comment_counts(connection, instance.media_id,
+                                  1, published)
+        return interfaces.EXT_CONTINUE
+
+    def before_delete(self, mapper, connection, instance):
+        media_id, published = self._counted_as(connection, instance)
+        add_to_comment_counts(connection, media_id, -1, -published)
+        return interfaces.EXT_CONTINUE
+
+mapper(Comment, comments, order_by=comments.c.created_on,
+       extension=CommentCountExtension(), properties={
     'author': composite(AuthorWithIP,
         comments.c.author_name,
         comments.c.author_email,
@@ -0,0 +1,119 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Change Notification
+
+:data:`change_notifier` records the objects that are inserted, updated
+or deleted through the ORM and, once the transaction is committed, tells
+any interested listeners what changed. This is how our caches learn that
+they're out of date::
+
+    def categories_changed(changes):
+        bump_version('categories')
+
+    change_notifier.listen(categories_changed, Category)
+
+Listeners are passed a dict which maps each changed class to a dict of
+primary keys and the names of the attributes that were changed. Inserted
+and deleted objects are mapped to ``None`` since all their attributes
+have changed::
+
+    {Media: {1: set(['title', 'tags']), 2: None}}
+
+Changes made with SQL expressions, bypassing the ORM, are not recorded,
+but they can be reported to the listeners with :meth:`ChangeNotifier.notify`.
+
+"""
+
+import logging
+import weakref
+
+from sqlalchemy.orm import attributes, object_mapper
+from sqlalchemy.orm.interfaces import SessionExtension
+
+log = logging.getLogger(__name__)
+
+__all__ = ['ChangeNotifier', 'change_notifier']
+
+class ChangeNotifier(SessionExtension):
+    """Notify listeners of the changes made by each committed transaction."""
+
+    def __init__(self):
+        self.listeners = []
+        self._changes = weakref.WeakKeyDictionary()
+
+    def listen(self, callback, *classes):
+        """Call ``callback(changes)`` after a commit changes any of ``classes``.
+
+        Only the changes to the given classes, or their subclasses, are
+        passed to the callback.
+
+        """
+        self.listeners.append((callback, classes))
+
+    def after_flush(self, session, flush_context):
+        changes = self._changes.setdefault(session, {})
+        for obj in session.new:
+            self._record(changes, obj, None)
+        for obj in session.deleted:
+            self._record(changes, obj, None)
+        for obj in session.dirty:
+            state = attributes.instance_state(obj)
+            # The original values of changed attributes are kept here until
+            # the flush is finalized, which happens after this hook.
+            if state.committed_state:
+                self._record(changes, obj, set(state.committed_state))
+
+    def _record(self, changes, obj, keys):
+        # New objects aren't given an identity key until after this hook,
+        # so read the primary key from the instance itself.
+        pk = tuple(object_mapper(obj).primary_key_from_instance(obj))
+        if len(pk) == 1:
+            pk = pk[0]
+        by_pk = changes.setdefault(obj.__class__, {})
+        if keys is None or by_pk.get(pk, keys) is None:
+            by_pk[pk] = None
+        else:
+            by_pk.setdefault(pk, set()).update(keys)
+
+    def after_commit(self, session):
+        # Changes from rolled back transactions are kept and reported with
+        # the next commit. At worst this invalidates a few caches needlessly.
+        changes = self._changes.pop(session, None)
+        if changes:
+            self.notify(changes)
+
+    def notify(self, changes):
+        """Pass the given changes to the interested listeners.
+
+        Call this once changes made without the ORM have been committed.
+
+        :param changes: A dict in the same form as the listeners are passed.
+
+        """
+        for callback, classes in self.listeners:
+            relevant = dict((cls, pks) for cls, pks in changes.iteritems()
+                            if not classes or issubclass(cls, classes))
+            if relevant:
+                try:
+                    callback(relevant)
+                except Exception:
+                    # The commit has already happened, so don't fail the
+                    # request over it.
+                    log.exception('Error notifying %r of changes', callback)
+
+change_notifier = ChangeNotifier()
+"""The :class:`ChangeNotifier` installed on our :data:`DBSession`."""
@@ -0,0 +1,236 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fulltext Search Indexing
+
+The ``media_fulltext`` table holds a denormalized copy of the searchable
+text of each :class:`~mediacore.model.media.Media` item, along with the
+names of its tags and categories. MySQL only supports FULLTEXT indexes
+on MyISAM tables, so this data can't live in our InnoDB tables.
+
+:class:`FullTextIndexer` keeps this table up to date from the
+application: it watches each session flush for changes to the indexed
+columns of media, and to the names of tags and categories, and rewrites
+the affected ``media_fulltext`` rows in one batch when the transaction
+is committed. Changes to other columns, such as views or likes, never
+touch the index.
+
+The index can be rebuilt from scratch with ``paster fulltext-index``.
+
+"""
+
+import weakref
+
+from sqlalchemy import sql
+from sqlalchemy.orm import attributes
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from mediacore.model.categories import Category, categories, category_closure
+from mediacore.model.media import (Media, media, media_fulltext,
+    media_tags, media_categories)
+from mediacore.model.tags import Tag, tags
+
+__all__ = ['FullTextIndexer', 'index_media', 'delete_media_index']
+
+# Mapped attributes which are copied into media_fulltext
+_indexed_attrs = ('title', 'subtitle', 'description_plain', 'notes',
+                  'author', 'tags', 'categories')
+
+# How many media rows to index per query
+_chunk_size = 500
+
+class FullTextIndexer(SessionExtension):
+    """Keep ``media_fulltext`` in sync with changes made in the session.
+
+    Install it in the session configuration::
+
+        DBSession.configure(extension=[FullTextIndexer()])
+
+    :param listeners: Callables which are passed the rows written to
+        ``media_fulltext`` and the list of deleted media IDs, once the
+        transaction that wrote them has been committed.
+
+    """
+    def __init__(self, listeners=()):
+        self.listeners = list(listeners)
+        # The media IDs awaiting reindexing in each session. Pending IDs
+        # are kept when a transaction is rolled back, since reindexing
+        # reads the current state from the database and is harmless.
+        self._pending = weakref.WeakKeyDictionary()
+        # The changes written in each session, for the listeners
+        self._written = weakref.WeakKeyDictionary()
+
+    def pending(self, session):
+        """Return the set of media IDs to be reindexed on commit."""
+        try:
+            return self._pending[session]
+        except KeyError:
+            return self._pending.setdefault(session, set())
+
+    def before_flush(self, session, flush_context, instances):
+        pending = self.pending(session)
+
+        # Renaming or deleting a tag or category affects every media item
+        # it's assigned to. These associations must be looked up now,
+        # before a delete cascades to the association tables.
+        for obj in session.dirty:
+            if isinstance(obj, (Tag, Category)) \
+            and attributes.get_history(obj, 'name').has_changes():
+                pending.update(_associated_media_ids(session, obj))
+        for obj in session.deleted:
+            if isinstance(obj, (Tag, Category)):
+                pending.update(_associated_media_ids(session, obj))
+
+        # The index rows of deleted media have to go before the media rows
+        # so they don't violate the foreign key in strict databases.
+        deleted_ids = [obj.id for obj in session.deleted
+                       if isinstance(obj, Media) and obj.id is not None]
+        if deleted_ids:
+            delete_media_index(session, deleted_ids)
+            # Reindexing IDs that no longer exist reports their deletion
+            pending.update(deleted_ids)
+
+    def after_flush(self, session, flush_context):
+        pending = self.pending(session)
+        for obj in session.new:
+            if isinstance(obj, Media):
+                pending.add(obj.id)
+        for obj in session.dirty:
+            if isinstance(obj, Media) and _indexed_attrs_changed(obj):
+                pending.add(obj.id)
+
+    def before_commit(self, session):
+        pending = self._pending.get(session, None)
+        if not pending and not session.dirty and not session.new \
+        and not session.deleted:
+            return
+        # Pick up any last changes before we write the index. This would
+        # otherwise happen after this hook is called.
+        session.flush()
+        pending = self._pending.pop(session, None)
+        if pending:
+            rows, deleted_ids = self._written.setdefault(session, ([], []))
+            def written(chunk_rows, chunk_deleted_ids):
+                if self.listeners:
+                    rows.extend(chunk_rows)
+                    deleted_ids.extend(chunk_deleted_ids)
+            index_media(session, pending, written)
+
+    def after_commit(self, session):
+        written = self._written.pop(session, None)
+        if written:
+            rows, deleted_ids = written
+            for listener in self.listeners:
+                listener(rows, deleted_ids)
+
+    def after_rollback(self, session):
+        self._written.pop(session, None)
+
+def _indexed_attrs_changed(obj):
+    for attr in _indexed_attrs:
+        history = attributes.get_history(obj, attr,
+            passive=attributes.PASSIVE_NO_INITIALIZE)
+        if history.has_changes():
+            return True
+    return False
+
+def _associated_media_ids(session, obj):
+    if isinstance(obj, Tag):
+        query = sql.select([media_tags.c.media_id],
+                           media_tags.c.tag_id == obj.id)
+    else:
+        # Deleting a category cascades to all its descendants too
+        query = sql.select([media_categories.c.media_id],
+            sql.and_(media_categories.c.category_id == category_closure.c.descendant_id,
+                     category_closure.c.ancestor_id == obj.id))
+    return [row[0] for row in session.execute(query)]
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for i in xrange(0, len(ids), _chunk_size):
+        yield ids[i:i + _chunk_size]
+
+def delete_media_index(bind, media_ids):
+    """Delete the ``media_fulltext`` rows for the given media IDs."""
+    for chunk in _chunks(media_ids):
+        bind.execute(media_fulltext.delete()\
+            .where(media_fulltext.c.media_id.in_(chunk)))
+
+def index_media(bind, media_ids, callback=None):
+    """(Re)write the ``media_fulltext`` rows for the given media IDs.
+
+    Rows are read from and written to the database in batches, so this
+    can be used to rebuild the entire index. IDs which no longer exist
+    in the ``media`` table have their index rows deleted.
+
+    :param bind: A session or connection to execute queries with.
+    :param media_ids: Media IDs to index.
+    :param callback: An optional callable which is passed the rows written
+        and the list of media IDs deleted after each batch.
+    :returns: The number of rows indexed.
+
+    """
+    count = 0
+    for chunk in _chunks(media_ids):
+        rows = _fetch_index_rows(bind, chunk)
+        delete_media_index(bind, chunk)
+        if rows:
+            bind.execute(media_fulltext.insert(), rows)
+        if callback is not None:
+            found = set(row['media_id'] for row in rows)
+            callback(rows, [id for id in chunk if id not in found])
+        count += len(rows)
+    return count
+
+def _fetch_index_rows(bind, media_ids):
+    execute = bind.execute
+    rows = {}
+    query = sql.select([
+        media.c.id, media.c.title, media.c.subtitle,
+        media.c.description_plain, media.c.notes, media.c.author_name,
+    ], media.c.id.in_(media_ids))
+    for row in execute(query):
+        rows[row.id] = {
+            'media_id': row.id,
+            'title': row.title,
+            'subtitle': row.subtitle,
+            'description_plain': row.description_plain,
+            'notes': row.notes,
+            'author_name': row.author_name,
+            'tags': [],
+            'categories': [],
+        }
+
+    query = sql.select([media_tags.c.media_id, tags.c.name],
+        sql.and_(media_tags.c.tag_id == tags.c.id,
+                 media_tags.c.media_id.in_(media_ids)),
+        order_by=[tags.c.name])
+    for media_id, name in execute(query):
+        if media_id in rows:
+            rows[media_id]['tags'].append(name)
+
+    query = sql.select([media_categories.c.media_id, categories.c.name],
+        sql.and_(media_categories.c.category_id == categories.c.id,
+                 media_categories.c.media_id.in_(media_ids)),
+        order_by=[categories.c.name])
+    for media_id, name in execute(query):
+        if media_id in rows:
+            rows[media_id]['categories'].append(name)
+
+    for row in rows.itervalues():
+        row['tags'] = u', '.join(row['tags'])
+        row['categories'] = u', '.join(row['categories'])
+    return rows.values()
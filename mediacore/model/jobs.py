@@ -0,0 +1,85 @@
+# This file is a part of MediaCore, Copyright 2009 Simple Station Inc.
+#
+# MediaCore is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MediaCore is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Job Model
+
+A job is a unit of work that's run after the request that queued it, by
+a ``paster process-jobs`` worker. See :mod:`mediacore.lib.jobs`.
+
+Jobs move through these statuses:
+
+    queued
+        Waiting for a worker, from ``run_after`` if it's set.
+    running
+        Claimed by a worker.
+    done
+        Finished successfully.
+    failed
+        Failed on every attempt. The last error is kept in ``error``.
+
+"""
+from datetime import datetime
+from sqlalchemy import Table, ForeignKey, Column
+from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime
+from sqlalchemy.orm import mapper, relation, backref
+
+from mediacore.model.meta import DBSession, metadata
+from mediacore.model.media import Media
+
+QUEUED = u'queued'
+RUNNING = u'running'
+DONE = u'done'
+FAILED = u'failed'
+
+jobs = Table('jobs', metadata,
+    Column('id', Integer, autoincrement=True, primary_key=True),
+    Column('type', Unicode(50), nullable=False),
+    Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE')),
+    Column('args', UnicodeText),
+    Column('status', Unicode(20), default=QUEUED, nullable=False, index=True),
+    Column('attempts', Integer, default=0, nullable=False),
+    Column('error', UnicodeText),
+    Column('worker', Unicode(100)),
+    Column('created_on', DateTime, default=datetime.now, nullable=False),
+    Column('run_after', DateTime),
+    Column('started_on', DateTime),
+    Column('finished_on', DateTime),
+    mysql_engine='InnoDB',
+    mysql_charset='utf8',
+)
+
+class Job(object):
+    """
+    A Background Job
+    """
+    query = DBSession.query_property()
+
+    def __init__(self, type=None, media=None, args=None):
+        self.type = type
+        self.media = media
+        self.args = args
+
+    def __repr__(self):
+        return '<Job: %s %s (%s)>' % (self.id, self.type, self.status)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+mapper(Job, jobs, properties={
+    'media': relation(Media,
+        backref=backref('jobs', passive_deletes=True)),
+})
@@ -28,22 +28,21 @@ belongs to a :class:`mediacore.model.podcasts.Podcast`.
 
 """
 
-import math
 import os.path
 from datetime import datetime
 
-from sqlalchemy import Table, ForeignKey, Column, sql, func, exc
+from sqlalchemy import Table, ForeignKey, Column, Index, sql, func
 from sqlalchemy.types import Unicode, UnicodeText, Integer, DateTime, Boolean, Float, Enum
-from sqlalchemy.orm import mapper, class_mapper, relation, backref, synonym, composite, column_property, comparable_property, dynamic_loader, validates, collections, attributes, Query
+from sqlalchemy.orm import mapper, class_mapper, relation, backref, synonym, composite, comparable_property, dynamic_loader, validates, collections, attributes, interfaces, Query
 from sqlalchemy.schema import DDL
 from pylons import app_globals, config, request
 
-from mediacore.model import get_available_slug, slug_length, _mtm_count_property, _properties_dict_from_labels, MatchAgainstClause
+from mediacore.model import get_available_slug, slug_length, _mtm_count_property, _properties_dict_from_labels
 from mediacore.model.meta import DBSession, metadata
 from mediacore.model.authors import Author
-from mediacore.model.comments import Comment, CommentQuery, comments
+from mediacore.model.comments import Comment, CommentQuery
 from mediacore.model.tags import Tag, TagList, tags, extract_tags, fetch_and_create_tags
-from mediacore.model.categories import Category, CategoryList, categories
+from mediacore.model.categories import Category, CategoryList, categories, category_closure
 from mediacore.lib import helpers
 from mediacore.lib.filetypes import AUDIO, AUDIO_DESC, CAPTIONS, VIDEO, guess_mimetype
 from mediacore.lib.embedtypes import external_embedded_containers
@@ -61,6 +60,7 @@ media = Table('media', metadata,
     Column('reviewed', Boolean, default=False, nullable=False),
     Column('encoded', Boolean, default=False, nullable=False),
     Column('publishable', Boolean, default=False, nullable=False),
+    Column('is_live', Boolean, default=False, nullable=False),
 
     Column('created_on', DateTime, default=datetime.now, nullable=False),
     Column('modified_on', DateTime, default=datetime.now, onupdate=datetime.now, nullable=False),
@@ -72,11 +72,14 @@ media = Table('media', metadata,
     Column('description', UnicodeText),
     Column('description_plain', UnicodeText),
     Column('notes', UnicodeText),
+    Column('thumb_key', Unicode(40)),
 
     Column('duration', Integer, default=0, nullable=False),
     Column('views', Integer, default=0, nullable=False),
     Column('likes', Integer, default=0, nullable=False),
     Column('popularity_points', Integer, default=0, nullable=False),
+    Column('comment_count', Integer, default=0, nullable=False),
+    Column('comment_count_published', Integer, default=0, nullable=False),
 
     Column('author_name', Unicode(50), nullable=False),
     Column('author_email', Unicode(255), nullable=False),
@@ -85,6 +88,17 @@ media = Table('media', metadata,
     mysql_charset='utf8',
 )
 
+# Indexes for the public listings, which show the published media ordered
+# by date or popularity, optionally within a podcast, and for the admin,
+# which lists media by their review status. InnoDB appends the primary key
+# to each, which keyset pagination uses as the tiebreaker.
+Index('media_live_publish_on', media.c.is_live, media.c.publish_on)
+Index('media_live_popularity', media.c.is_live, media.c.popularity_points)
+Index('media_podcast_live_publish_on',
+      media.c.podcast_id, media.c.is_live, media.c.publish_on)
+Index('media_status_modified_on', media.c.reviewed, media.c.encoded,
+      media.c.publishable, media.c.modified_on)
+
 media_files = Table('media_files', metadata,
     Column('id', Integer, autoincrement=True, primary_key=True),
     Column('media_id', Integer, ForeignKey('media.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False),
@@ -161,7 +175,72 @@ def _setup_mysql_fulltext_indexes():
         DDL(sql, on='mysql').execute_at('after-create', media_fulltext)
 _setup_mysql_fulltext_indexes()
 
+def live_at(now):
+    """Return a clause for the media which should be live at the given time.
+
+    Public queries should filter on :attr:`Media.is_live` instead, which
+    is kept up to date by :mod:`mediacore.lib.publishing`.
+
+    """
+    return sql.and_(
+        media.c.reviewed == True,
+        media.c.encoded == True,
+        media.c.publishable == True,
+        media.c.publish_on <= now,
+        sql.or_(media.c.publish_until == None,
+                media.c.publish_until >= now),
+    )
+
+# The columns loaded into each MediaSummary, see MediaQuery.summaries()
+summary_columns = (
+    'id', 'slug', 'type', 'podcast_id', 'title', 'author_name',
+    'author_email', 'publish_on', 'thumb_key', 'duration', 'views', 'likes',
+    'popularity_points', 'comment_count_published',
+)
+
+# The number of characters of description_plain loaded as the excerpt of
+# each MediaSummary. Listings display excerpts of up to 135 characters.
+excerpt_length = 300
+
 class MediaQuery(Query):
+    # The entities selected by summaries(), or None if it hasn't been used
+    _summary_entities = None
+
+    def __iter__(self):
+        rows = super(MediaQuery, self).__iter__()
+        # Only wrap the rows while the summary columns are selected, and not
+        # after they've been replaced, as they are when counting the results.
+        if self._summary_entities is None \
+        or self._summary_entities is not self._entities:
+            return rows
+        return (MediaSummary(row) for row in rows)
+
+    def count(self):
+        if self._summary_entities is not None \
+        and self._summary_entities is self._entities:
+            # Count the media rows rather than a subquery of the summaries
+            return self.with_entities(Media).count()
+        return super(MediaQuery, self).count()
+
+    def summaries(self, *columns):
+        """Load :class:`MediaSummary` instances instead of :class:`Media`.
+
+        Only the :data:`summary_columns` and an excerpt of the plaintext
+        description are selected, unless more column names are given.
+
+        :param columns: Names of any other columns to load, such as
+            ``'description'``.
+
+        """
+        # The author columns are only mapped as the author composite
+        entities = [getattr(Media, name, media.c[name])
+                    for name in summary_columns + columns]
+        entities.append(sql.func.substr(media.c.description_plain, 1,
+                                        excerpt_length).label('excerpt'))
+        query = self.with_entities(*entities)
+        query._summary_entities = query._entities
+        return query
+
     def reviewed(self, flag=True):
         return self.filter(Media.reviewed == flag)
 
@@ -169,18 +248,7 @@ class MediaQuery(Query):
         return self.filter(Media.encoded == flag)
 
     def published(self, flag=True):
-        published = sql.and_(
-            Media.reviewed == True,
-            Media.encoded == True,
-            Media.publishable == True,
-            Media.publish_on <= datetime.now(),
-            sql.or_(Media.publish_until == None,
-                    Media.publish_until >= datetime.now()),
-        )
-        if flag:
-            return self.filter(published)
-        else:
-            return self.filter(sql.not_(published))
+        return self.filter(Media.is_live == flag)
 
     def order_by_status(self):
         return self.order_by(Media.reviewed.asc(),
@@ -191,52 +259,36 @@ class MediaQuery(Query):
         return self.order_by(Media.popularity_points.desc())
 
     def search(self, search, bool=False, order_by=True):
-        search_cols = _fulltext_indexes['public']
-        return self._search(search_cols, search, bool, order_by)
+        return self._search('public', search, bool, order_by)
 
     def admin_search(self, search, bool=False, order_by=True):
-        search_cols = _fulltext_indexes['admin']
-        return self._search(search_cols, search, bool, order_by)
-
-    def _search(self, search_cols, search, bool=False, order_by=True):
-        if self.session.connection().dialect.name != 'mysql':
-            # TODO: Use this fallback when triggers haven't been installed
-            return self.filter(Media.title.like(search))
-        filter = MatchAgainstClause(search_cols, search, bool)
-        query = self.join(MediaFullText).filter(filter)
-        if order_by:
-            # MySQL automatically orders natural lang searches by relevance,
-            # so override any existing ordering
-            query = query.order_by(None)
-            if bool:
-                # To mimic the same behaviour in boolean mode, we must do an
-                # extra natural language search on our boolean-filtered results
-                relevance = MatchAgainstClause(search_cols, search, bool=False)
-                query = query.order_by(relevance)
-        return query
+        return self._search('admin', search, bool, order_by)
+
+    def _search(self, index, search, bool=False, order_by=True):
+        return app_globals.search_engine.search(self, search, index,
+                                                bool, order_by)
 
     def in_category(self, cat):
-        all_cats = [cat]
-        all_cats.extend(cat.descendants())
-        all_ids = [c.id for c in all_cats]
+        """Filter for media in the given category or any of its descendants."""
         return self.filter(sql.exists(sql.select(
             [media_categories.c.media_id],
             sql.and_(media_categories.c.media_id == Media.id,
-                     media_categories.c.category_id.in_(all_ids))
+                     media_categories.c.category_id == category_closure.c.descendant_id,
+                     category_closure.c.ancestor_id == cat.id)
         )))
 
     def exclude(self, *args):
         """Exclude the given Media rows or IDs from the results.
 
-        Accepts any number of arguments of Media instances, ids,
-        lists of both, or None.
+        Accepts any number of arguments of Media or MediaSummary instances,
+        ids, lists of both, or None.
         """
         def _flatten(*args):
             ids = []
             for arg in args:
                 if isinstance(arg, list):
                     ids.extend(_flatten(*arg))
-                elif isinstance(arg, Media):
+                elif isinstance(arg, (Media, MediaSummary)):
                     ids.append(int(arg.id))
                 elif arg is not None:
                     ids.append(int(arg))
@@ -282,6 +334,13 @@ class Media(object):
         publish_on and publish_until dates. If this is false, this is
         considered to be in draft state and will not appear on the site.
 
+    .. attribute:: is_live
+
+        A flag to indicate that this media is reviewed, encoded, publishable
+        and within its publishing window, so that it appears on the site.
+        It's set whenever the media is saved, and flipped as the publishing
+        window opens or closes by :mod:`mediacore.lib.publishing`.
+
     .. attribute:: created_on
     .. attribute:: modified_on
 
@@ -324,6 +383,11 @@ class Media(object):
 
         Notes for administrative use -- never displayed publicly.
 
+    .. attribute:: thumb_key
+
+        The name the thumbnails are stored under, or None if the default
+        thumbs are used. See :mod:`mediacore.lib.thumbnails`.
+
     .. attribute:: author
 
         An instance of :class:`mediacore.model.authors.Author`.
@@ -362,8 +426,17 @@ class Media(object):
         .. todo:: Reimplement as a dynamic loader.
 
     .. attribute:: comment_count
+
+        The number of comments, including those which haven't been
+        approved.
+
     .. attribute:: comment_count_published
 
+        The number of published comments.
+
+        Both counts are kept up to date as comments are saved,
+        see :class:`mediacore.model.comments.CommentCountExtension`.
+
     """
 
     query = DBSession.query_property(MediaQuery)
@@ -459,41 +532,31 @@ class Media(object):
     def is_published(self):
         if self.id is None:
             return False
-        return self.publishable and self.reviewed and self.encoded\
-           and (self.publish_on is not None and self.publish_on <= datetime.now())\
-           and (self.publish_until is None or self.publish_until >= datetime.now())
+        return self.is_live_at(datetime.now())
+
+    def is_live_at(self, now):
+        """Return True if this media should be live at the given time."""
+        return bool(self.publishable and self.reviewed and self.encoded
+            and (self.publish_on is not None and self.publish_on <= now)
+            and (self.publish_until is None or self.publish_until >= now))
 
     def increment_views(self):
         """Increment the number of views in the database.
 
         We avoid concurrency issues by incrementing JUST the views and
-        not allowing modified_on to be updated automatically.
+        not allowing modified_on to be updated automatically. Depending
+        on the ``view_counter`` config, the database may not reflect the
+        new view until the counter's next flush.
 
         """
         if self.id is None:
             self.views += 1
             return self.views
 
-        query = 'UPDATE %s SET %s = (%s + 1) WHERE %s = :media_id' \
-              % (media, media.c.views, media.c.views, media.c.id)
-
-        # Don't raise an exception should concurrency problems occur.
-        # Views will not actually be incremented in this case, but thats
-        # relatively unimportant compared to rendering the page for the user.
-        # We may be able to remove this after we improve our triggers to not
-        # issue an UPDATE on media_fulltext unless one of its columns are
-        # actually changed. Even when just media.views is updated, all the
-        # columns in the corresponding media_fulltext row are updated, and
-        # media_fulltext's MyISAM engine must lock the whole table to do so.
-        transaction = DBSession.begin_nested()
-        try:
-            DBSession.execute(query, {'media_id': self.id}, self.__class__)
-            transaction.commit()
-        except exc.OperationalError, e:
-            transaction.rollback()
-            # (OperationalError) (1205, 'Lock wait timeout exceeded, try restarting the transaction')
-            if not '1205' in e.message:
-                raise
+        # Views are handed off to the view counter, which by default
+        # buffers them and flushes them to the database in batches. See
+        # :mod:`mediacore.lib.viewcounter`.
+        app_globals.view_counter.increment(self.id)
 
         # Increment the views by one for the rest of the request,
         # but don't allow the ORM to increment the views too.
@@ -509,20 +572,17 @@ class Media(object):
         return likes
 
     def update_popularity(self):
-        # FIXME: The current algorithm assumes that the earliest publication
-        #        date is January 1, 2000.
+        """Recalculate the popularity points for this media item.
 
-        # In our ranking algorithm, being base_life_hours newer is equivalent
-        # to having log_base times more votes.
-        log_base = int(app_globals.settings['popularity_decay_exponent'])
-        base_life_hours = int(app_globals.settings['popularity_decay_lifetime'])
+        See :mod:`mediacore.lib.popularity` for ranking the whole library.
 
+        """
+        from mediacore.lib.popularity import (calculate_popularity,
+            popularity_settings)
         if self.is_published:
-            base_life = base_life_hours * 3600
-            delta = self.publish_on - datetime(2000, 1, 1) # since January 1, 2000
-            t = delta.days * 86400 + delta.seconds
-            popularity = math.log(self.likes+1, log_base) + t/base_life
-            self.popularity_points = max(int(popularity), 0)
+            log_base, base_life_hours = popularity_settings()
+            self.popularity_points = calculate_popularity(self.publish_on,
+                self.likes, log_base, base_life_hours)
         else:
             self.popularity_points = 0
 
@@ -537,6 +597,46 @@ class Media(object):
     def _validate_description_plain(self, key, value):
         return helpers.strip_xhtml(value, True)
 
+class MediaSummary(object):
+    """
+    A read-only summary of a :class:`Media` item, for listing many at once.
+
+    Summaries are loaded by :meth:`MediaQuery.summaries`, which selects
+    just the :data:`summary_columns` and the first :data:`excerpt_length`
+    characters of the plaintext description, rather than every column
+    of full ORM instances. They aren't tracked by the session either, so
+    a page of them costs a fraction of the memory.
+
+    .. attribute:: excerpt
+
+        The start of :attr:`Media.description_plain`, long enough to be
+        truncated for display.
+
+    .. attribute:: categories
+
+        Not loaded by the query. Set by the controllers which need it.
+
+    Any other attribute is a column of the same name on :class:`Media`.
+    Only the columns which were loaded are set.
+
+    """
+    __slots__ = summary_columns + (
+        'excerpt', 'description', 'description_plain', 'categories',
+    )
+
+    _thumb_dir = 'media'
+
+    def __init__(self, row):
+        for key, value in zip(row.keys(), row):
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return '<MediaSummary: %s>' % self.slug
+
+    @property
+    def author(self):
+        return Author(self.author_name, self.author_email)
+
 class MediaFile(object):
     """
     Audio or Video file or link
@@ -602,11 +702,25 @@ class MediaFullText(object):
     query = DBSession.query_property()
 
 
+class MediaLiveExtension(interfaces.MapperExtension):
+    """Set :attr:`Media.is_live` whenever a media item is saved."""
+    def before_insert(self, mapper, connection, instance):
+        instance.is_live = instance.is_live_at(datetime.now())
+        return interfaces.EXT_CONTINUE
+
+    def before_update(self, mapper, connection, instance):
+        is_live = instance.is_live_at(datetime.now())
+        if is_live != instance.is_live:
+            instance.is_live = is_live
+        return interfaces.EXT_CONTINUE
+
+
 mapper(MediaFile, media_files)
 
 mapper(MediaFullText, media_fulltext)
 
-_media_mapper = mapper(Media, media, order_by=media.c.title, properties={
+_media_mapper = mapper(Media, media, order_by=media.c.title,
+                       extension=MediaLiveExtension(), properties={
     'fulltext': relation(MediaFullText, uselist=False, passive_deletes=True),
     'author': composite(Author, media.c.author_name, media.c.author_email),
     'files': relation(MediaFile, backref='media', order_by=media_files.c.type.asc(), passive_deletes=True),
@@ -614,15 +728,6 @@ _media_mapper = mapper(Media, media, order_by=media.c.title, properties={
     'categories': relation(Category, secondary=media_categories, backref=backref('media', lazy='dynamic', query_class=MediaQuery), collection_class=CategoryList, passive_deletes=True),
 
     'comments': dynamic_loader(Comment, backref='media', query_class=CommentQuery, passive_deletes=True),
-    'comment_count': column_property(
-        sql.select([sql.func.count(comments.c.id)],
-                   media.c.id == comments.c.media_id).label('comment_count'),
-        deferred=True),
-    'comment_count_published': column_property(
-        sql.select([sql.func.count(comments.c.id)],
-                   sql.and_(comments.c.media_id == media.c.id,
-                            comments.c.publishable == True)).label('comment_count_published'),
-        deferred=True),
 })
 
 # Add properties for counting how many media items have a given Tag
@@ -630,12 +735,7 @@ _tags_mapper = class_mapper(Tag, compile=False)
 _tags_mapper.add_properties(_properties_dict_from_labels(
     _mtm_count_property('media_count', media_tags),
     _mtm_count_property('media_count_published', media_tags, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= datetime.now(),
-        sql.or_(media.c.publish_until == None,
-                media.c.publish_until >= datetime.now()),
+        media.c.is_live == True,
     ]),
 ))
 
@@ -644,11 +744,6 @@ _categories_mapper = class_mapper(Category, compile=False)
 _categories_mapper.add_properties(_properties_dict_from_labels(
     _mtm_count_property('media_count', media_categories),
     _mtm_count_property('media_count_published', media_categories, [
-        media.c.reviewed == True,
-        media.c.encoded == True,
-        media.c.publishable == True,
-        media.c.publish_on <= datetime.now(),
-        sql.or_(media.c.publish_until == None,
-                media.c.publish_until >= datetime.now()),
+        media.c.is_live == True,
     ]),
 ))
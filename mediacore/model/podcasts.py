@@ -49,6 +49,7 @@ podcasts = Table('podcasts', metadata,
     Column('copyright', Unicode(50)),
     Column('itunes_url', Unicode(80)),
     Column('feedburner_url', Unicode(80)),
+    Column('thumb_key', Unicode(40)),
     mysql_engine='InnoDB',
     mysql_charset='utf8',
 )
@@ -106,6 +107,11 @@ class Podcast(object):
         be forwarded to this address -- unless, of course, the request is
         coming from Feedburner.
 
+    .. attribute:: thumb_key
+
+        The name the thumbnails are stored under, or None if the default
+        thumbs are used. See :mod:`mediacore.lib.thumbnails`.
+
     .. attribute:: media
 
         A dynamic loader for :class:`mediacore.model.media.Media` episodes:
@@ -153,14 +159,7 @@ mapper(Podcast, podcasts, order_by=podcasts.c.title, properties={
                 [sql.func.count(media.c.id)],
                 sql.and_(
                     media.c.podcast_id == podcasts.c.id,
-                    media.c.reviewed == True,
-                    media.c.encoded == True,
-                    media.c.publishable == True,
-                    media.c.publish_on <= datetime.now(),
-                    sql.or_(
-                        media.c.publish_until == None,
-                        media.c.publish_until >= datetime.now()
-                    ),
+                    media.c.is_live == True,
                 )
             ).label('media_count_published'),
             deferred=True
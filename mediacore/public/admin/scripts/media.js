@@ -77,7 +77,6 @@ var MediaManager = new Class({
 		if (this.isNew) {
 			this.initNewMedia(json.media_id);
 			this.updateFormActions(json.media_id);
-			this.thumbUploader.setNewID(json.media_id);
 		}
 		if (this.newID && this.newID != json.media_id) {
 			this.mergeMedia(json.media_id);
@@ -85,7 +84,7 @@ var MediaManager = new Class({
 			this.setStubData(json.title, json.slug, json.link);
 			this.updateStatusForm(json.status_form);
 		}
-		this.thumbUploader.refreshThumb();
+		this.thumbUploader.setThumb(json.thumb_url);
 	},
 
 	onFileEdited: function(json){
@@ -107,7 +106,7 @@ var MediaManager = new Class({
 			var replaces = $(this.files._getFileID(id));
 			this.files.fileAdded(pseudoresp, replaces, row);
 		}, this);
-		this.thumbUploader.refreshThumb();
+		this.thumbUploader.setThumb(json.thumb_url);
 	},
 
 	setStubData: function(title, slug, link){
@@ -239,23 +239,13 @@ var ThumbUploader = new Class({
 		this.parent(file);
 		if (!file.response.error){
 			var json = JSON.decode(file.response.text, true);
-			if (json.success) {
-				if (json.id) this.setNewID(json.id);
-				this.refreshThumb();
-			}
+			if (json.success) this.setThumb(json.thumb_url);
 		}
 	},
 
-	setNewID: function(id){
-		var src = this.image.get('src'), newsrc = src.replace(/\/new([sml])\.(jpg|png)/, '/' + id + '$1.$2');
-		if (newsrc && src != newsrc) this.image.set('src', newsrc);
-		return this;
-	},
-
-	refreshThumb: function(){
-		var src = this.image.get('src'), qsStart = src.indexOf('?');
-		if (qsStart > 0) src = src.substr(0, qsStart);
-		this.image.set('src', src + '?' + $time());
+	setThumb: function(url){
+		// Thumbs are named after their content, so a new thumb has a new URL
+		if (url && this.image.get('src') != url) this.image.set('src', url);
 		return this;
 	}
 
@@ -13,12 +13,14 @@ from paste.deploy import loadapp
 from paste.script.appinstall import SetupCommand
 from pylons import url
 from routes.util import URLGenerator
+from sqlalchemy.engine.base import Connection
 from webtest import TestApp
 
 import pylons.test
 
 __all__ = [
     'environ',
+    'QueryCounter',
     'TestCase',
     'TestController',
     'url',
@@ -29,6 +31,31 @@ SetupCommand('setup-app').run([pylons.test.pylonsapp.config['__file__']])
 
 environ = {}
 
+class QueryCounter(object):
+    """Count the SQL statements executed between start() and stop()."""
+
+    def __init__(self):
+        self.count = 0
+        self._originals = None
+
+    def start(self):
+        self.count = 0
+        self._originals = (Connection._cursor_execute,
+                           Connection._cursor_executemany)
+        counter = self
+        def wrap(original):
+            def counting(*args, **kwargs):
+                counter.count += 1
+                return original(*args, **kwargs)
+            return counting
+        Connection._cursor_execute = wrap(self._originals[0])
+        Connection._cursor_executemany = wrap(self._originals[1])
+
+    def stop(self):
+        Connection._cursor_execute, Connection._cursor_executemany = \
+            self._originals
+        return self.count
+
 class TestController(TestCase):
 
     def __init__(self, *args, **kwargs):
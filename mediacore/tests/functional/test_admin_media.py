@@ -184,6 +184,7 @@ class TestMediaController(TestController):
         assert add_json['success'] == True
         assert add_json['media_id'] == media_id
         assert add_json['file_id'] == media.files[0].id
+        assert add_json['thumb_url'].endswith('/%ss.jpg' % media.thumb_key)
         assert 'message' not in add_json
 
         # Ensure that the file was properly created.
@@ -5,3 +5,98 @@ class TestApiMediaController(TestController):
     def test_index(self):
         response = self.app.get(url(controller='api/media', action='index'))
         # Test response...
+
+    def test_index_not_modified(self):
+        index_url = url(controller='api/media', action='index')
+        response = self.app.get(index_url)
+        etag = response.headers['ETag']
+        response = self.app.get(index_url, headers={'If-None-Match': etag},
+                                status=304)
+        assert response.headers['ETag'] == etag
+        # A different query gets a different ETag
+        self.app.get(index_url, params={'limit': 5},
+                     headers={'If-None-Match': etag}, status=200)
+
+    def test_index_query_count(self):
+        """Listing more media shouldn't take more queries."""
+        from mediacore.model import Category, DBSession
+        category = Category(u'API Query Count', u'api-query-count')
+        def add_media(start, stop):
+            for i in range(start, stop):
+                media = self._new_publishable_media(u'api-query-count-%d' % i,
+                        u'API Query Count %d' % i)
+                media.encoded = True
+                media.categories.append(category)
+                DBSession.add(media)
+            DBSession.commit()
+        def count_queries(limit):
+            counter = QueryCounter()
+            counter.start()
+            try:
+                self.app.get(url(controller='api/media', action='index'),
+                             params={'category': 'api-query-count',
+                                     'limit': limit})
+            finally:
+                counter.stop()
+            return counter.count
+
+        add_media(0, 2)
+        few = count_queries(2)
+        add_media(2, 8)
+        many = count_queries(8)
+        assert few == many, \
+            'Listing 2 media took %d queries, 8 took %d' % (few, many)
+
+    def test_index_cursor(self):
+        """Following next_cursor should page through every result once."""
+        import simplejson
+        from mediacore.model import Category, DBSession
+        category = Category(u'API Cursor', u'api-cursor')
+        for i in range(5):
+            media = self._new_publishable_media(u'api-cursor-%d' % i,
+                    u'API Cursor %d' % i)
+            media.encoded = True
+            media.categories.append(category)
+            DBSession.add(media)
+        DBSession.commit()
+
+        index_url = url(controller='api/media', action='index')
+        params = {'category': 'api-cursor', 'limit': 2, 'count': 0}
+        slugs = []
+        while True:
+            response = self.app.get(index_url, params=params)
+            result = simplejson.loads(response.body)
+            assert result['count'] is None
+            slugs.extend(media['slug'] for media in result['media'])
+            if not result['next_cursor']:
+                break
+            params['cursor'] = result['next_cursor']
+        assert sorted(slugs) == ['api-cursor-%d' % i for i in range(5)]
+
+    def test_index_count_by_date(self):
+        """Counts of queries for different dates shouldn't be shared."""
+        import simplejson
+        from datetime import datetime, timedelta
+        from mediacore.model import Category, DBSession
+        category = Category(u'API Count By Date', u'api-count-by-date')
+        for i, publish_on in enumerate((datetime(2008, 6, 1),
+                                        datetime(2010, 6, 1),
+                                        datetime.now() - timedelta(days=3))):
+            media = self._new_publishable_media(u'api-count-by-date-%d' % i,
+                    u'API Count By Date %d' % i)
+            media.encoded = True
+            media.publish_on = publish_on
+            media.categories.append(category)
+            DBSession.add(media)
+        DBSession.commit()
+
+        def count(**params):
+            params['category'] = 'api-count-by-date'
+            response = self.app.get(url(controller='api/media',
+                                        action='index'), params=params)
+            return simplejson.loads(response.body)['count']
+
+        assert count(published_after='2009-01-01') == 2
+        assert count(published_after='2011-01-01') == 1
+        assert count(max_age=7) == 1
+        assert count(max_age=10000) == 3
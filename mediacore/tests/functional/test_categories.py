@@ -1,7 +1,24 @@
 from mediacore.tests import *
+from mediacore.model import Category, DBSession
 
 class TestCategoriesController(TestController):
 
     def test_index(self):
         response = self.app.get(url(controller='categories', action='index'))
         # Test response...
+
+    def test_cached_counts_are_invalidated(self):
+        category = Category(u'Cache Test', u'cache-test')
+        DBSession.add(category)
+        DBSession.commit()
+        response = self.app.get(url(controller='categories', action='index'))
+        assert 'cache-test' not in response
+
+        media = self._new_publishable_media(u'category-cache-test',
+                                            u'Category Cache Test')
+        media.encoded = True
+        media.categories.append(category)
+        DBSession.add(media)
+        DBSession.commit()
+        response = self.app.get(url(controller='categories', action='index'))
+        assert 'Cache Test <small>(1)</small>' in response
@@ -5,3 +5,50 @@ class TestMediaController(TestController):
     def test_index(self):
         response = self.app.get(url(controller='media', action='index'))
         # Test response...
+
+    def test_random(self):
+        response = self.app.get(url(controller='media', action='random'))
+        assert response.status_int == 302
+
+    def test_random_picks_published_media(self):
+        import pylons
+        from mediacore.lib.random_media import random_media
+        from mediacore.model import DBSession, Media, fetch_row
+        for slug, encoded in ((u'random-published-1', True),
+                              (u'random-published-2', True),
+                              (u'random-draft', False)):
+            media = self._new_publishable_media(slug, slug)
+            media.encoded = encoded
+            DBSession.add(media)
+        DBSession.commit()
+
+        response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(response.app_globals)
+        random_media.invalidate()
+
+        for i in range(10):
+            response = self.app.get(url(controller='media', action='random'))
+            assert response.status_int == 302
+            location = response.headers['Location']
+            slug = location.rstrip('/').rsplit('/', 1)[-1]
+            media = fetch_row(Media, slug=slug)
+            assert media.is_live, location
+            assert location.endswith(url(controller='media', action='view',
+                                         slug=slug,
+                                         podcast_slug=media.podcast and
+                                                      media.podcast.slug))
+
+    def test_cached_counts_are_invalidated(self):
+        from mediacore.model import DBSession, Tag
+        tag = Tag(u'Count Test', u'count-test')
+        DBSession.add(tag)
+        for i in (1, 2):
+            media = self._new_publishable_media(u'count-test-%d' % i,
+                                                u'Count Test %d' % i)
+            media.encoded = True
+            media.tags.append(tag)
+            DBSession.add(media)
+            DBSession.commit()
+            response = self.app.get(url(controller='media', action='index',
+                                        tag=u'count-test'))
+            assert 'Showing %d results tagged with' % i in response
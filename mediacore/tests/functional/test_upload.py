@@ -60,3 +60,47 @@ class TestUploadController(TestController):
         assert len(media.files) == 1
         assert media.files[0].container == 'mp3'
         assert media.description == "<p>actually just testing an mp3 upload.</p>"
+
+    def test_submit_async_chunked(self):
+        import simplejson as json
+        fields, files = self._valid_values('testing chunked mp3 upload')
+        content = files[0][2]
+        chunk_url = url(controller='upload', action='chunk')
+        submit_url = url(controller='upload', action='submit_async')
+
+        def send_chunk(first, last, **params):
+            response = self.app.post(
+                url(controller='upload', action='chunk', **params),
+                params=content[first:last + 1],
+                content_type='application/octet-stream',
+                headers={'Content-Range': 'bytes %d-%d/%d'
+                                          % (first, last, len(content))})
+            return json.loads(response.body)
+
+        data = send_chunk(0, 9, filename='filename.mp3')
+        assert data['success'] and data['offset'] == 10
+        upload_id = data['upload_id']
+
+        # Resume after an interruption
+        data = json.loads(self.app.get(chunk_url, params={'upload_id': upload_id}).body)
+        assert data['offset'] == 10 and not data['complete']
+        data = send_chunk(10, len(content) - 1, upload_id=upload_id)
+        assert data['complete']
+
+        fields['upload_id'] = upload_id
+        response = self.app.post(submit_url, params=fields)
+        assert response.body == '{"redirect": "/upload/success", "success": true}'
+
+        media = fetch_row(Media, slug=u'testing-chunked-mp3-upload')
+        assert len(media.files) == 1
+        assert media.files[0].size == len(content)
+
+    def test_chunked_upload_too_large(self):
+        import simplejson as json
+        response = self.app.post(
+            url(controller='upload', action='chunk', filename='huge.mp3'),
+            params='0123456789',
+            content_type='application/octet-stream',
+            headers={'Content-Range': 'bytes 0-9/%d' % (400 * 1024 * 1024)})
+        data = json.loads(response.body)
+        assert not data['success'] and 'upload_id' not in data
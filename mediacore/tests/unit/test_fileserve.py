@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+from webtest import TestApp
+
+from mediacore.tests import *
+from mediacore.lib.fileserve import FileServer, parse_range
+
+class TestFileServer(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, '0123456789')
+        os.close(fd)
+        self.app = TestApp(FileServer(self.path, 'text/plain'))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parse_range(self):
+        assert parse_range('bytes=2-4', 10) == (2, 4)
+        assert parse_range('bytes=7-', 10) == (7, 9)
+        assert parse_range('bytes=-3', 10) == (7, 9)
+        assert parse_range('bytes=5-100', 10) == (5, 9)
+        assert parse_range('bytes=10-', 10) is False
+        assert parse_range('bytes=0-1,4-5', 10) is None
+        assert parse_range('items=0-1', 10) is None
+
+    def test_ranges(self):
+        response = self.app.get('/')
+        assert response.body == '0123456789'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+
+        response = self.app.get('/', headers={'Range': 'bytes=2-4'}, status=206)
+        assert response.body == '234'
+        assert response.headers['Content-Range'] == 'bytes 2-4/10'
+
+        response = self.app.get('/', headers={'Range': 'bytes=20-'}, status=416)
+        assert response.headers['Content-Range'] == 'bytes */10'
+
+        etag = response.headers['ETag']
+        self.app.get('/', headers={'If-None-Match': etag}, status=304)
@@ -0,0 +1,50 @@
+from pylons import config
+
+from mediacore.tests import *
+from mediacore.lib.jobs import enqueue, job_handler, process_jobs
+from mediacore.model import DBSession, Job
+
+calls = []
+
+@job_handler('test_succeed')
+def succeed(media, value):
+    calls.append(value)
+
+@job_handler('test_fail')
+def fail(media):
+    raise ValueError, 'Failed on purpose'
+
+class TestJobs(TestController):
+    def setUp(self):
+        config['job_queue'] = 'true'
+        config['job_retry_delay'] = '0'
+        config['job_max_attempts'] = '3'
+        del calls[:]
+
+    def tearDown(self):
+        config['job_queue'] = 'false'
+        DBSession.query(Job).delete()
+        DBSession.commit()
+
+    def test_jobs_run_after_commit(self):
+        job = enqueue('test_succeed', value=1)
+        DBSession.commit()
+        assert calls == []
+        assert process_jobs(DBSession) == (1, 0)
+        assert calls == [1]
+        DBSession.refresh(job)
+        assert job.status == u'done' and job.attempts == 1
+
+    def test_failed_jobs_are_retried(self):
+        config['job_max_attempts'] = '2'
+        job = enqueue('test_fail')
+        DBSession.commit()
+        assert process_jobs(DBSession) == (0, 2)
+        DBSession.refresh(job)
+        assert job.status == u'failed' and job.attempts == 2
+        assert 'Failed on purpose' in job.error
+
+    def test_disabled_queue_runs_immediately(self):
+        config['job_queue'] = 'false'
+        assert enqueue('test_succeed', value=2) is None
+        assert calls == [2]
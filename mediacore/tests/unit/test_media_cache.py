@@ -0,0 +1,67 @@
+import pylons
+import webob.exc
+from mediacore.tests import *
+from mediacore.lib.cache import bump_version
+from mediacore.lib.media_cache import MediaCache
+from mediacore.model import DBSession
+
+class TestMediaCache(TestController):
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def _add_media(self, slug):
+        media = self._new_publishable_media(slug, slug)
+        DBSession.add(media)
+        DBSession.commit()
+        return media.id
+
+    def test_cached_copies(self):
+        media_id = self._add_media(u'media-cache')
+        cache = MediaCache(size=2)
+        media = cache.get(u'media-cache')
+        assert media.id == media_id
+        assert media in DBSession
+        media.title = u'Not Saved'
+        DBSession.rollback()
+        DBSession.remove()
+
+        counter = QueryCounter()
+        counter.start()
+        try:
+            media = cache.get(u'media-cache')
+            assert (media.title, media.files, media.podcast) \
+                == (u'media-cache', [], None)
+        finally:
+            queries = counter.stop()
+        assert queries == 0, queries
+
+        media.title = u'Saved'
+        DBSession.commit()
+        bump_version('media')
+        DBSession.remove()
+        assert cache.get(u'media-cache').title == u'Saved'
+
+    def test_least_recently_used_are_dropped(self):
+        for slug in (u'media-cache-1', u'media-cache-2', u'media-cache-3'):
+            self._add_media(slug)
+        cache = MediaCache(size=2)
+        cache.get(u'media-cache-1')
+        cache.get(u'media-cache-2')
+        cache.get(u'media-cache-1')
+        cache.get(u'media-cache-3')
+        assert sorted(cache._entries) == [u'media-cache-1', u'media-cache-3']
+        cache.invalidate(u'media-cache-1')
+        assert cache._entries.keys() == [u'media-cache-3']
+
+    def test_missing_media(self):
+        cache = MediaCache(size=2)
+        try:
+            cache.get(u'no-such-media')
+        except webob.exc.HTTPNotFound:
+            pass
+        else:
+            assert False, 'HTTPNotFound was not raised'
@@ -148,3 +148,182 @@ class TestModels(TestController):
         except SQLAlchemyError, e:
             DBSession.rollback()
             raise e
+
+    def test_fulltext_index(self):
+        """The media_fulltext row should follow changes to indexed columns,
+        tags and categories."""
+        from mediacore.model import Tag
+        from mediacore.model.media import MediaFullText
+        try:
+            media = self._new_publishable_media(u'fulltext-index',
+                    u'Fulltext Index')
+            tag = Tag(u'fulltext-tag')
+            media.tags.append(tag)
+            DBSession.add(media)
+            DBSession.commit()
+            fulltext = MediaFullText.query.get(media.id)
+            assert fulltext.title == u'Fulltext Index'
+            assert fulltext.tags == u'fulltext-tag'
+
+            media.title = u'Fulltext Index Renamed'
+            tag.name = u'fulltext-tag-renamed'
+            DBSession.commit()
+            DBSession.expire_all()
+            fulltext = MediaFullText.query.get(media.id)
+            assert fulltext.title == u'Fulltext Index Renamed'
+            assert fulltext.tags == u'fulltext-tag-renamed'
+
+            media_id = media.id
+            DBSession.delete(media)
+            DBSession.commit()
+            assert MediaFullText.query.get(media_id) is None
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+    def test_category_closure(self):
+        """Ancestors and descendants should follow categories as they move."""
+        from mediacore.model import Category, Media
+        from mediacore.model.categories import CategoryList
+        try:
+            root = Category(u'Closure Root', u'closure-root')
+            child = Category(u'Closure Child', u'closure-child')
+            grandchild = Category(u'Closure Grandchild', u'closure-grandchild')
+            other = Category(u'Closure Other', u'closure-other')
+            child.parent = root
+            grandchild.parent = child
+            DBSession.add_all([root, child, grandchild, other])
+            media = self._new_publishable_media(u'closure-media',
+                    u'Closure Media')
+            media.categories.append(grandchild)
+            DBSession.add(media)
+            DBSession.commit()
+            assert root.descendants() == [child, grandchild]
+            assert grandchild.ancestors() == [root, child]
+            assert isinstance(grandchild.ancestors(), CategoryList)
+            assert Media.query.in_category(root).all() == [media]
+
+            child.parent = other
+            DBSession.commit()
+            assert root.descendants() == []
+            assert other.descendants() == [child, grandchild]
+            assert grandchild.ancestors() == [other, child]
+            assert Media.query.in_category(root).all() == []
+            assert Media.query.in_category(other).all() == [media]
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+    def test_comment_counts(self):
+        """The comment counts should follow comments as they're added,
+        approved, trashed and deleted."""
+        from mediacore.model import AuthorWithIP, Comment
+        from mediacore.model.comments import reconcile_comment_counts
+        def counts():
+            DBSession.refresh(media)
+            return media.comment_count, media.comment_count_published
+        try:
+            media = self._new_publishable_media(u'comment-counts',
+                    u'Comment Counts')
+            DBSession.add(media)
+            for subject in (u'First', u'Second'):
+                comment = Comment()
+                comment.subject = subject
+                comment.body = u'Body'
+                comment.author = AuthorWithIP(u'fake name', None, '127.0.0.1')
+                media.comments.append(comment)
+            DBSession.commit()
+            assert counts() == (2, 0)
+
+            first, second = media.comments.all()
+            first.reviewed = second.reviewed = True
+            first.publishable = second.publishable = True
+            DBSession.commit()
+            assert counts() == (2, 2)
+
+            second.publishable = False
+            DBSession.commit()
+            assert counts() == (2, 1)
+
+            DBSession.delete(first)
+            DBSession.commit()
+            assert counts() == (1, 0)
+
+            media.comment_count = 5
+            DBSession.commit()
+            reconcile_comment_counts(DBSession, [media.id])
+            DBSession.commit()
+            assert counts() == (1, 0)
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+    def test_is_live(self):
+        """is_live should be set as media are saved, and flipped as their
+        publishing windows open and close."""
+        from datetime import datetime, timedelta
+        from mediacore.lib.publishing import update_live_media
+        from mediacore.model import Media
+        try:
+            now = datetime.now()
+            media = self._new_publishable_media(u'is-live', u'Is Live')
+            media.encoded = True
+            media.publish_on = now + timedelta(hours=1)
+            DBSession.add(media)
+            DBSession.commit()
+            assert not media.is_live
+            assert media not in Media.query.published().all()
+
+            later = now + timedelta(hours=2)
+            assert update_live_media(DBSession, [media.id], later) \
+                == [media.id]
+            DBSession.commit()
+            DBSession.refresh(media)
+            assert media.is_live
+            assert media in Media.query.published().all()
+
+            media.publishable = False
+            DBSession.commit()
+            assert not media.is_live
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
+
+    def test_media_summaries(self):
+        """Summaries should carry the listed columns and an excerpt of the
+        plaintext description, and page like the full media."""
+        from mediacore.lib.paginate import fetch_keyset_page
+        from mediacore.model import Media
+        from mediacore.model.media import MediaSummary, excerpt_length
+        try:
+            media = self._new_publishable_media(u'summary', u'Summary')
+            media.encoded = True
+            media.description = u'<p>%s</p>' % (u'word ' * 100)
+            media.notes = u'Not for listings'
+            DBSession.add(media)
+            DBSession.commit()
+
+            query = Media.query.filter(Media.id == media.id)
+            summary = query.summaries().one()
+            assert isinstance(summary, MediaSummary)
+            assert (summary.id, summary.slug, summary.title) \
+                == (media.id, media.slug, media.title)
+            assert summary.author == media.author
+            assert len(summary.excerpt) == excerpt_length
+            assert media.description_plain.startswith(summary.excerpt)
+            assert not hasattr(summary, 'notes')
+            assert not hasattr(summary, 'description')
+            assert query.summaries().count() == 1
+
+            summary = query.summaries('description').one()
+            assert summary.description == media.description
+
+            latest = Media.query.filter(Media.id >= media.id)\
+                .order_by(Media.publish_on.desc())
+            items, next_cursor, page = \
+                fetch_keyset_page(latest.summaries(), None, 1)
+            assert [i.id for i in items] \
+                == [m.id for m in fetch_keyset_page(latest, None, 1)[0]]
+        except SQLAlchemyError, e:
+            DBSession.rollback()
+            raise e
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pylons
+from mediacore.tests import TestController
+from mediacore.lib.search import InvertedIndexSearchEngine, parse_search
+from mediacore.model import DBSession, Media
+
+class TestInvertedIndexSearch(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.engine = InvertedIndexSearchEngine(
+            os.path.join(self.index_dir, 'index.sqlite'))
+        self.engine.update_index([
+            self._row(1, u'Introduction to Python', tags=u'python, programming'),
+            self._row(2, u'Cooking with Python', notes=u'secret recipe'),
+            self._row(3, u'Advanced Cooking', tags=u'food'),
+        ], [])
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def _row(self, media_id, title, tags=u'', notes=u''):
+        return dict(media_id=media_id, title=title, subtitle=None,
+                    description_plain=u'', notes=notes, author_name=u'x',
+                    tags=tags, categories=u'')
+
+    def _ids(self, search, index='public', bool=False):
+        return [id for id, score in self.engine.rank(search, index, bool)]
+
+    def test_parse_search(self):
+        assert parse_search(u'+a -b c*', bool=True) == ([u'a'], [u'c*'], [u'b'])
+        assert parse_search(u'+a -b c*') == ([], [u'a', u'b', u'c'], [])
+
+    def test_ranking(self):
+        # Python appears twice in the first item's title and tags
+        assert self._ids(u'python') == [1, 2]
+        assert self._ids(u'python cooking')[0] == 2
+
+    def test_boolean_mode(self):
+        assert self._ids(u'+python -cooking', bool=True) == [1]
+        assert self._ids(u'cook*', bool=True) == [2, 3] \
+            or self._ids(u'cook*', bool=True) == [3, 2]
+
+    def test_notes_are_admin_only(self):
+        assert self._ids(u'recipe') == []
+        assert self._ids(u'recipe', index='admin') == [2]
+
+    def test_update_and_delete(self):
+        self.engine.update_index([self._row(1, u'Renamed')], [2])
+        assert self._ids(u'python') == []
+        assert self._ids(u'renamed') == [1]
+
+class TestSearchFilters(TestController):
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_filters_apply_before_the_cap(self):
+        # The drafts rank higher, but only the published media should be
+        # returned, even though just one result is allowed.
+        engine = InvertedIndexSearchEngine(
+            os.path.join(self.index_dir, 'index.sqlite'), max_results=1)
+        rows = []
+        for slug, title, encoded in ((u'draft-1', u'Capped Capped', False),
+                                     (u'draft-2', u'Capped Capped', False),
+                                     (u'published', u'Capped', True)):
+            media = self._new_publishable_media(slug, title)
+            media.encoded = encoded
+            DBSession.add(media)
+            DBSession.flush()
+            rows.append(dict(media_id=media.id, title=title))
+        DBSession.commit()
+        engine.update_index(rows, [])
+
+        query = engine.search(Media.query.published(), u'capped')
+        assert [m.slug for m in query] == [u'published']
+        assert query.count() == 1
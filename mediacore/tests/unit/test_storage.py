@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+from mediacore.tests import *
+from mediacore.lib.storage import LocalS3Storage, LocalStorage
+
+class TestStorage(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_local_delete_keeps_a_copy(self):
+        deleted_dir = os.path.join(self.root, 'deleted')
+        storage = LocalStorage(os.path.join(self.root, 'media'), deleted_dir)
+        storage.store(StringIO('data'), 'a/b.mp4')
+        assert storage.exists('a/b.mp4')
+        storage.delete('a/b.mp4')
+        assert not storage.exists('a/b.mp4')
+        assert os.path.isfile(os.path.join(deleted_dir, 'a', 'b.mp4'))
+
+    def test_multipart_upload(self):
+        storage = LocalS3Storage(self.root, 'media', 'http://example.com/',
+                                 part_size=10, workers=3)
+        part_sizes = {}
+        upload_part = storage._upload_part
+        def record_part(upload_id, number, data):
+            part_sizes[number] = len(data)
+            upload_part(upload_id, number, data)
+        storage._upload_part = record_part
+        data = ''.join(chr(i % 256) for i in xrange(95))
+        url = storage.store(StringIO(data), 'big.mp4')
+        assert sorted(part_sizes.items()) \
+            == [(n, 10) for n in xrange(1, 10)] + [(10, 5)]
+        assert url == 'http://example.com/media/big.mp4'
+        assert storage.name_for_url(url) == 'big.mp4'
+        f = open(os.path.join(self.root, 'media', 'big.mp4'), 'rb')
+        try:
+            assert f.read() == data
+        finally:
+            f.close()
+        assert os.listdir(os.path.join(self.root, '.multipart')) == []
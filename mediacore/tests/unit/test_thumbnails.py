@@ -0,0 +1,27 @@
+from cStringIO import StringIO
+
+from PIL import Image
+
+from mediacore.tests import *
+from mediacore.lib.thumbnails import _draft_size, render_thumbs
+
+class TestThumbnails(TestCase):
+    sizes = {'s': (128, 72), 'm': (160, 90), 'l': (560, 315)}
+
+    def _image(self, format, size=(1600, 1200)):
+        buffer = StringIO()
+        Image.new('RGB', size, (255, 0, 0)).save(buffer, format)
+        buffer.seek(0)
+        return buffer
+
+    def test_draft_size_covers_cropped_thumbs(self):
+        assert _draft_size((1600, 1200), self.sizes.values()) == (560, 420)
+        assert _draft_size((100, 100), self.sizes.values()) == (560, 560)
+
+    def test_render_thumbs(self):
+        for format in ('JPEG', 'PNG'):
+            thumbs = render_thumbs(self._image(format), self.sizes)
+            for key, xy in self.sizes.iteritems():
+                thumb_img = Image.open(StringIO(thumbs[key]))
+                assert thumb_img.format == 'JPEG'
+                assert thumb_img.size == xy
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+
+import pylons
+from mediacore.tests import *
+from mediacore.lib.viewcounter import BufferedViewCounter, JournalViewCounter
+from mediacore.model import DBSession, Media
+
+class TestViewCounter(TestController):
+    def __init__(self, *args, **kwargs):
+        TestController.__init__(self, *args, **kwargs)
+
+        # Initialize pylons.app_globals, for use in main thread.
+        self.response = self.app.get('/_test_vars')
+        pylons.app_globals._push_object(self.response.app_globals)
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.journal_dir)
+
+    def _get_media(self, slug):
+        media = self._new_publishable_media(slug, slug)
+        DBSession.add(media)
+        DBSession.commit()
+        return media.id
+
+    def _views(self, media_id):
+        DBSession.expire_all()
+        return DBSession.query(Media.views).filter(Media.id == media_id).scalar()
+
+    def test_buffered_views_flush_in_one_batch(self):
+        media_id = self._get_media(u'view-counter-buffered')
+        counter = BufferedViewCounter(flush_interval=3600, flush_threshold=5)
+        for x in range(4):
+            counter.increment(media_id)
+        assert self._views(media_id) == 0
+        counter.increment(media_id)
+        assert self._views(media_id) == 5
+
+    def test_journal_replays_dead_process_views(self):
+        media_id = self._get_media(u'view-counter-journal')
+        # Simulate the journal of a worker process that died before
+        # flushing. PIDs are capped well below this on every platform.
+        f = open(os.path.join(self.journal_dir, '4999999.journal'), 'w')
+        f.write('%d 1\n%d 2\n%d' % (media_id, media_id, media_id))
+        f.close()
+        counter = JournalViewCounter(self.journal_dir, flush_interval=3600)
+        counter.increment(media_id)
+        counter.flush()
+        assert self._views(media_id) == 4
+        assert os.listdir(self.journal_dir) == []
@@ -39,11 +39,11 @@ def setup_app(command, conf, vars):
            ``python batch-scripts/upgrade/upgrade_from_v072.py deployment.ini``
            ``python batch-scripts/upgrade/upgrade_from_v080.py deployment.ini``
 
-    XXX: For search to work, we depend on a number of MySQL triggers which
-         copy the data from our InnoDB tables to a MyISAM table for its
-         fulltext indexing capability. Triggers can only be installed with
-         a mysql superuser like root, so you must run the setup_triggers.sql
-         script yourself.
+    XXX: Search depends on the media_fulltext table, which the application
+         keeps up to date as media are edited. If you are upgrading from a
+         version which relied on the setup_triggers.sql script, or search
+         is missing results, rebuild the index with:
+           ``paster fulltext-index deployment.ini``
 
     """
     if pylons.test.pylonsapp:
@@ -167,6 +167,7 @@ def add_default_data():
     podcast.copyright = u'Copyright 2009 Xyz'
     podcast.itunes_url = None
     podcast.feedburner_url = None
+    podcast.thumb_key = u'1'
     DBSession.add(podcast)
 
     comment = Comment()
@@ -188,6 +189,7 @@ def add_default_data():
     media.author = Author(u.display_name, u.email_address)
     media.categories.append(category)
     media.comments.append(comment)
+    media.thumb_key = u'1'
     DBSession.add(media)
 
     import datetime
@@ -226,8 +228,12 @@ def add_default_data():
 
     name = u'MediaCore Team'
     email = u'info@simplestation.com'
+    # The thumbs for these are shipped in public/images/media as 2s.jpg etc
+    thumb_key = 1
     for slug, title, desc, desc_plain, publish_on, duration, url, type, container in instructional_media:
+        thumb_key += 1
         media = Media()
+        media.thumb_key = unicode(thumb_key)
         media.author = Author(name, email)
         media.description = desc
         media.description_plain = desc_plain
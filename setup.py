@@ -11,7 +11,7 @@ install_requires = [
     'WebTest == 1.2',
     'Pylons == 0.10',
     'WebHelpers == 1.0',
-    'SQLAlchemy >= 0.6.3',
+    'SQLAlchemy >= 0.6.5',
     'sqlalchemy-migrate == 0.6',
     'Genshi == 0.6',
     'Routes == 1.12',
@@ -101,6 +101,13 @@ setup(
 
     [paste.app_install]
     main = pylons.util:PylonsInstaller
+
+    [paste.paster_command]
+    fulltext-index = mediacore.lib.commands:FullTextIndexCommand
+    process-jobs = mediacore.lib.commands:ProcessJobsCommand
+    publish-media = mediacore.lib.commands:PublishMediaCommand
+    rank-popularity = mediacore.lib.commands:RankPopularityCommand
+    reconcile-comment-counts = mediacore.lib.commands:ReconcileCommentCountsCommand
     """,
 
     **extra_arguments_for_setup